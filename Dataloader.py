@@ -1,9 +1,12 @@
 import csv
-import pickle
 import numpy as np
 from nltk import word_tokenize
 import numpy.random as rd
 from os import path
+from utils.tokenizer import tokenize_lines
+from utils.Corpus import Corpus
+from utils.Vocab import Vocab, save_word_list, load_word_list
+from utils.BucketSampler import BucketSampler
 
 
 class Dataloader:
@@ -19,10 +22,30 @@ class Dataloader:
         self.preprocess_fn = lambda w, x: x
         self.special_tokens = ['<bos>', '<eos>', '<pad>', '<unk>']
         self.sentiments = None
+        self.sentiment_lines = None
         self.shuffle_lines()
 
-    def set_sentiments(self, sentiments):
+    def set_sentiments(self, sentiments, nthreads=1):
+        """
+        Scores all the sentences once (see `compute_sentiments`), `get(..., with_sentiments=True)` then only slices
+        the scores.
+        :param sentiments: utils.SentimentsSimple
+        :param nthreads: number of processes used to tokenize the dataset if it is not tokenized yet
+        """
         self.sentiments = sentiments
+        self.compute_sentiments(nthreads)
+
+    def compute_sentiments(self, nthreads=1):
+        """
+        Tokenizes the dataset once (`tokenize_dataset`) if needed and scores all its sentences in one vectorized pass
+        (see `SentimentsSimple.corpus_scores`). `sentiment_lines` is an array with the scores of every line, in the
+        format of `get_sentiment`.
+        """
+        first = 1 if self.testing_data else 2
+        if len(self.original_lines) and isinstance(self.original_lines[0][first], str):
+            self.tokenize_dataset(nthreads)
+        corpus = Corpus.from_stories([self.sentiment_sentences(line) for line in self.original_lines])
+        self.sentiment_lines = self.sentiments.corpus_scores(corpus).reshape(len(self.original_lines), -1)
 
     def set_special_tokens(self, tokens):
         self.special_tokens = tokens
@@ -33,6 +56,43 @@ class Dataloader:
     def shuffle_lines(self):
         rd.shuffle(self.lines)
 
+    def bucket_lines(self, batch_size, n_buckets=10):
+        """
+        Reorders the lines so that the batches of `get(k * batch_size, batch_size, random=True)` hold stories of
+        similar lengths (see `utils.BucketSampler`). Replaces `shuffle_lines` between epochs.
+        :param batch_size:
+        :param n_buckets: number of buckets of lengths
+        :return: proportion of padding of the batches
+        """
+        lengths = [[len(sentence) for sentence in self.preprocess(line, no_preprocess=True)]
+                   for line in self.original_lines]
+        sampler = BucketSampler(lengths, batch_size, n_buckets, seed=rd.randint(2 ** 31))
+        batches = sampler.batches()
+        self.lines = np.concatenate(batches).tolist()
+        return sampler.padding_ratio(batches)
+
+    def tokenize_dataset(self, nthreads=1, progress_fn=None):
+        """
+        Tokenizes all the sentences once with `nthreads` processes instead of at every `get`.
+        :param nthreads: number of processes
+        :param progress_fn: callback called with the number of lines tokenized since the last call
+        """
+        first, last = (1, 7) if self.testing_data else (2, 7)
+        sentences = [line[first:last] for line in self.original_lines]
+        tokenized = tokenize_lines(sentences, nthreads, progress_fn=progress_fn)
+        self.original_lines = [line[:first] + tokens + line[last:]
+                               for line, tokens in zip(self.original_lines, tokenized)]
+
+    @staticmethod
+    def tokenize(sentence):
+        """
+        Tokenizes a sentence if `tokenize_dataset` has not already done it.
+        Returns a new list as the batches are padded in place.
+        """
+        if isinstance(sentence, str):
+            return word_tokenize(sentence.lower())
+        return list(sentence)
+
     def __getitem__(self, item):
         if type(item) == slice:
             return self.get(item.start, item.stop - item.start)
@@ -45,31 +105,20 @@ class Dataloader:
         """
         Compute the vocab
         """
-        words = {}
-        for k in range(len(self)):
-            sentences = self.get(k, no_preprocess=True)[0]
-            # We use all words for vocab even those in the resulting sentence
-            for sentence in sentences:
-                for word in sentence:
-                    if word not in self.special_tokens:
-                        if word in words.keys():
-                            words[word] += 1
-                        else:
-                            words[word] = 1
-        self.index_to_word = list(list(zip(*sorted(words.items(), key=lambda w: w[1], reverse=True)))[0])
-        self.index_to_word = [token for token in self.special_tokens] + self.index_to_word
+        # All words are used for vocab even those in the resulting sentence
+        stories = map(lambda line: self.preprocess(line, no_preprocess=True), self.original_lines)
+        self.index_to_word = Vocab().add_stories(stories).index_to_word(self.special_tokens)
         for k, word in enumerate(self.index_to_word):
             self.word_to_index[word] = k
 
     def save_vocab(self, file, size=-1):
         """
-        Save vocab into pickle file
+        Save vocab into a npz file (see `utils.Vocab.save_word_list`)
         :param file: file location
         :param size: size of the vocab. Default: all vocab
         """
         file_path = path.abspath(path.join(path.curdir, file))
-        with open(file_path, 'wb') as file:
-            pickle.dump(self.index_to_word[:size], file)
+        save_word_list(file_path, self.index_to_word[:size])
 
     def load_vocab(self, file, size=-1):
         """
@@ -78,8 +127,7 @@ class Dataloader:
         :param size: size of the vocab. Default: all vocab
         """
         file_path = path.abspath(path.join(path.curdir, file))
-        with open(file_path, 'rb') as file:
-            self.index_to_word = pickle.load(file)[:size]
+        self.index_to_word = load_word_list(file_path)[0][:size]
         for k, word in enumerate(self.index_to_word):
             self.word_to_index[word] = k
 
@@ -103,8 +151,7 @@ class Dataloader:
         if not random:
             batch = list(map(preprocess_fn, self.original_lines[index:ending]))
             if with_sentiments:
-                batch_sentiments = np.array([[i for t in l for i in t] for l in
-                                             list(map(self.get_sentiment, self.original_lines[index:index + number]))])
+                batch_sentiments = self.sentiment_lines[index:index + number]
             max_length = self.unify_batch_length(batch, no_preprocess=no_preprocess)
             if self.testing_data:
                 batch_labels = list(map(preprocess_labels_fn, self.original_lines[index:index + number]))
@@ -118,7 +165,7 @@ class Dataloader:
                 lines.append(self.original_lines[i])
             batch = list(map(preprocess_fn, lines))
             if with_sentiments:
-                batch_sentiments = np.array([[i for t in l for i in t] for l in list(map(self.get_sentiment, lines))])
+                batch_sentiments = self.sentiment_lines[indexes]
             max_length = self.unify_batch_length(batch, no_preprocess=no_preprocess)
             if self.testing_data:
                 batch_labels = list(map(preprocess_labels_fn, lines))
@@ -170,25 +217,25 @@ class Dataloader:
         sentences = line[5:7]
         tokenized_sentences = []
         for sentence in sentences:
-            sentence = sentence.lower()
-            sentence = word_tokenize(sentence)
+            sentence = self.tokenize(sentence)
             if not no_preprocess:
                 sentence = self.preprocess_fn(self.word_to_index, sentence)
             tokenized_sentences.append(sentence)
         right_sentence = int(line[7])
         return tokenized_sentences, right_sentence - 1
 
+    def sentiment_sentences(self, line):
+        """
+        :return: the tokenized sentences of a line scored by `get_sentiment`
+        """
+        sentences = line[1:7] if self.testing_data else line[2:]  # remove the 2 first cols id and title
+        return list(map(self.tokenize, sentences))
+
     def get_sentiment(self, line):
-        if self.testing_data:
-            sentences = line[1:7]
-        else:
-            sentences = line[2:]  # remove the 2 first cols id and title
-        sentiments = []
-        for sentence in sentences:
-            sentence = sentence.lower()
-            sentence = word_tokenize(sentence)
-            sentiments.append(self.sentiments.sentence_score(sentence))
-        return sentiments
+        """
+        Scores of the sentences of one line. The batches use the scores precomputed by `set_sentiments`.
+        """
+        return [self.sentiments.sentence_score(sentence) for sentence in self.sentiment_sentences(line)]
 
     def preprocess(self, line, no_preprocess=False):
         if self.testing_data:
@@ -197,8 +244,7 @@ class Dataloader:
             sentences = line[2:]  # remove the 2 first cols id and title
         tokenized_sentences = []
         for sentence in sentences:
-            sentence = sentence.lower()
-            sentence = word_tokenize(sentence)
+            sentence = self.tokenize(sentence)
             if not no_preprocess:
                 sentence = self.preprocess_fn(self.word_to_index, sentence)
             tokenized_sentences.append(sentence)
@@ -1,29 +1,38 @@
 import os
+import argparse
 from tqdm import tqdm
-from nltk import word_tokenize
 
 from Dataloader import Dataloader
+from utils.tokenizer import tokenize_lines
 
 
-def main():
+def main(nthreads=1):
     dataset_path = os.path.abspath(os.path.join(os.path.curdir, './data/CBTest/data/'))
     export_file = os.path.abspath(os.path.join(os.path.curdir, './data/CBTest/final.txt'))
     for filename in os.listdir(dataset_path):
         if filename[-9:] == 'train.txt':
             with open(os.path.join(dataset_path, filename), 'r') as file:
-                with open(export_file, 'a') as file:
-                    for line in file:
-                        if len(line) > 1 and int(line[:2]) <= 20:
-                            tokenized = word_tokenize(line[2:].lower())
-                            file.write(' '.join(tokenized) + '\n')
+                lines = [[line[2:]] for line in file if len(line) > 1 and int(line[:2]) <= 20]
+            progress_bar = tqdm(total=len(lines))
+            tokenized = tokenize_lines(lines, nthreads, progress_fn=progress_bar.update)
+            progress_bar.close()
+            with open(export_file, 'a') as file:
+                for line in tokenized:
+                    file.write(' '.join(line[0]) + '\n')
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nthreads", '-t', type=int, default=2, help="Number of threads to use")
+    args = parser.parse_args()
     # Add stories to text file to calculate sentence embeddings
     export_file = os.path.abspath(os.path.join(os.path.curdir, '../sent2vec-cython-wrapper/final.txt'))
     training_set = Dataloader('data/train_stories.csv')
     training_set.set_special_tokens(['<pad>', '<unk>'])
     training_set.load_vocab('./default.voc')
+    progress_bar = tqdm(total=len(training_set))
+    training_set.tokenize_dataset(args.nthreads, progress_fn=progress_bar.update)
+    progress_bar.close()
     for k in tqdm(range(len(training_set))):
         sentences = training_set.get(k)[0]
         with open(export_file, 'a') as file:
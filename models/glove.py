@@ -0,0 +1,137 @@
+import os
+import shutil
+import numpy as np
+
+
+def glove_binary_path(glove_path):
+    """
+    Folder of the binary version of a GloVe text file, next to it.
+    """
+    return os.path.splitext(glove_path)[0] + '-binary'
+
+
+def glove_converted(directory):
+    return os.path.isfile(os.path.join(directory, 'words.npy')) and \
+           os.path.isfile(os.path.join(directory, 'vectors.npy'))
+
+
+def convert_glove(glove_path, directory=None):
+    """
+    Converts a GloVe text file to a folder holding:
+    - words.npy: the words of the file (uint8 array, utf-8, one word per line)
+    - vectors.npy: the float32 matrix of the vectors, in the order of the words
+    The lines whose vector does not have the size of the first vector are skipped.
+    :param glove_path: path of the text file
+    :param directory: path of the folder. Default: `glove_binary_path(glove_path)`
+    :return: path of the folder
+    """
+    if directory is None:
+        directory = glove_binary_path(glove_path)
+    n_words, dim = 0, None
+    with open(glove_path, encoding='utf-8') as f:
+        for line in f:
+            if dim is None:
+                dim = len(np.fromstring(line.split(' ', 1)[1], sep=' '))
+            n_words += 1
+
+    # Written in a temporary folder so that other processes never see a partial conversion
+    tmp_directory = directory.rstrip(os.sep) + '.tmp-' + str(os.getpid())
+    os.makedirs(tmp_directory, exist_ok=True)
+    vectors = np.lib.format.open_memmap(os.path.join(tmp_directory, 'vectors.npy'), mode='w+', dtype=np.float32,
+                                        shape=(n_words, dim))
+    words = []
+    with open(glove_path, encoding='utf-8') as f:
+        for line in f:
+            word, vec = line.split(' ', 1)
+            vec = np.fromstring(vec, sep=' ')
+            if len(vec) == dim:
+                vectors[len(words)] = vec
+                words.append(word)
+    vectors.flush()
+    del vectors
+    if len(words) < n_words:
+        # Drops the rows of the skipped lines
+        vectors = np.load(os.path.join(tmp_directory, 'vectors.npy'), mmap_mode='r')[:len(words)]
+        np.save(os.path.join(tmp_directory, 'vectors-kept.npy'), vectors)
+        del vectors
+        os.replace(os.path.join(tmp_directory, 'vectors-kept.npy'), os.path.join(tmp_directory, 'vectors.npy'))
+    np.save(os.path.join(tmp_directory, 'words.npy'),
+            np.frombuffer('\n'.join(words).encode('utf-8'), dtype=np.uint8))
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.rename(tmp_directory, directory)
+    return directory
+
+
+_loaded = {}
+
+
+def load_glove(glove_path):
+    """
+    Opens the binary version of a GloVe text file, converting it the first time.
+    The matrix is opened with `np.memmap`: loading is almost instantaneous and several processes share the same pages.
+    A file is only opened once per process.
+    :param glove_path: path of the text file
+    :return: (words, vectors) the list of the words and the float32 matrix of their vectors
+    """
+    if glove_path in _loaded:
+        return _loaded[glove_path]
+    directory = glove_binary_path(glove_path)
+    if not glove_converted(directory):
+        print('Converting {0} to {1}...'.format(glove_path, directory))
+        convert_glove(glove_path, directory)
+    words = np.load(os.path.join(directory, 'words.npy'), mmap_mode='r')
+    words = bytes(words).decode('utf-8').split('\n') if len(words) else []
+    vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+    _loaded[glove_path] = words, vectors
+    return words, vectors
+
+
+class WordVectors:
+    """
+    Vocabulary of word vectors backed by a word to row index and a matrix (usually the memory-mapped matrix of
+    `load_glove`, shared by all the vocabularies built from it).
+    Behaves like the dictionary word -> vector it replaces, and converts whole sentences to rows at once.
+    """
+
+    def __init__(self, index, vectors):
+        """
+        :param index: dictionary word -> row of the word in vectors
+        :param vectors: float32 matrix
+        """
+        self.index = index
+        self.vectors = vectors
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, word):
+        return word in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __getitem__(self, word):
+        return self.vectors[self.index[word]]
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def update(self, other):
+        """
+        Adds the words of another vocabulary built on the same matrix.
+        """
+        assert other.vectors is self.vectors, 'vocabularies must share the same matrix'
+        self.index.update(other.index)
+
+    def rows(self, words):
+        """
+        :param words: list of words
+        :return: (rows, kept) int64 array of the rows of the words in the vocabulary and bool array of the words in
+            the vocabulary
+        """
+        rows = np.fromiter((self.index.get(word, -1) for word in words), dtype=np.int64, count=len(words))
+        kept = rows >= 0
+        return rows[kept], kept
@@ -12,6 +12,8 @@ import torch
 from torch.autograd import Variable
 import torch.nn as nn
 
+from .glove import load_glove, WordVectors
+
 
 """
 InferSent encoder
@@ -36,10 +38,12 @@ class BLSTMEncoder(nn.Module):
         #return 'cuda' in str(type(self.enc_lstm.bias_hh_l0.data))
         return True
 
-    def forward(self, sent_tuple):
+    def forward(self, sent_tuple, masked=False):
         # sent_len: [max_len, ..., min_len] (bsize)
         # sent: Variable(seqlen x bsize x worddim)
+        # masked: if True, the padding is excluded from the max pooling
         sent, sent_len = sent_tuple
+        lengths = np.asarray(sent_len)
 
         # Sort by length (keep idx)
         sent_len, idx_sort = np.sort(sent_len)[::-1], np.argsort(-sent_len)
@@ -65,6 +69,11 @@ class BLSTMEncoder(nn.Module):
             emb = torch.sum(sent_output, 0).squeeze(0)
             emb = emb / sent_len.expand_as(emb)
         elif self.pool_type == "max":
+            if masked:
+                mask = np.arange(sent_output.size(0))[:, None] >= lengths[None, :]
+                mask = torch.from_numpy(mask.astype(np.uint8)).unsqueeze(2).expand_as(sent_output)
+                mask = mask.cuda() if self.is_cuda() else mask
+                sent_output = sent_output.masked_fill(Variable(mask), -float('inf'))
             emb = torch.max(sent_output, 0)[0]
             if emb.ndimension() == 3:
                 emb = emb.squeeze(0)
@@ -94,12 +103,12 @@ class BLSTMEncoder(nn.Module):
         assert hasattr(self, 'glove_path'), \
                'warning : you need to set_glove_path(glove_path)'
         # create word_vec with glove vectors
-        word_vec = {}
-        with open(self.glove_path) as f:
-            for line in f:
-                word, vec = line.split(' ', 1)
-                if word in word_dict:
-                    word_vec[word] = np.fromstring(vec, sep=' ')
+        words, vectors = load_glove(self.glove_path)
+        index = {}
+        for k, word in enumerate(words):
+            if word in word_dict:
+                index[word] = k
+        word_vec = WordVectors(index, vectors)
         print('Found {0}(/{1}) words with glove vectors'.format(
                     len(word_vec), len(word_dict)))
         return word_vec
@@ -108,21 +117,12 @@ class BLSTMEncoder(nn.Module):
         assert hasattr(self, 'glove_path'), 'warning : you need \
                                              to set_glove_path(glove_path)'
         # create word_vec with k first glove vectors
-        k = 0
-        word_vec = {}
-        with open(self.glove_path) as f:
-            for line in f:
-                word, vec = line.split(' ', 1)
-                if k <= K:
-                    word_vec[word] = np.fromstring(vec, sep=' ')
-                    k += 1
-                if k > K:
-                    if word in ['<s>', '</s>']:
-                        word_vec[word] = np.fromstring(vec, sep=' ')
-
-                if k > K and all([w in word_vec for w in ['<s>', '</s>']]):
-                    break
-        return word_vec
+        words, vectors = load_glove(self.glove_path)
+        index = {word: k for k, word in enumerate(words[:K + 1])}
+        for word in ['<s>', '</s>']:
+            if word not in index and word in words:
+                index[word] = words.index(word, K + 1)
+        return WordVectors(index, vectors)
 
     def build_vocab(self, sentences, tokenize=True):
         assert hasattr(self, 'glove_path'), 'warning : you need \
@@ -156,16 +156,25 @@ class BLSTMEncoder(nn.Module):
         print('New vocab size : {0} (added {1} words)'.format(
                         len(self.word_vec), len(new_word_vec)))
 
-    def get_batch(self, batch):
+    def get_batch(self, batch, out=None):
         # sent in batch in decreasing order of lengths
-        # batch: (bsize, max_len, word_dim)
-        embed = np.zeros((len(batch[0]), len(batch), self.word_emb_dim))
-
-        for i in range(len(batch)):
-            for j in range(len(batch[i])):
-                embed[j, i, :] = self.word_vec[batch[i][j]]
-
-        return torch.FloatTensor(embed)
+        # batch: list of arrays of rows in word_vec
+        # out: float32 buffer of at least max_len * bsize * word_dim values, reused between batches
+        # returns: (max_len, bsize, word_dim)
+        lengths = np.array([len(sent) for sent in batch])
+        shape = (lengths.max(), len(batch), self.word_emb_dim)
+        if out is None:
+            embed = np.zeros(shape, dtype=np.float32)
+        else:
+            embed = out[:np.prod(shape)].reshape(shape)
+            embed.fill(0)
+
+        # one gather for all the words of the batch
+        positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        embed[positions, np.repeat(np.arange(len(batch)), lengths)] = \
+            self.word_vec.vectors[np.concatenate(batch)]
+
+        return torch.from_numpy(embed)
 
     def prepare_samples(self, sentences, bsize, tokenize, verbose):
         if tokenize:
@@ -174,17 +183,18 @@ class BLSTMEncoder(nn.Module):
                      ['<s>']+word_tokenize(s)+['</s>'] for s in sentences]
         n_w = np.sum([len(x) for x in sentences])
 
-        # filters words without glove vectors
-        for i in range(len(sentences)):
-            s_f = [word for word in sentences[i] if word in self.word_vec]
-            if not s_f:
-                import warnings
-                warnings.warn('No words in "{0}" (idx={1}) have glove vectors. \
-                               Replacing by "</s>"..'.format(sentences[i], i))
-                s_f = ['</s>']
-            sentences[i] = s_f
-
-        lengths = np.array([len(s) for s in sentences])
+        # filters words without glove vectors, for all the sentences at once
+        rows, kept = self.word_vec.rows([word for s in sentences for word in s])
+        starts = np.cumsum([0] + [len(s) for s in sentences[:-1]])
+        lengths = np.add.reduceat(kept.astype(np.int64), starts) if len(kept) else np.zeros(0, dtype=np.int64)
+        rows = np.split(rows, np.cumsum(lengths)[:-1])
+        for i in np.flatnonzero(lengths == 0):
+            import warnings
+            warnings.warn('No words in "{0}" (idx={1}) have glove vectors. \
+                           Replacing by "</s>"..'.format(sentences[i], i))
+            rows[i] = np.array([self.word_vec.index['</s>']])
+            lengths[i] = 1
+
         n_wk = np.sum(lengths)
         #if verbose:
             #print('Nb words kept : {0}/{1} ({2} %)'.format(
@@ -192,29 +202,36 @@ class BLSTMEncoder(nn.Module):
 
         # sort by decreasing length
         lengths, idx_sort = np.sort(lengths)[::-1], np.argsort(-lengths)
-        sentences = np.array(sentences)[idx_sort]
+        sentences = [rows[k] for k in idx_sort]
 
         return sentences, lengths, idx_sort
 
-    def encode(self, sentences, bsize=64, tokenize=True, verbose=False):
-        tic = time.time()
-        sentences, lengths, idx_sort = self.prepare_samples(
-                        sentences, bsize, tokenize, verbose)
-
-        embeddings = []
+    def encode_sorted(self, sentences, lengths, idx_sort, bsize, masked=False):
+        # sentences, lengths, idx_sort: outputs of prepare_samples
+        # returns the embeddings in the original order of the sentences
+        # buffers reused by all the batches
+        buffer = np.empty(lengths[0] * min(bsize, len(sentences)) * self.word_emb_dim,
+                          dtype=np.float32)
+        embeddings = None
         for stidx in range(0, len(sentences), bsize):
             batch = Variable(self.get_batch(
-                        sentences[stidx:stidx + bsize]), volatile=True)
+                        sentences[stidx:stidx + bsize], buffer), volatile=True)
             if self.is_cuda():
                 batch = batch.cuda()
             batch = self.forward(
-                (batch, lengths[stidx:stidx + bsize])).data.cpu().numpy()
-            embeddings.append(batch)
-        embeddings = np.vstack(embeddings)
+                (batch, lengths[stidx:stidx + bsize]), masked).data.cpu().numpy()
+            if embeddings is None:
+                embeddings = np.empty((len(sentences), batch.shape[1]), dtype=batch.dtype)
+            # unsort
+            embeddings[idx_sort[stidx:stidx + bsize]] = batch
+        return embeddings
 
-        # unsort
-        idx_unsort = np.argsort(idx_sort)
-        embeddings = embeddings[idx_unsort]
+    def encode(self, sentences, bsize=64, tokenize=True, verbose=False):
+        tic = time.time()
+        sentences, lengths, idx_sort = self.prepare_samples(
+                        sentences, bsize, tokenize, verbose)
+
+        embeddings = self.encode_sorted(sentences, lengths, idx_sort, bsize)
 
         #if verbose:
             #print('Speed : {0} sentences/s ({1} mode, bsize={2})'.format(
@@ -222,6 +239,30 @@ class BLSTMEncoder(nn.Module):
             #        'gpu' if self.is_cuda() else 'cpu', bsize))
         return embeddings
 
+    def encode_groups(self, groups, bsize=1024, tokenize=True, verbose=False):
+        """
+        Encodes several groups of sentences (e.g. the sentences of every story of a batch) with one call to the
+        encoder. Only for max pooling: the embeddings are then the same as calling `encode` on every group, a sentence
+        shorter than the longest sentence of its group being also pooled over the zero padding of the group.
+        :param groups: list of non empty lists of sentences (strings)
+        :param bsize: number of sentences given to the encoder at once
+        :return: list of the embedding matrices of the groups
+        """
+        assert self.pool_type == "max", "encode_groups only gives the embeddings of encode with max pooling."
+        sizes = [len(group) for group in groups]
+        offsets = np.cumsum([0] + sizes)
+        sentences, lengths, idx_sort = self.prepare_samples(
+                        [sentence for group in groups for sentence in group], bsize, tokenize, verbose)
+
+        embeddings = self.encode_sorted(sentences, lengths, idx_sort, bsize, masked=True)
+
+        # zero padding seen by the sentences in the batch of their group
+        sentence_lengths = np.empty_like(lengths)
+        sentence_lengths[idx_sort] = lengths
+        padded = sentence_lengths < np.repeat(np.maximum.reduceat(sentence_lengths, offsets[:-1]), sizes)
+        embeddings[padded] = np.maximum(embeddings[padded], 0)
+        return np.split(embeddings, offsets[1:-1])
+
     def visualize(self, sent, tokenize=True):
         if tokenize:
             from nltk.tokenize import word_tokenize
@@ -234,7 +275,7 @@ class BLSTMEncoder(nn.Module):
             import warnings
             warnings.warn('No words in "{0}" have glove vectors. Replacing \
                            by "<s> </s>"..'.format(sent))
-        batch = Variable(self.get_batch(sent), volatile=True)
+        batch = Variable(self.get_batch([self.word_vec.rows(sent[0])[0]]), volatile=True)
 
         if self.is_cuda():
             batch = batch.cuda()
@@ -82,10 +82,11 @@ class Scheduler:
 
 
 def scheduler_preprocess(word_to_index, sentence):
-    sentence = list(map(lambda word: word if word in word_to_index.keys() else '<unk>', sentence))
-    # replace words by tokens
-    sentence = list(map(lambda word: word_to_index[word], sentence))
-    return sentence
+    """
+    Replaces words by tokens. Prefer `Dataloader.compute_token_ids` which does it for the whole dataset at once.
+    """
+    unk = word_to_index['<unk>']
+    return [word_to_index.get(word, unk) for word in sentence]
 
 
 def scheduler_get_labels(batch):
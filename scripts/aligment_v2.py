@@ -1,5 +1,5 @@
 import datetime
-from utils import Dataloader
+from utils import Dataloader, EncoderCache, add_noise
 from scripts import DefaultScript
 import numpy as np
 from torch.autograd import Variable
@@ -21,7 +21,7 @@ class Script(DefaultScript):
     def train(self):
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         writer = tf.summary.FileWriter('./logs/' + timestamp + '-concept-fb/')
-        output_fn = OutputFN(self.config.GLOVE_PATH, self.config.model_path)
+        output_fn = OutputFN(self.config.GLOVE_PATH, self.config.model_path, self.config)
         train_set = Dataloader(self.config, 'data/train_stories.csv')
         test_set = Dataloader(self.config, 'data/test_stories.csv', testing_data=True)
         train_set.set_special_tokens(["<unk>"])
@@ -298,7 +298,7 @@ class Script(DefaultScript):
 
 class OutputFN:
 
-    def __init__(self, GLOVE_PATH, model_path):
+    def __init__(self, GLOVE_PATH, model_path, config):
         self.GLOVE_PATH = GLOVE_PATH
         if USE_CUDA:
             self.model = torch.load(model_path)
@@ -306,30 +306,26 @@ class OutputFN:
             self.model=torch.load(model_path, map_location=lambda storage, loc: storage)
         self.model.set_glove_path(self.GLOVE_PATH)
         self.model.build_vocab_k_words(K=100000)
+        self.cache = EncoderCache.from_config(self.model.encode_groups, config)
 
     def __call__(self, data):
         batch = np.array(data.batch)
-        all_histoire_debut_embedding = []
-        all_histoire_fin_embedding = []
-        all_histoire_noise_debut = []
-        all_histoire_noise_fin = []
-        for b in batch:
-            histoire_debut = np.array([
-                b[3]])
-            histoire_noise_debut = self.add_noise(histoire_debut)
-            histoire_embedding_debut = self.infersent(histoire_debut)
-            histoire_embedding_noise_debut = self.infersent(histoire_noise_debut)
-            histoire_fin = np.array([
-                b[4]])
-            histoire_noise_fin = self.add_noise(histoire_fin)
-            histoire_embedding_fin = self.infersent(histoire_fin)
-            histoire_embedding_noise_fin = self.infersent(histoire_noise_fin)
-            all_histoire_debut_embedding.append(histoire_embedding_debut)
-            all_histoire_fin_embedding.append(histoire_embedding_fin)
-            all_histoire_noise_debut.append(histoire_embedding_noise_debut)
-            all_histoire_noise_fin.append(histoire_embedding_noise_fin)
-        return [np.array(all_histoire_debut_embedding), np.array(all_histoire_fin_embedding),
-                np.array(all_histoire_noise_debut), np.array(all_histoire_noise_fin)]
+        histoires_debut = [np.array([
+            b[3]]) for b in batch]
+        histoires_fin = [np.array([
+            b[4]]) for b in batch]
+        # The noise is added to all the sentences of the batch at once
+        noise = add_noise([sto for histoire in histoires_debut + histoires_fin for sto in histoire])
+        noise_debut, noise_fin = noise[:1 * len(batch)], noise[1 * len(batch):]
+        stories = []
+        for k in range(len(batch)):
+            histoire_noise_debut = noise_debut[k:k + 1]
+            histoire_noise_fin = noise_fin[k:k + 1]
+            stories.extend([histoires_debut[k], histoire_noise_debut, histoires_fin[k], histoire_noise_fin])
+        # All the sentences of the batch are encoded at once
+        embeddings = self.infersent_stories(stories)
+        return [np.array(embeddings[0::4]), np.array(embeddings[2::4]),
+                np.array(embeddings[1::4]), np.array(embeddings[3::4])]
 
     def infersent(self, story):
         """
@@ -343,61 +339,39 @@ class OutputFN:
         embeddings = self.model.encode(sentences, tokenize=True, verbose=True)
         return (embeddings)
 
+    def infersent_stories(self, stories, cached=False):
+        """
+        Same as calling `infersent` on every story, with one call to the encoder
+        :param stories: list of stories
+        :param cached: if True, the embeddings of the stories are memoized
+        :return: list of the embeddings of every story
+        """
+        groups = [[' '.join(sto) for sto in story] for story in stories]
+        if cached:
+            return self.cache.encode_groups(groups)
+        return self.model.encode_groups(groups, tokenize=True, verbose=True)
+
     def output_fn_test(self, data):
         """
         :param data:
         :return:
         """
         batch = np.array(data.batch)
-        all_histoire_debut_embedding = []
-        all_histoire_fin_embedding1 = []
-        all_histoire_fin_embedding2 = []
+        stories = []
         label = []
         for b in batch:
             histoire_debut = np.array([
                 b[3]])
-            histoire_embedding_debut = self.infersent(histoire_debut)
-            all_histoire_debut_embedding.append(histoire_embedding_debut)
             histoire_fin1 = np.array([
                 b[4]])
             histoire_fin2 = np.array([
                 b[5]])
-            histoire_embedding_fin1 = self.infersent(histoire_fin1)
-            all_histoire_fin_embedding1.append(histoire_embedding_fin1)
-            histoire_embedding_fin2 = self.infersent(histoire_fin2)
-            all_histoire_fin_embedding2.append(histoire_embedding_fin2)
+            stories.extend([histoire_debut, histoire_fin1, histoire_fin2])
             label.append(2 - int(b[6][0]))
-        return [np.array(all_histoire_debut_embedding), np.array(all_histoire_fin_embedding1),
-                np.array(all_histoire_fin_embedding2), np.array(label)]
-
-    def add_noise(self, variable, drop_probability: float = 0.1, shuffle_max_distance: int = 3):
-        """
-        :param variable:np array that : [[sentence1][sentence2]]
-        :param drop_probability: we drop every word in the input sentence with a probability
-        :param shuffle_max_distance: we slightly shuffle the input sentence
-        :return:
-        """
-
-        def perm(i):
-            return i[0] + (shuffle_max_distance + 1) * np.random.random()
-
-        liste = []
-        for b in range(variable.shape[0]):
-            sequence = variable[b]
-            if (type(sequence) != list):
-                sequence = sequence.tolist()
-            sequence, reminder = sequence[:-1], sequence[-1:]
-            if len(sequence) != 0:
-                compteur = 0
-                for num, val in enumerate(np.random.random_sample(len(sequence))):
-                    if val < drop_probability:
-                        sequence.pop(num - compteur)
-                        compteur = compteur + 1
-                sequence = [x for _, x in sorted(enumerate(sequence), key=perm)]
-            sequence = np.concatenate((sequence, reminder), axis=0)
-            liste.append(sequence)
-        new_variable = np.array(liste)
-        return new_variable
+        # The test stories are the same at every epoch
+        embeddings = self.infersent_stories(stories, cached=True)
+        return [np.array(embeddings[0::3]), np.array(embeddings[1::3]),
+                np.array(embeddings[2::3]), np.array(label)]
 
 
 
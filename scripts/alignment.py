@@ -10,7 +10,7 @@ import numpy as np
 from keras.models import Model
 from keras.layers import Input, Dense, Dropout, LeakyReLU, BatchNormalization, Lambda
 
-from utils import Dataloader
+from utils import Dataloader, EncoderCache
 from scripts import DefaultScript
 
 
@@ -70,6 +70,7 @@ class Script(DefaultScript):
         assert self.config.sent2vec.model is not None, "Please add sent2vec_model config value."
         self.sent2vec_model = sent2vec.Sent2vecModel()
         self.sent2vec_model.load_model(self.config.sent2vec.model)
+        self.sent2vec_model = EncoderCache.from_config(self.sent2vec_model.embed_sentences, self.config)
 
         # Initialize tensorflow session
         sess = tf.Session()
@@ -0,0 +1,50 @@
+import os
+import time
+from utils import Dataloader, AnnIndex, sent2vec_store
+from scripts import DefaultScript
+
+
+class Script(DefaultScript):
+
+    slug = 'ann_index'
+
+    def train(self):
+        """
+        Builds the index of the sent2vec embeddings of the training endings, the ids being the indexes of the stories.
+        """
+        training_set = Dataloader(self.config)
+        training_set.load_dataset('./data/train.bin')
+        sent2vec_store(self.config, [training_set])
+
+        endings = training_set.get_sentences(slice(0, len(training_set)), 4)
+        if self.config.debug:
+            print('Building the index of', len(endings), 'endings...')
+        tic = time.time()
+        n_lists = self.config.ann.n_lists if self.config.ann.is_set('n_lists') else None
+        index = AnnIndex.build(endings, n_lists=n_lists, seed=0)
+        index.save(index_path(self.config))
+        if self.config.debug:
+            print('Built in {0:.1f}s ({1} lists).'.format(time.time() - tic, len(index.centroids)))
+
+    def test(self):
+        """
+        Recall vs latency of the index compared to brute-force search, the queries being the last sentences of the
+        contexts of the testing set.
+        """
+        testing_set = Dataloader(self.config, testing_data=True)
+        testing_set.load_dataset('data/test.bin')
+        sent2vec_store(self.config, [testing_set])
+
+        index = AnnIndex.load(index_path(self.config))
+        queries = testing_set.get_sentences(slice(0, len(testing_set)), 3)
+        k = self.config.ann.k if self.config.ann.is_set('k') else 10
+        print('{0} endings, {1} lists, {2} queries, k={3}'.format(len(index), len(index.centroids), len(queries), k))
+        print('n_probe   recall   ms/query')
+        for result in index.benchmark(queries, k):
+            n_probe = 'exact' if result['n_probe'] is None else result['n_probe']
+            print('{0:>7}   {1:.4f}   {2:.3f}'.format(n_probe, result['recall'], result['ms']))
+
+
+def index_path(config):
+    assert config.ann.is_set('index') and config.ann.index is not None, "Please add ann.index config value."
+    return os.path.abspath(os.path.join(os.curdir, config.ann.index))
@@ -206,7 +206,7 @@ def model(sess, config):
 
 
 def main(config):
-    train_set = SNLIDataloader('data/snli_1.0/snli_1.0_train.jsonl')
+    train_set = SNLIDataloader('data/snli_1.0/snli_1.0_train.jsonl', nthreads=config.nthreads)
     train_set.set_preprocess_fn(preprocess_fn)
     train_set.set_output_fn(output_fn)
     dev_set = Dataloader(config, 'data/test_stories.csv', testing_data=True)
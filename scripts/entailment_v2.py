@@ -15,7 +15,7 @@ import keras
 import numpy as np
 from utils import SNLIDataloader
 from nltk import word_tokenize
-from utils import Dataloader
+from utils import Dataloader, EncoderCache
 from scripts import DefaultScript
 
 
@@ -111,9 +111,9 @@ def main(config):
 
     preprocess_fn = Preprocess(sent2vec_model)
 
-    output_fn_test = OutputFnTest(sent2vec_model, config)
+    output_fn_test = OutputFnTest(EncoderCache.from_config(sent2vec_model.embed_sentences, config), config)
 
-    train_set = SNLIDataloader('data/snli_1.0/snli_1.0_train.jsonl')
+    train_set = SNLIDataloader('data/snli_1.0/snli_1.0_train.jsonl', nthreads=config.nthreads)
     train_set.set_preprocess_fn(preprocess_fn)
     train_set.set_output_fn(output_fn)
 
@@ -160,7 +160,7 @@ def test(config):
     sent2vec_model = sent2vec.Sent2vecModel()
     sent2vec_model.load_model(config.sent2vec.model)
 
-    output_fn_test = OutputFnTest(sent2vec_model, config)
+    output_fn_test = OutputFnTest(EncoderCache.from_config(sent2vec_model.embed_sentences, config), config)
 
     test_set = Dataloader(config, 'data/test_stories.csv', testing_data=True)
     test_set.load_dataset('data/test.bin')
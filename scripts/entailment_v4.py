@@ -18,7 +18,7 @@ from keras import backend as K
 import tensorflow as tf
 import tensorflow_hub as hub
 import numpy as np
-from utils import SNLIDataloader, Dataloader
+from utils import SNLIDataloader, Dataloader, EncoderCache, hub_precompute, hub_store, elmo_sentences
 from nltk import word_tokenize
 from scripts import DefaultScript
 
@@ -169,18 +169,25 @@ def main(config):
                 'elmo_embeddings': elmo_emb_fn
             })
 
-    output_fn = OutputFN(elmo_model_emb, type_translation_model, graph)
-    output_fn_test = OutputFNTest(elmo_model_emb, type_translation_model, graph)
     train_set = Dataloader(config, 'data/train_stories.csv')
     # test_set.set_preprocess_fn(preprocess_fn)
     train_set.load_dataset('data/train.bin')
     train_set.load_vocab('./data/default.voc', config.vocab_size)
-    train_set.set_output_fn(output_fn)
 
     test_set = Dataloader(config, 'data/test_stories.csv', testing_data=True)
     # test_set.set_preprocess_fn(preprocess_fn)
     test_set.load_dataset('data/test.bin')
     test_set.load_vocab('./data/default.voc', config.vocab_size)
+
+    if hub_precompute(config):
+        # The output functions read the ELMo embeddings from the store instead of running the module at every batch
+        elmo_model_emb = hub_store(config, elmo_sentences(train_set, test_set), 'elmo')
+    else:
+        # The sentences seen again at every epoch are only embedded once
+        elmo_model_emb = EncoderCache.from_config(elmo_model_emb.predict, config, min_batch_size=2)
+    output_fn = OutputFN(elmo_model_emb, type_translation_model, graph)
+    output_fn_test = OutputFNTest(elmo_model_emb, type_translation_model, graph)
+    train_set.set_output_fn(output_fn)
     test_set.set_output_fn(output_fn_test)
 
     generator_training = train_set.get_batch(config.batch_size, config.n_epochs)
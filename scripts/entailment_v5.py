@@ -15,7 +15,7 @@ import keras
 import numpy as np
 from utils import SNLIDataloaderPairs
 from nltk import word_tokenize
-from utils import Dataloader
+from utils import Dataloader, EncoderCache
 from scripts import DefaultScript
 
 
@@ -115,9 +115,9 @@ def main(config):
 
     preprocess_fn = Preprocess(sent2vec_model)
 
-    output_fn_test = OutputFnTest(sent2vec_model, config)
+    output_fn_test = OutputFnTest(EncoderCache.from_config(sent2vec_model.embed_sentences, config), config)
 
-    train_set = SNLIDataloaderPairs('data/snli_1.0/snli_1.0_train.jsonl')
+    train_set = SNLIDataloaderPairs('data/snli_1.0/snli_1.0_train.jsonl', nthreads=config.nthreads)
     train_set.set_preprocess_fn(preprocess_fn)
     train_set.set_output_fn(output_fn)
 
@@ -15,7 +15,7 @@ import keras
 import numpy as np
 from utils import SNLIDataloaderPairs
 from nltk import word_tokenize
-from utils import Dataloader
+from utils import Dataloader, sent2vec_store
 from scripts import DefaultScript
 
 
@@ -31,24 +31,18 @@ class Script(DefaultScript):
 
 
 class OutputFnTest:
-    def __init__(self, sent2vec, config):
-        self.sent2vec = sent2vec
+    def __init__(self, config):
         self.config = config
 
     def __call__(self, data):
+        # Sentences embedded with sent2vec (see `utils.EmbeddingStore`)
         batch = data.batch
-        sentence_batch = []
-        ending_1 = []
-        ending_2 = []
-        for b in range(len(batch)):
-            # sentence = batch[b][0] + ' ' + batch[b][1] + ' ' + batch[b][2] + ' ' + batch[b][3]
-            sentence = " ".join(batch[b][3])
-            sentence_batch.append(self.sent2vec.embed_sentence(sentence))
-            ending_1.append(self.sent2vec.embed_sentence(" ".join(batch[b][4])))
-            ending_2.append(self.sent2vec.embed_sentence(" ".join(batch[b][5])))
+        sentence_batch = batch[:, 3]
+        ending_1 = batch[:, 4]
+        ending_2 = batch[:, 5]
         correct_ending = data.label
         label = np.array(correct_ending) - 1
-        return [np.array(sentence_batch), np.array(ending_1), np.array(ending_2)], np.array(label)
+        return [sentence_batch, ending_1, ending_2], np.array(label)
 
 
 def model(config):
@@ -75,12 +69,7 @@ def model(config):
 
 
 def main(config):
-    import sent2vec
-    assert config.sent2vec.model is not None, "Please add sent2vec_model config value."
-    sent2vec_model = sent2vec.Sent2vecModel()
-    sent2vec_model.load_model(config.sent2vec.model)
-
-    output_fn_test = OutputFnTest(sent2vec_model, config)
+    output_fn_test = OutputFnTest(config)
 
     train_set = Dataloader(config, 'data/dev_stories.csv', testing_data=True)
     train_set.load_dataset('data/dev.bin')
@@ -91,6 +80,7 @@ def main(config):
     test_set.load_dataset('data/test.bin')
     test_set.load_vocab('./data/default.voc', config.vocab_size)
     test_set.set_output_fn(output_fn_test)
+    sent2vec_store(config, [train_set, test_set])
     # dev_set = SNLIDataloader('data/snli_1.0/snli_1.0_dev.jsonl')
     # dev_set.set_preprocess_fn(preprocess_fn)
     # dev_set.set_output_fn(output_fn)
@@ -125,17 +115,13 @@ def main(config):
 
 
 def test(config):
-    import sent2vec
-    assert config.sent2vec.model is not None, "Please add sent2vec_model config value."
-    sent2vec_model = sent2vec.Sent2vecModel()
-    sent2vec_model.load_model(config.sent2vec.model)
-
-    output_fn_test = OutputFnTest(sent2vec_model, config)
+    output_fn_test = OutputFnTest(config)
 
     test_set = Dataloader(config, 'data/test_stories.csv', testing_data=True)
     test_set.load_dataset('data/test.bin')
     test_set.load_vocab('./data/default.voc', config.vocab_size)
     test_set.set_output_fn(output_fn_test)
+    sent2vec_store(config, [test_set])
 
     generator_testing = test_set.get_batch(config.batch_size, config.n_epochs, random=True)
 
@@ -27,7 +27,7 @@ class Script(DefaultScript):
     slug = 'preprocess_files'
 
     def train(self):
-        train_set = SNLIDataloaderPairs('data/snli_1.0/snli_1.0_train.jsonl')
+        train_set = SNLIDataloaderPairs('data/snli_1.0/snli_1.0_train.jsonl', nthreads=self.config.nthreads)
         train_set.load_vocab('./data/snli_vocab.dat', self.config.vocab_size)
         train_set.set_preprocess_fn(preprocess_fn)
         train_set.set_output_fn(output_fn)
@@ -8,7 +8,7 @@ import os
 import tensorflow_hub as hub
 import tensorflow as tf
 from scripts import DefaultScript
-from utils import Dataloader
+from utils import Dataloader, EmbeddedOutputFn, embedding_types, hub_precompute, hub_store
 
 
 class ElmoEmbedding:
@@ -97,6 +97,11 @@ class Script(DefaultScript):
         test_set.load_vocab('./data/default.voc', self.config.vocab_size)
         test_set.set_output_fn(output_fn_test)
         train_set.set_output_fn(output_fn)
+        if hub_precompute(self.config):
+            # The hub module is run once over all the sentences instead of at every batch
+            store = hub_store(self.config, list(train_set.sentences()) + list(test_set.sentences()))
+            test_set.set_output_fn(EmbeddedOutputFn(output_fn_test, store))
+            train_set.set_output_fn(EmbeddedOutputFn(output_fn, store))
 
         generator_training = train_set.get_batch(self.config.batch_size, self.config.n_epochs)
         generator_dev = test_set.get_batch(self.config.batch_size, self.config.n_epochs)
@@ -134,37 +139,33 @@ class Script(DefaultScript):
         pass
 
     def build_graph(self, sess):
-        if self.config.debug:
-            print('Importing Elmo/USE module...')
-        if self.config.hub.is_set("cache_dir"):
-            os.environ['TFHUB_CACHE_DIR'] = self.config.hub.cache_dir
-
-        embedding_types = {
-            "elmo": {
-                "name": "elmo",
-                "url": "https://tfhub.dev/google/elmo/1",
-                "size": 1024
-            },
-            "use": {
-                "name": "use",
-                "url": "https://tfhub.dev/google/universal-sentence-encoder/1",
-                "size": 512
-            }
-        }[self.config.embedding_type]
-        elmo_model = hub.Module(embedding_types['url'], trainable=True)
-
-        if self.config.debug:
-            print('Imported.')
-        sess.run(tf.global_variables_initializer())
-        sess.run(tf.tables_initializer())
-
-        elmo_embeddings = keras.layers.Lambda(ElmoEmbedding(elmo_model, embedding_types), output_shape=(embedding_types['size'],))
-
-        sentence1 = keras.layers.Input(shape=(1,), dtype="string")
-        sentence2 = keras.layers.Input(shape=(1,), dtype="string")
-        sentence3 = keras.layers.Input(shape=(1,), dtype="string")
-        sentence4 = keras.layers.Input(shape=(1,), dtype="string")
-        sentence5 = keras.layers.Input(shape=(1,), dtype="string")
+        embedding_type = embedding_types[self.config.embedding_type]
+        if hub_precompute(self.config):
+            # The output functions give the embeddings read from the store
+            sentence_input = lambda: keras.layers.Input(shape=(embedding_type['size'],))
+            elmo_embeddings = lambda x: x
+        else:
+            if self.config.debug:
+                print('Importing Elmo/USE module...')
+            if self.config.hub.is_set("cache_dir"):
+                os.environ['TFHUB_CACHE_DIR'] = self.config.hub.cache_dir
+
+            elmo_model = hub.Module(embedding_type['url'], trainable=True)
+
+            if self.config.debug:
+                print('Imported.')
+            sess.run(tf.global_variables_initializer())
+            sess.run(tf.tables_initializer())
+
+            sentence_input = lambda: keras.layers.Input(shape=(1,), dtype="string")
+            elmo_embeddings = keras.layers.Lambda(ElmoEmbedding(elmo_model, embedding_type),
+                                                  output_shape=(embedding_type['size'],))
+
+        sentence1 = sentence_input()
+        sentence2 = sentence_input()
+        sentence3 = sentence_input()
+        sentence4 = sentence_input()
+        sentence5 = sentence_input()
 
         sentence1_emb = elmo_embeddings(sentence1)
         sentence2_emb = elmo_embeddings(sentence2)
@@ -8,7 +8,7 @@ import os
 import tensorflow_hub as hub
 import tensorflow as tf
 from scripts import DefaultScript
-from utils import Dataloader
+from utils import Dataloader, EmbeddedOutputFn, embedding_types, hub_precompute, hub_store
 
 
 class ElmoEmbedding:
@@ -33,7 +33,9 @@ def output_fn(data):
     sentences4 = []
     sentences5 = []
     label = []
-    for b in batch:
+    # Endings of random stories for the whole batch
+    random_endings = data.dataloader.negative_sampler().sample(n=len(batch))
+    for b, random_ending in zip(batch, random_endings):
         sentences1.append(" ".join(b[0]))
         sentences2.append(" ".join(b[1]))
         sentences3.append(" ".join(b[2]))
@@ -42,10 +44,8 @@ def output_fn(data):
             sentences5.append(" ".join(b[4]))
             label.append(1)
         else:
-            k = random.randint(0, len(data.dataloader))
-            random_story = data.dataloader.get(k, 1, raw=True).batch[0]
-            sentences5.append(" ".join(random_story[4]))
-            if random_story[4] == b[4]:
+            sentences5.append(" ".join(random_ending))
+            if list(random_ending) == list(b[4]):
                 label.append(1)
             else:
                 label.append(0)
@@ -88,6 +88,11 @@ class Script(DefaultScript):
         test_set.load_vocab('./data/default.voc', self.config.vocab_size)
         test_set.set_output_fn(output_fn_test)
         train_set.set_output_fn(output_fn)
+        if hub_precompute(self.config):
+            # The hub module is run once over all the sentences instead of at every batch
+            store = hub_store(self.config, list(train_set.sentences()) + list(test_set.sentences()))
+            test_set.set_output_fn(EmbeddedOutputFn(output_fn_test, store))
+            train_set.set_output_fn(EmbeddedOutputFn(output_fn, store))
 
         generator_training = train_set.get_batch(self.config.batch_size, self.config.n_epochs)
         generator_dev = test_set.get_batch(self.config.batch_size, self.config.n_epochs)
@@ -125,37 +130,33 @@ class Script(DefaultScript):
         pass
 
     def build_graph(self, sess):
-        if self.config.debug:
-            print('Importing Elmo/USE module...')
-        if self.config.hub.is_set("cache_dir"):
-            os.environ['TFHUB_CACHE_DIR'] = self.config.hub.cache_dir
-
-        embedding_types = {
-            "elmo": {
-                "name": "elmo",
-                "url": "https://tfhub.dev/google/elmo/1",
-                "size": 1024
-            },
-            "use": {
-                "name": "use",
-                "url": "https://tfhub.dev/google/universal-sentence-encoder/1",
-                "size": 512
-            }
-        }[self.config.embedding_type]
-        elmo_model = hub.Module(embedding_types['url'], trainable=True)
-
-        if self.config.debug:
-            print('Imported.')
-        sess.run(tf.global_variables_initializer())
-        sess.run(tf.tables_initializer())
-
-        elmo_embeddings = keras.layers.Lambda(ElmoEmbedding(elmo_model, embedding_types), output_shape=(embedding_types['size'],))
-
-        sentence1 = keras.layers.Input(shape=(1,), dtype="string")
-        sentence2 = keras.layers.Input(shape=(1,), dtype="string")
-        sentence3 = keras.layers.Input(shape=(1,), dtype="string")
-        sentence4 = keras.layers.Input(shape=(1,), dtype="string")
-        sentence5 = keras.layers.Input(shape=(1,), dtype="string")
+        embedding_type = embedding_types[self.config.embedding_type]
+        if hub_precompute(self.config):
+            # The output functions give the embeddings read from the store
+            sentence_input = lambda: keras.layers.Input(shape=(embedding_type['size'],))
+            elmo_embeddings = lambda x: x
+        else:
+            if self.config.debug:
+                print('Importing Elmo/USE module...')
+            if self.config.hub.is_set("cache_dir"):
+                os.environ['TFHUB_CACHE_DIR'] = self.config.hub.cache_dir
+
+            elmo_model = hub.Module(embedding_type['url'], trainable=True)
+
+            if self.config.debug:
+                print('Imported.')
+            sess.run(tf.global_variables_initializer())
+            sess.run(tf.tables_initializer())
+
+            sentence_input = lambda: keras.layers.Input(shape=(1,), dtype="string")
+            elmo_embeddings = keras.layers.Lambda(ElmoEmbedding(elmo_model, embedding_type),
+                                                  output_shape=(embedding_type['size'],))
+
+        sentence1 = sentence_input()
+        sentence2 = sentence_input()
+        sentence3 = sentence_input()
+        sentence4 = sentence_input()
+        sentence5 = sentence_input()
 
         sentence1_emb = elmo_embeddings(sentence1)
         sentence2_emb = elmo_embeddings(sentence2)
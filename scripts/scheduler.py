@@ -1,9 +1,8 @@
 import os
-import random
 import datetime
 import keras
 import numpy as np
-from utils import Dataloader
+from utils import Dataloader, Prefetcher, sent2vec_store
 from scripts import DefaultScript
 
 
@@ -23,20 +22,8 @@ class Script(DefaultScript):
         main(self.config, training_set, testing_set)
 
 
-class Preprocess:
-    """
-    Preprocess to apply to the dataset
-    """
-
-    def __init__(self, sent2vec_model):
-        self.sent2vec_model = sent2vec_model
-
-    def __call__(self, word_to_index, sentence):
-        sentence = self.sent2vec_model.embed_sentence(' '.join(sentence))
-        return sentence
-
-
-def output_fn_train(data):
+def output_fn_train(data, random_state=None):
+    random_state = np.random if random_state is None else random_state
     batch = np.array(data.batch)
     beggining = batch[:, 0, :]
     middle = batch[:, 1:4, :].reshape(len(batch), -1)
@@ -47,7 +34,7 @@ def output_fn_train(data):
     end_sentiment = sentiments[:, 4]
     label = []
     for i in range(len(batch)):
-        if random.random() > 0.5:
+        if random_state.random_sample() > 0.5:
             beggining, ending = ending[:], beggining[:]
             beg_sentiment, end_sentiment = end_sentiment[:], beg_sentiment[:]
             label.append(0)
@@ -59,7 +46,8 @@ def output_fn_train(data):
     return [inputs, sentiments], np.array(label)
 
 
-def output_fn_test(data):
+def output_fn_test(data, random_state=None):
+    random_state = np.random if random_state is None else random_state
     batch = np.array(data.batch)
     mid_input = batch[:, 1:4, :]
     end_input_1 = batch[:, 4, :]
@@ -73,7 +61,7 @@ def output_fn_test(data):
     sentiments = np.concatenate((mid_sent, end_sent_1, end_sent_2), axis=1)
     # correct ending if 1 --> if 2 true get 2 - 1 = 1, if 1 true get 1 - 1 = 0
     label = np.array(correct_ending) - 1
-    if random.random() > 0.5:
+    if random_state.random_sample() > 0.5:
         label = 1 - label
     # Return what's needed for keras
     return [inputs, sentiments], label
@@ -104,21 +92,18 @@ def keras_model(config):
 
 
 def main(config, training_set, testing_set):
-    import sent2vec
-    assert config.sent2vec.model is not None, "Please add sent2vec_model config value."
-    sent2vec_model = sent2vec.Sent2vecModel()
-    sent2vec_model.load_model(config.sent2vec.model)
-
-    preprocess_fn = Preprocess(sent2vec_model)
-
-    training_set.set_preprocess_fn(preprocess_fn)
-    testing_set.set_preprocess_fn(preprocess_fn)
+    # Sentences embedded once with sent2vec and read from the store
+    sent2vec_store(config, [training_set, testing_set])
 
     training_set.set_output_fn(output_fn_train)
     testing_set.set_output_fn(output_fn_test)
 
-    generator_training = training_set.get_batch(config.batch_size, config.n_epochs, random=True)
-    generator_testing = testing_set.get_batch(config.batch_size, config.n_epochs, random=True)
+    generator_training = Prefetcher.from_config(
+        training_set.get_batch(config.batch_size, config.n_epochs, random=True, raw=True), config,
+        map_fn=output_fn_train)
+    generator_testing = Prefetcher.from_config(
+        testing_set.get_batch(config.batch_size, config.n_epochs, random=True, raw=True), config,
+        map_fn=output_fn_test)
 
     cloze_model = keras_model(config)
 
@@ -143,4 +128,6 @@ def main(config, training_set, testing_set):
                               validation_data=generator_testing,
                               validation_steps=len(testing_set) / config.batch_size,
                               callbacks=[tensorboard, saver])
+    generator_training.close()
+    generator_testing.close()
 
@@ -3,7 +3,7 @@ import random
 import datetime
 import keras
 import numpy as np
-from utils import Dataloader
+from utils import Dataloader, sent2vec_store
 from scripts import DefaultScript
 
 
@@ -23,37 +23,16 @@ class Script(DefaultScript):
         main(self.config, training_set, testing_set)
 
 
-class Preprocess:
-    """
-    Preprocess to apply to the dataset
-    """
-
-    def __init__(self, sent2vec_model):
-        self.sent2vec_model = sent2vec_model
-
-    def __call__(self, word_to_index, sentence):
-        sentence = self.sent2vec_model.embed_sentence(' '.join(sentence))
-        return sentence
-
-
 def output_fn_train(data):
     batch = np.array(data.batch)
     last_sentences = batch[:, 3, :]
     endings = batch[:, 4, :]
-    label = []
-    # Randomly choose a bad ending
-    for i in range(len(batch)):
-        # Only 50% of the time
-        if random.random() > 0.5:
-            k = random.randint(0, len(data.dataloader) - 1)
-            new_data = data.dataloader.get(k, raw=True)
-            new_batch = np.array(new_data.batch)
-            endings[i] = new_batch[0, 4, :]
-            label.append(0)
-        else:
-            label.append(1)
+    # Randomly choose a bad ending, only 50% of the time
+    negative = np.random.random_sample(len(batch)) > 0.5
+    endings[negative] = data.dataloader.negative_sampler().sample(n=np.count_nonzero(negative))
+    label = np.where(negative, 0, 1)
     # Return what's needed for keras
-    return [last_sentences, endings], np.array(label)
+    return [last_sentences, endings], label
 
 
 def output_fn_test(data):
@@ -98,15 +77,8 @@ def keras_model(config):
 
 
 def main(config, training_set, testing_set):
-    import sent2vec
-    assert config.sent2vec.model is not None, "Please add sent2vec_model config value."
-    sent2vec_model = sent2vec.Sent2vecModel()
-    sent2vec_model.load_model(config.sent2vec.model)
-
-    preprocess_fn = Preprocess(sent2vec_model)
-
-    training_set.set_preprocess_fn(preprocess_fn)
-    testing_set.set_preprocess_fn(preprocess_fn)
+    # Sentences embedded once with sent2vec and read from the store
+    sent2vec_store(config, [training_set, testing_set])
 
     training_set.set_output_fn(output_fn_train)
     testing_set.set_output_fn(output_fn_test)
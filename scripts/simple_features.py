@@ -1,8 +1,6 @@
 import datetime
 import os
 
-import numpy as np
-
 import keras
 from keras.layers import Embedding, Flatten, Dense, GRU, Dropout, Input, concatenate, Reshape
 from keras.utils import to_categorical
@@ -11,50 +9,10 @@ from scripts import DefaultScript
 from utils import PPDataloader
 
 
-def preprocess_fn(word_to_index, sentences):
-    sentiments = []
-    topics = []
-    label = None
-    for sentence in sentences:
-        if type(sentence) == int:
-            label = sentence
-        else:
-            sentiments.append(sentence[0])
-            topic = sentence[1][1:]
-            topic_list = []
-            for t in topic:
-                topic_list.append(word_to_index[t] if t in word_to_index.keys() else word_to_index['<unk>'])
-                # Always send the same order for the topics
-                topic_list = sorted(topic_list)
-            if len(topic_list) < 5:
-                topic_list += [word_to_index['<pad>'] for _ in range(5 - len(topic_list))]
-            elif len(topic_list) > 5:
-                topic_list = topic_list[:5]
-            topics.append(topic_list)
-    return sentiments, topics, label
-
-
 def output_fn(_, batch):
-    sentiments = []
-    sentences_1 = []
-    sentences_2 = []
-    sentences_3 = []
-    sentences_4 = []
-    endings_1 = []
-    endings_2 = []
-    labels = []
-    for b in batch:
-        sentiment, topics, label = b
-        sentiments.append(sentiment)
-        sentences_1.append(topics[0])
-        sentences_2.append(topics[1])
-        sentences_3.append(topics[2])
-        sentences_4.append(topics[3])
-        endings_1.append(topics[4])
-        endings_2.append(topics[5])
-        labels.append(label)  # 0 if ending_1 is correct, 1 if ending_2 is correct
-    return [np.array(sentences_1), np.array(sentences_2), np.array(sentences_3), np.array(sentences_4),
-            np.array(endings_1), np.array(endings_2), np.array(sentiments)], np.array(labels)
+    sentiments, topics, labels = batch
+    # labels: 0 if ending_1 is correct, 1 if ending_2 is correct
+    return [topics[:, 0], topics[:, 1], topics[:, 2], topics[:, 3], topics[:, 4], topics[:, 5], sentiments], labels
 
 
 class Script(DefaultScript):
@@ -63,12 +21,12 @@ class Script(DefaultScript):
     def train(self):
         train_set = PPDataloader('./data/dev_features.pkl')
         train_set.load_vocab('./data/dev_topics.pkl', size_percent=0.8)
-        train_set.set_preprocess_fn(preprocess_fn)
+        train_set.pack_features()
         train_set.set_output_fn(output_fn)
 
         test_set = PPDataloader('./data/test_features.pkl')
         test_set.load_vocab('./data/dev_topics.pkl', size_percent=0.8)
-        test_set.set_preprocess_fn(preprocess_fn)
+        test_set.pack_features()
         test_set.set_output_fn(output_fn)
 
         self.config.set('vocab_size', len(train_set.index_to_word))
@@ -178,22 +136,7 @@ class Script(DefaultScript):
         return model
 
     def output_fn_seq2seq(self, _, batch):
-        sentiments = []
-        sentences_1 = []
-        sentences_2 = []
-        sentences_3 = []
-        sentences_4 = []
-        ringht_ending = []
-        wrong_ending = []
-        for b in batch:
-            sentiment, topics, _ = b
-            sentiments.append(sentiment[0:5])
-            sentences_1.append(topics[0])
-            sentences_2.append(topics[1])
-            sentences_3.append(topics[2])
-            sentences_4.append(topics[3])
-            ringht_ending.append(topics[4])
-            wrong_ending.append(topics[5])
-        return [np.array(sentences_1), np.array(sentences_2), np.array(sentences_3), np.array(sentences_4),
-                np.array(ringht_ending), np.array(sentiments)], to_categorical(np.array(wrong_ending),
-                                                                               self.config.vocab_size)
+        sentiments, topics, _ = batch
+        # The model predicts the topics of the wrong ending
+        return [topics[:, 0], topics[:, 1], topics[:, 2], topics[:, 3], topics[:, 4],
+                sentiments[:, 0:5]], to_categorical(topics[:, 5], self.config.vocab_size)
@@ -1,6 +1,5 @@
 import datetime
 import os
-import random
 
 import numpy as np
 import tensorflow as tf
@@ -12,50 +11,10 @@ from scripts import DefaultScript
 from utils import PPDataloader
 
 
-def preprocess_fn(word_to_index, sentences):
-    sentiments = []
-    topics = []
-    label = None
-    for sentence in sentences:
-        if type(sentence) == int:
-            label = sentence
-        else:
-            sentiments.append(sentence[0])
-            topic = sentence[1][1:]
-            topic_list = []
-            for t in topic:
-                topic_list.append(word_to_index[t] if t in word_to_index.keys() else word_to_index['<unk>'])
-                # Always send the same order for the topics
-                topic_list = sorted(topic_list)
-            if len(topic_list) < 5:
-                topic_list += [word_to_index['<pad>'] for _ in range(5 - len(topic_list))]
-            elif len(topic_list) > 5:
-                topic_list = topic_list[:5]
-            topics.append(topic_list)
-    return sentiments, topics, label
-
-
 def output_fn(_, batch):
-    sentiments = []
-    sentences_1 = []
-    sentences_2 = []
-    sentences_3 = []
-    sentences_4 = []
-    endings_1 = []
-    endings_2 = []
-    labels = []
-    for b in batch:
-        sentiment, topics, label = b
-        sentiments.append(sentiment)
-        sentences_1.append(topics[0])
-        sentences_2.append(topics[1])
-        sentences_3.append(topics[2])
-        sentences_4.append(topics[3])
-        endings_1.append(topics[4])
-        endings_2.append(topics[5])
-        labels.append(label)  # 0 if ending_1 is correct, 1 if ending_2 is correct
-    return [np.array(sentences_1), np.array(sentences_2), np.array(sentences_3), np.array(sentences_4),
-            np.array(endings_1), np.array(endings_2), np.array(sentiments)], np.array(labels)
+    sentiments, topics, labels = batch
+    # labels: 0 if ending_1 is correct, 1 if ending_2 is correct
+    return [topics[:, 0], topics[:, 1], topics[:, 2], topics[:, 3], topics[:, 4], topics[:, 5], sentiments], labels
 
 
 class Script(DefaultScript):
@@ -69,12 +28,23 @@ class Script(DefaultScript):
 
         train_set = PPDataloader('./data/train_features.pkl')
         train_set.load_vocab('./data/dev_topics.pkl', size_percent=0.8)
-        train_set.set_preprocess_fn(preprocess_fn)
+        sentiments, topics, _ = train_set.pack_features()
+        # Wrong endings of the training set, generated ahead of time (most likely topics of the generator)
+        column = train_set.add_column(self.generate_endings(sentiments, topics))
         train_set.set_output_fn(self.output_fn_train)
+        refresh_every = self.config.simple_features_discriminator.refresh_every if \
+            self.config.simple_features_discriminator.is_set('refresh_every') else None
+
+        def refresh_endings(epoch, logs):
+            # The generator is frozen: new endings are sampled from its softmax to get different negatives
+            if refresh_every and (epoch + 1) % refresh_every == 0:
+                train_set.set_column(column, self.generate_endings(sentiments, topics, sample=True))
+
+        refresher = keras.callbacks.LambdaCallback(on_epoch_end=refresh_endings)
 
         test_set = PPDataloader('./data/test_features.pkl')
         test_set.load_vocab('./data/dev_topics.pkl', size_percent=0.8)
-        test_set.set_preprocess_fn(preprocess_fn)
+        test_set.pack_features()
         test_set.set_output_fn(output_fn)
 
         self.config.set('vocab_size', len(train_set.index_to_word))
@@ -105,7 +75,7 @@ class Script(DefaultScript):
                             verbose=verbose,
                             validation_data=test_generator,
                             validation_steps=len(test_set) / self.config.batch_size,
-                            callbacks=[tensorboard, saver])
+                            callbacks=[tensorboard, saver, refresher])
         # model = self.build_seq_to_seq_graph()
         # x, y = dev_set.get(1, 2)
         # print(model.train_on_batch(x, y))
@@ -145,35 +115,38 @@ class Script(DefaultScript):
         model.compile(keras.optimizers.Adam(lr=0.0005), 'binary_crossentropy', ['accuracy'])
         return model
 
-    def output_fn_train(self, _, batch):
-        sentiments = []
-        sentences_1 = []
-        sentences_2 = []
-        sentences_3 = []
-        sentences_4 = []
-        endings_1 = []
-        endings_2 = []
-        labels = []
-        for b in batch:
-            sentiment, topics, label = b
-            sentiments.append(sentiment)
-            sentences_1.append(topics[0])
-            sentences_2.append(topics[1])
-            sentences_3.append(topics[2])
-            sentences_4.append(topics[3])
+    def generate_endings(self, sentiments, topics, sample=False, chunk_size=4096):
+        """
+        Runs the generator on all the stories, `chunk_size` stories at a time so that only the ids of the generated
+        topics are kept (not the softmax over the vocab)
+        :param sentiments: float array of shape `stories x sentences`
+        :param topics: int array of shape `stories x sentences x topic_length`
+        :param sample: if True, the topics are sampled from the softmax of the generator, else the most likely ones
+        :param chunk_size: number of stories given to the generator at once
+        :return: int32 array of the generated topics of the wrong endings of shape `stories x topic_length`
+        """
+        endings = np.empty(topics[:, 0].shape, dtype=np.int32)
+        for start in range(0, len(topics), chunk_size):
+            chunk_topics = topics[start:start + chunk_size]
             with self.graph.as_default():
                 generated_output = self.generator_model.predict(
-                        [np.array([topics[0]]), np.array([topics[1]]), np.array([topics[2]]), np.array([topics[3]]),
-                         np.array([topics[4]]), np.array([sentiment])], batch_size=1)
-            generated_output = np.argmax(generated_output, axis=2)
-            print(generated_output)
-            if random.random() > 0.5:
-                endings_1.append(topics[4])
-                endings_2.append(generated_output)
-                labels.append(0)
+                        [chunk_topics[:, 0], chunk_topics[:, 1], chunk_topics[:, 2], chunk_topics[:, 3],
+                         chunk_topics[:, 4], sentiments[start:start + chunk_size, 0:5]],
+                        batch_size=self.config.batch_size)
+            if sample:
+                # Inverse transform sampling of every position
+                uniform = np.random.random(generated_output.shape[:2] + (1,))
+                chosen = (np.cumsum(generated_output, axis=2) < uniform).sum(axis=2)
+                endings[start:start + chunk_size] = np.minimum(chosen, generated_output.shape[2] - 1)
             else:
-                endings_1.append(generated_output)
-                endings_2.append(topics[4])
-                labels.append(1)
-        return [np.array(sentences_1), np.array(sentences_2), np.array(sentences_3), np.array(sentences_4),
-                np.array(endings_1), np.array(endings_2), np.array(sentiments)], np.array(labels)
+                endings[start:start + chunk_size] = np.argmax(generated_output, axis=2)
+        return endings
+
+    def output_fn_train(self, _, batch):
+        sentiments, topics, _, generated_endings = batch
+        # The real ending is the first one (label 0) half of the time
+        swapped = np.random.random(len(sentiments)) <= 0.5
+        endings_1 = np.where(swapped[:, None], generated_endings, topics[:, 4])
+        endings_2 = np.where(swapped[:, None], topics[:, 4], generated_endings)
+        return [topics[:, 0], topics[:, 1], topics[:, 2], topics[:, 3], endings_1, endings_2,
+                sentiments], swapped.astype(np.int64)
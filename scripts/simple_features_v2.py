@@ -11,25 +11,10 @@ from scripts import DefaultScript
 from utils import PPDataloader
 
 
-def preprocess_fn(_, sentences):
-    sentiments = []
-    label = None
-    for sentence in sentences:
-        if type(sentence) == int:
-            label = sentence
-        else:
-            sentiments.append(sentence[0])
-    return sentiments, label
-
-
 def output_fn(_, batch):
-    sentiments = []
-    labels = []
-    for b in batch:
-        sentiment, label = b
-        sentiments.append(sentiment)
-        labels.append(label)  # 0 if ending_1 is correct, 1 if ending_2 is correct
-    return np.array(sentiments), np.array(labels)
+    sentiments, _, labels = batch
+    # labels: 0 if ending_1 is correct, 1 if ending_2 is correct
+    return sentiments, labels
 
 
 class Script(DefaultScript):
@@ -38,12 +23,12 @@ class Script(DefaultScript):
     def train(self):
         train_set = PPDataloader('./data/dev_features.pkl')
         train_set.load_vocab('./data/dev_topics.pkl', size_percent=0.8)
-        train_set.set_preprocess_fn(preprocess_fn)
+        train_set.pack_features()
         train_set.set_output_fn(self.output_fn_seq2seq)
 
         test_set = PPDataloader('./data/test_features.pkl')
         test_set.load_vocab('./data/dev_topics.pkl', size_percent=0.8)
-        test_set.set_preprocess_fn(preprocess_fn)
+        test_set.pack_features()
         test_set.set_output_fn(self.output_fn_seq2seq)
 
         self.config.set('vocab_size', len(train_set.index_to_word))
@@ -109,21 +94,10 @@ class Script(DefaultScript):
         return model
 
     def output_fn_seq2seq(self, _, batch):
-        sentiments = []
-        labels = []
-        for b in batch:
-            sentiment, label = b
-            s = sentiment[0:4]
-            right_ending = sentiment[4]
-            wrong_ending = sentiment[5]
-            if label == 1:
-                right_ending = sentiment[5]
-                wrong_ending = sentiment[4]
-            sentiments.append(s + [right_ending])
-            if wrong_ending <= -1:
-                labels.append([0, 0, 1])
-            elif wrong_ending == 0:
-                labels.append([0, 1, 0])
-            elif wrong_ending >= 1:
-                labels.append([1, 0, 0])
-        return np.array(sentiments), np.array(labels)
+        sentiments, _, labels = batch
+        right_ending = np.where(labels == 1, sentiments[:, 5], sentiments[:, 4])
+        wrong_ending = np.where(labels == 1, sentiments[:, 4], sentiments[:, 5])
+        # The model predicts if the sentiment of the wrong ending is positive, neutral or negative
+        classes = np.stack([wrong_ending >= 1, wrong_ending == 0, wrong_ending <= -1], axis=1)
+        kept = classes.any(axis=1)
+        return np.concatenate([sentiments[kept, 0:4], right_ending[kept, None]], axis=1), classes[kept].astype(np.int64)
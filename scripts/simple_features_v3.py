@@ -13,25 +13,10 @@ from scripts import DefaultScript
 from utils import PPDataloader
 
 
-def preprocess_fn(_, sentences):
-    sentiments = []
-    label = None
-    for sentence in sentences:
-        if type(sentence) == int:
-            label = sentence
-        else:
-            sentiments.append(sentence[0])
-    return sentiments, label
-
-
 def output_fn(_, batch):
-    sentiments = []
-    labels = []
-    for b in batch:
-        sentiment, label = b
-        sentiments.append(sentiment)
-        labels.append(label)  # 0 if ending_1 is correct, 1 if ending_2 is correct
-    return np.array(sentiments), np.array(labels)
+    sentiments, _, labels = batch
+    # labels: 0 if ending_1 is correct, 1 if ending_2 is correct
+    return sentiments, labels
 
 
 class Script(DefaultScript):
@@ -45,12 +30,12 @@ class Script(DefaultScript):
 
         train_set = PPDataloader('./data/train_features.pkl')
         train_set.load_vocab('./data/train_topics.pkl', size_percent=0.8)
-        train_set.set_preprocess_fn(preprocess_fn)
+        train_set.pack_features()
         train_set.set_output_fn(self.output_fn_train)
 
         test_set = PPDataloader('./data/test_features.pkl')
         test_set.load_vocab('./data/dev_topics.pkl', size_percent=0.8)
-        test_set.set_preprocess_fn(preprocess_fn)
+        test_set.pack_features()
         test_set.set_output_fn(output_fn)
 
         self.config.set('vocab_size', len(train_set.index_to_word))
@@ -105,8 +90,8 @@ class Script(DefaultScript):
     def output_fn_train(self, _, batch):
         sentiments = []
         labels = []
-        for b in batch:
-            sentiment, label = b
+        for sentiment, _, label in zip(*batch):
+            sentiment = sentiment.tolist()
             with self.graph.as_default():
                 generated_output = self.generator_model.predict(np.array([sentiment]), batch_size=1)
             generated_output = np.argmax(generated_output, axis=1)
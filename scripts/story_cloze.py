@@ -15,7 +15,7 @@ import tensorflow_hub as hub
 import keras.backend as K
 import numpy as np
 
-from utils import Dataloader
+from utils import Dataloader, hub_precompute, hub_store, elmo_sentences
 from scripts import DefaultScript
 
 
@@ -27,32 +27,35 @@ class Script(DefaultScript):
         sess = tf.Session()
         K.set_session(sess)  # Set to keras backend
 
-        if self.config.debug:
-            print('Importing Elmo module...')
-        if self.config.hub.is_set("cache_dir"):
-            os.environ['TFHUB_CACHE_DIR'] = self.config.hub.cache_dir
+        test_set = Dataloader(self.config, 'data/test_stories.csv', testing_data=True)
+        # test_set.set_preprocess_fn(preprocess_fn)
+        test_set.load_dataset('data/test.bin')
+        test_set.load_vocab('./data/default.voc', self.config.vocab_size)
 
-        elmo_model = hub.Module("https://tfhub.dev/google/elmo/1", trainable=True)
-        if self.config.debug:
-            print('Imported.')
+        graph = tf.get_default_graph()
+        if hub_precompute(self.config):
+            # ELMo is run once over all the sentences, the output function reads the embeddings from the store
+            elmo_model_emb = hub_store(self.config, elmo_sentences(test_set, separator=""), 'elmo')
+        else:
+            if self.config.debug:
+                print('Importing Elmo module...')
+            if self.config.hub.is_set("cache_dir"):
+                os.environ['TFHUB_CACHE_DIR'] = self.config.hub.cache_dir
 
-        sess.run(tf.global_variables_initializer())
-        sess.run(tf.tables_initializer())
+            elmo_model = hub.Module("https://tfhub.dev/google/elmo/1", trainable=True)
+            if self.config.debug:
+                print('Imported.')
 
-        graph = tf.get_default_graph()
+            sess.run(tf.global_variables_initializer())
+            sess.run(tf.tables_initializer())
 
-        elmo_emb_fn = ElmoEmbedding(elmo_model)
+            elmo_emb_fn = ElmoEmbedding(elmo_model)
 
-        elmo_model_emb = get_elmo_embedding(elmo_emb_fn)
+            elmo_model_emb = get_elmo_embedding(elmo_emb_fn)
 
         type_translation_model = keras.models.load_model(self.config.type_translation_model)
 
         output_fn = OutputFN(elmo_model_emb, type_translation_model, graph)
-
-        test_set = Dataloader(self.config, 'data/test_stories.csv', testing_data=True)
-        # test_set.set_preprocess_fn(preprocess_fn)
-        test_set.load_dataset('data/test.bin')
-        test_set.load_vocab('./data/default.voc', self.config.vocab_size)
         test_set.set_output_fn(output_fn)
 
         generator_test = test_set.get_batch(self.config.batch_size, 1)
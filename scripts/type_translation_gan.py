@@ -15,7 +15,7 @@ import tensorflow as tf
 import tensorflow_hub as hub
 import keras.backend as K
 import numpy as np
-from utils import SNLIDataloaderPairs
+from utils import SNLIDataloaderPairs, hub_precompute, hub_store
 from scripts import DefaultScript
 
 
@@ -50,7 +50,7 @@ class Script(DefaultScript):
 
         output_fn = OutputFN(elmo_model_emb, graph)
 
-        test_set = SNLIDataloaderPairs('data/snli_1.0/snli_1.0_test.jsonl')
+        test_set = SNLIDataloaderPairs('data/snli_1.0/snli_1.0_test.jsonl', nthreads=self.config.nthreads)
         test_set.set_preprocess_fn(preprocess_fn)
         test_set.set_output_fn(output_fn)
 
@@ -158,33 +158,36 @@ def main(config):
     sess = tf.Session()
     K.set_session(sess)  # Set to keras backend
 
-    if config.debug:
-        print('Importing Elmo module...')
-    if config.hub.is_set("cache_dir"):
-        os.environ['TFHUB_CACHE_DIR'] = config.hub.cache_dir
+    train_set = SNLIDataloaderPairs('data/snli_1.0/snli_1.0_train.jsonl', nthreads=config.nthreads)
+    train_set.load_vocab('./data/snli_vocab.dat', config.vocab_size)
+    train_set.set_preprocess_fn(preprocess_fn)
+    dev_set = SNLIDataloaderPairs('data/snli_1.0/snli_1.0_dev.jsonl', nthreads=config.nthreads)
+    dev_set.load_vocab('./data/snli_vocab.dat', config.vocab_size)
+    dev_set.set_preprocess_fn(preprocess_fn)
 
-    elmo_model = hub.Module("https://tfhub.dev/google/elmo/1", trainable=True)
-    if config.debug:
-        print('Imported.')
+    graph = tf.get_default_graph()
+    if hub_precompute(config):
+        # ELMo is run once over all the sentences, the output functions read the embeddings from the store
+        elmo_model_emb = hub_store(config, list(train_set.sentences()) + list(dev_set.sentences()), 'elmo')
+    else:
+        if config.debug:
+            print('Importing Elmo module...')
+        if config.hub.is_set("cache_dir"):
+            os.environ['TFHUB_CACHE_DIR'] = config.hub.cache_dir
 
-    sess.run(tf.global_variables_initializer())
-    sess.run(tf.tables_initializer())
+        elmo_model = hub.Module("https://tfhub.dev/google/elmo/1", trainable=True)
+        if config.debug:
+            print('Imported.')
 
-    graph = tf.get_default_graph()
+        sess.run(tf.global_variables_initializer())
+        sess.run(tf.tables_initializer())
 
-    elmo_emb_fn = ElmoEmbedding(elmo_model)
+        elmo_emb_fn = ElmoEmbedding(elmo_model)
 
-    elmo_model_emb = get_elmo_embedding(elmo_emb_fn)
+        elmo_model_emb = get_elmo_embedding(elmo_emb_fn)
 
     output_fn = OutputFN(elmo_model_emb, graph)
-
-    train_set = SNLIDataloaderPairs('data/snli_1.0/snli_1.0_train.jsonl')
-    train_set.load_vocab('./data/snli_vocab.dat', config.vocab_size)
-    train_set.set_preprocess_fn(preprocess_fn)
     train_set.set_output_fn(output_fn)
-    dev_set = SNLIDataloaderPairs('data/snli_1.0/snli_1.0_dev.jsonl')
-    dev_set.load_vocab('./data/snli_vocab.dat', config.vocab_size)
-    dev_set.set_preprocess_fn(preprocess_fn)
     dev_set.set_output_fn(output_fn)
     # test_set = SNLIDataloader('data/snli_1.0/snli_1.0_test.jsonl')
 
@@ -18,7 +18,7 @@ import keras.backend as K
 import numpy as np
 from keras.layers import BatchNormalization, Dropout, LeakyReLU
 
-from utils import SNLIDataloaderPairs, Dataloader
+from utils import SNLIDataloaderPairs, Dataloader, hub_precompute, hub_store, elmo_sentences
 from scripts import DefaultScript
 
 
@@ -53,7 +53,7 @@ class Script(DefaultScript):
 
         output_fn = OutputFN(elmo_model_emb, graph)
 
-        test_set = SNLIDataloaderPairs('data/snli_1.0/snli_1.0_test.jsonl')
+        test_set = SNLIDataloaderPairs('data/snli_1.0/snli_1.0_test.jsonl', nthreads=self.config.nthreads)
         test_set.set_preprocess_fn(preprocess_fn)
         test_set.set_output_fn(output_fn)
 
@@ -186,17 +186,20 @@ def main(config):
 
     elmo_model_emb = get_elmo_embedding(elmo_emb_fn)
 
-    output_fn = OutputFN(elmo_model_emb, graph)
-    output_fn_test = OutputFNTest(elmo_model_emb, graph)
-
     train_set = Dataloader(config, 'data/test_stories.csv', testing_data=True)
     # train_set.set_preprocess_fn(preprocess_fn)
     train_set.load_dataset('data/test.bin')
     train_set.load_vocab('./data/default.voc', config.vocab_size)
-    train_set.set_output_fn(output_fn)
-    dev_set = SNLIDataloaderPairs('data/snli_1.0/snli_1.0_dev.jsonl')
+    dev_set = SNLIDataloaderPairs('data/snli_1.0/snli_1.0_dev.jsonl', nthreads=config.nthreads)
     dev_set.load_vocab('./data/snli_vocab.dat', config.vocab_size)
     dev_set.set_preprocess_fn(preprocess_fn)
+
+    if hub_precompute(config):
+        # The output functions read the ELMo embeddings from the store instead of running the module at every batch
+        elmo_model_emb = hub_store(config, list(elmo_sentences(train_set)) + list(dev_set.sentences()), 'elmo')
+    output_fn = OutputFN(elmo_model_emb, graph)
+    output_fn_test = OutputFNTest(elmo_model_emb, graph)
+    train_set.set_output_fn(output_fn)
     dev_set.set_output_fn(output_fn_test)
     # test_set = SNLIDataloader('data/snli_1.0/snli_1.0_test.jsonl')
 
@@ -1,7 +1,7 @@
 import datetime
 import numpy as np
 import tensorflow as tf
-from models import VanillaSeq2SeqEncoder, scheduler_preprocess, scheduler_get_labels
+from models import VanillaSeq2SeqEncoder, scheduler_get_labels
 from utils import load_embedding
 from utils import Dataloader
 from scripts import DefaultScript
@@ -24,10 +24,12 @@ class Script(DefaultScript):
 
 
 def main(config, training_set, testing_set):
-    training_set.set_preprocess_fn(scheduler_preprocess)
+    training_set.compute_token_ids()
     training_set.set_special_tokens(['<pad>', '<unk>'])
-    testing_set.set_preprocess_fn(scheduler_preprocess)
+    testing_set.compute_token_ids()
     testing_set.set_special_tokens(['<pad>', '<unk>'])
+    # Batches of stories of similar lengths: less padding steps in the LSTM
+    training_sampler = training_set.bucket_sampler(config.batch_size, drop_last=True)
 
     scheduler_model = VanillaSeq2SeqEncoder(config.batch_size, config.vocab_size, config.embedding_size, config.hidden_size)
     _ = scheduler_model()
@@ -81,22 +83,20 @@ def main(config, training_set, testing_set):
                 accuracy_summary = tf.Summary()
                 accuracy_summary.value.add(tag='accuracy', simple_value=accuracy)
                 test_writer.add_summary(accuracy_summary, epoch)
-            for k in range(0, len(training_set), config.batch_size):
-                if k + config.batch_size < len(training_set):
-                    summary_op = tf.summary.merge_all()
+            for k, line_indexes in enumerate(training_sampler):
+                summary_op = tf.summary.merge_all()
 
-                    batch = training_set.get(k, config.batch_size, random=True)
-                    shuffled_batch, labels = scheduler_get_labels(batch)
-                    probabilities, _, computed_mse, summary = sess.run(
-                        ['scheduler/order_probability:0', 'scheduler/optimize/optimizer',
-                         'scheduler/optimize/mse:0', summary_op],
-                        {'scheduler/x:0': shuffled_batch,
-                         'scheduler/optimize/label:0': labels})
-                    writer.add_summary(summary, epoch * len(training_set) + k)
-                    if not epoch % config.save_model_every:
-                        model_path = './builds/' + timestamp
-                        saver.save(sess, model_path, global_step=epoch)
-            training_set.shuffle_lines()
+                batch = training_set.get_lines(line_indexes)
+                shuffled_batch, labels = scheduler_get_labels(batch)
+                probabilities, _, computed_mse, summary = sess.run(
+                    ['scheduler/order_probability:0', 'scheduler/optimize/optimizer',
+                     'scheduler/optimize/mse:0', summary_op],
+                    {'scheduler/x:0': shuffled_batch,
+                     'scheduler/optimize/label:0': labels})
+                writer.add_summary(summary, epoch * len(training_set) + k * config.batch_size)
+                if not epoch % config.save_model_every:
+                    model_path = './builds/' + timestamp
+                    saver.save(sess, model_path, global_step=epoch)
             if not epoch % config.save_model_every:
                 model_path = './builds/' + timestamp + '/model'
                 saver.save(sess, model_path, global_step=epoch)
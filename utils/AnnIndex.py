@@ -0,0 +1,230 @@
+import os
+import time
+import shutil
+import numpy as np
+
+
+def normalize(vectors):
+    """
+    :return: float32 copy of the vectors with a unit norm
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def top_k(scores, k):
+    """
+    :param scores: float array of shape `queries x candidates`
+    :return: positions of the k highest scores of every row, the highest first
+    """
+    k = min(k, scores.shape[1])
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(best, order, axis=1)
+
+
+def brute_force_search(vectors, queries, k=10, batch_size=1024):
+    """
+    Exact search of the vectors with the highest cosine similarity.
+    :param vectors: float array of shape `items x dim`
+    :param queries: float array of shape `queries x dim`
+    :param k: number of results per query
+    :param batch_size: number of queries compared to all the vectors at once
+    :return: (positions, scores) arrays of shape `queries x k`, positions being rows of vectors
+    """
+    vectors, queries = normalize(vectors), normalize(queries)
+    positions = np.empty((len(queries), min(k, len(vectors))), dtype=np.int64)
+    scores = np.empty(positions.shape, dtype=np.float32)
+    for start in range(0, len(queries), batch_size):
+        batch_scores = queries[start:start + batch_size] @ vectors.T
+        best = top_k(batch_scores, k)
+        positions[start:start + batch_size] = best
+        scores[start:start + batch_size] = np.take_along_axis(batch_scores, best, axis=1)
+    return positions, scores
+
+
+def kmeans(vectors, n_clusters, n_iter=10, sample_size=100000, batch_size=4096, random_state=None):
+    """
+    Spherical k-means (centroids of unit norm) on a sample of the vectors.
+    :param vectors: float array of unit vectors of shape `items x dim`
+    :return: float32 array of shape `n_clusters x dim`
+    """
+    random_state = np.random if random_state is None else random_state
+    if len(vectors) > sample_size:
+        vectors = vectors[np.sort(random_state.choice(len(vectors), sample_size, replace=False))]
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[random_state.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = assign(vectors, centroids, batch_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        # Empty clusters restart from random vectors
+        empty = counts == 0
+        sums[empty] = vectors[random_state.choice(len(vectors), np.count_nonzero(empty))]
+        centroids = normalize(sums)
+    return centroids
+
+
+def assign(vectors, centroids, batch_size=4096):
+    """
+    :return: index of the closest centroid of every vector
+    """
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        assignment[start:start + batch_size] = np.argmax(normalize(vectors[start:start + batch_size]) @ centroids.T,
+                                                         axis=1)
+    return assignment
+
+
+class AnnIndex:
+    """
+    Approximate nearest neighbour search (cosine similarity) with an inverted file index (IVF).
+    The vectors are clustered with a spherical k-means into `n_lists` lists. A query is only compared to the vectors
+    of the `n_probe` lists whose centroids are the closest to it: `n_probe` trades recall for latency (see
+    `AnnIndex.benchmark`).
+    An index is a folder holding:
+    - centroids.npy: centroids of the lists
+    - offsets.npy: position of the first vector of every list in vectors.npy, plus the end
+    - ids.npy: id of every vector (e.g. the index of the story or the row in an `utils.EmbeddingStore`)
+    - vectors.npy: normalized float32 vectors sorted by list, opened with `np.memmap`
+    """
+
+    files = ['centroids', 'offsets', 'ids', 'vectors']
+
+    def __init__(self, centroids, offsets, ids, vectors):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+
+    @classmethod
+    def build(cls, vectors, ids=None, n_lists=None, n_iter=10, seed=None):
+        """
+        :param vectors: float array of shape `items x dim`
+        :param ids: id of every vector. Default: its position.
+        :param n_lists: number of lists. Default: 4 * sqrt(items)
+        :param n_iter: number of iterations of k-means
+        :param seed: seed of k-means
+        """
+        vectors = normalize(vectors)
+        ids = np.arange(len(vectors), dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(len(vectors)))
+        n_lists = max(1, min(n_lists, len(vectors)))
+        centroids = kmeans(vectors, n_lists, n_iter, random_state=np.random.RandomState(seed))
+        assignment = assign(vectors, centroids)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=n_lists)))).astype(np.int64)
+        return cls(centroids, offsets, ids[order], vectors[order])
+
+    @classmethod
+    def from_store(cls, store, sentences, ids=None, **kwargs):
+        """
+        Index of the embeddings of sentences of an `utils.EmbeddingStore` (sent2vec, ELMo...).
+        :param store: EmbeddingStore
+        :param sentences: list of sentences (list of words or strings)
+        :param ids: id of every sentence. Default: its row in the store.
+        :param kwargs: see `AnnIndex.build`
+        """
+        rows = store.lookup(sentences)
+        return cls.build(store.gather(rows), rows if ids is None else ids, **kwargs)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        :param directory: path of the index folder
+        """
+        arrays = {}
+        for name in cls.files:
+            arrays[name] = np.load(os.path.join(directory, name + '.npy'), mmap_mode='r' if name == 'vectors' else None)
+        return cls(**arrays)
+
+    @staticmethod
+    def exists(directory):
+        return all([os.path.isfile(os.path.join(directory, name + '.npy')) for name in AnnIndex.files])
+
+    def save(self, directory):
+        """
+        :param directory: path of the index folder
+        """
+        # Written in a temporary folder so that other processes never see a partial index
+        tmp_directory = directory.rstrip(os.sep) + '.tmp-' + str(os.getpid())
+        os.makedirs(tmp_directory, exist_ok=True)
+        for name in self.files:
+            np.save(os.path.join(tmp_directory, name + '.npy'), getattr(self, name))
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.rename(tmp_directory, directory)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, queries, k=10, n_probe=8):
+        """
+        :param queries: float array of shape `queries x dim`
+        :param k: number of results per query
+        :param n_probe: number of lists searched per query
+        :return: (ids, scores) arrays of shape `queries x k`, the closest first. If less than k vectors are in the
+            probed lists, the missing results have the id -1 and the score -inf.
+        """
+        queries = normalize(queries)
+        n_probe = min(n_probe, len(self.centroids))
+        probes = top_k(queries @ self.centroids.T, n_probe)
+        best_positions = np.full((len(queries), k), -1, dtype=np.int64)
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        # Lists are visited one at a time, with all the queries probing them
+        probed_lists, probing_queries = np.unique(probes, return_inverse=True)
+        probing_queries = probing_queries.reshape(probes.shape)
+        for list_position, list_id in enumerate(probed_lists):
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if start == end:
+                continue
+            query_ids = np.flatnonzero((probing_queries == list_position).any(axis=1))
+            scores = queries[query_ids] @ np.asarray(self.vectors[start:end]).T
+            scores = np.concatenate((best_scores[query_ids], scores), axis=1)
+            positions = np.concatenate((best_positions[query_ids],
+                                        np.broadcast_to(np.arange(start, end), (len(query_ids), end - start))),
+                                       axis=1)
+            best = top_k(scores, k)
+            best_scores[query_ids] = np.take_along_axis(scores, best, axis=1)
+            best_positions[query_ids] = np.take_along_axis(positions, best, axis=1)
+        ids = np.where(best_positions >= 0, self.ids[np.maximum(best_positions, 0)], -1)
+        return ids, best_scores
+
+    def neighbours(self, k=10, n_probe=8, batch_size=4096):
+        """
+        Approximate nearest neighbours of every indexed vector, to use as hard negatives in a `utils.NegativeSampler`
+        (when the ids are the indexes of the stories).
+        :return: int64 array of shape `items x k` of ids, in the order of the ids. If less than k other vectors are in
+            the probed lists, the missing neighbours have the id -1 (see `search`).
+        """
+        table = np.empty((len(self), k), dtype=np.int64)
+        for start in range(0, len(self), batch_size):
+            ids, _ = self.search(self.vectors[start:start + batch_size], k + 1, n_probe)
+            # Removes the vector itself
+            own = ids == self.ids[start:start + batch_size, None]
+            own[~own.any(axis=1), -1] = True
+            table[start:start + batch_size] = ids[~own].reshape(-1, k)
+        return table[np.argsort(self.ids, kind='stable')]
+
+    def benchmark(self, queries, k=10, n_probes=(1, 2, 4, 8, 16, 32)):
+        """
+        Recall and latency of the index compared to an exact search.
+        :param queries: float array of shape `queries x dim`
+        :param k: number of results per query
+        :param n_probes: values of n_probe to evaluate
+        :return: list of dicts with n_probe, recall (proportion of the exact k nearest neighbours found) and ms (time
+            per query in milliseconds). The first one, with n_probe None, is the exact search.
+        """
+        tic = time.time()
+        exact_positions, _ = brute_force_search(self.vectors, queries, k)
+        results = [{'n_probe': None, 'recall': 1., 'ms': 1000 * (time.time() - tic) / len(queries)}]
+        exact_ids = self.ids[exact_positions]
+        for n_probe in n_probes:
+            tic = time.time()
+            ids, _ = self.search(queries, k, n_probe)
+            ms = 1000 * (time.time() - tic) / len(queries)
+            found = sum([len(np.intersect1d(a, b)) for a, b in zip(ids, exact_ids)])
+            results.append({'n_probe': n_probe, 'recall': found / exact_ids.size, 'ms': ms})
+        return results
@@ -0,0 +1,85 @@
+import numpy as np
+
+
+def padding_ratio(lengths, batches):
+    """
+    Proportion of padding when every batch is padded to its longest sentence.
+    :param lengths: lengths of the sentences, array of shape `items x sentences` (or `items`)
+    :param batches: list of index arrays
+    """
+    lengths = np.asarray(lengths)
+    if lengths.ndim == 1:
+        lengths = lengths[:, None]
+    padded, total = 0, 0
+    for batch in batches:
+        batch_lengths = lengths[batch]
+        padded += batch_lengths.size * batch_lengths.max()
+        total += batch_lengths.sum()
+    if padded == 0:
+        return 0.
+    return float(padded - total) / float(padded)
+
+
+class BucketSampler:
+    """
+    Batch sampler grouping items of similar lengths to reduce padding.
+    The items are sorted by length (the length of the longest sentence of the story) and split into `n_buckets`
+    buckets of the same size. Every epoch, the items are shuffled inside their bucket, the buckets are cut into batches
+    and the order of the batches is shuffled, so consecutive batches come from different buckets.
+    """
+
+    def __init__(self, lengths, batch_size, n_buckets=10, drop_last=False, seed=None):
+        """
+        :param lengths: lengths of the sentences, array of shape `items x sentences` (or `items`)
+        :param batch_size:
+        :param n_buckets: number of buckets
+        :param drop_last: if True, the last batch is dropped when smaller than batch_size
+        :param seed: seed of the sampler
+        """
+        self.lengths = np.asarray(lengths)
+        self.keys = self.lengths if self.lengths.ndim == 1 else self.lengths.max(axis=1)
+        self.batch_size = batch_size
+        self.n_buckets = max(1, min(n_buckets, len(self.keys)))
+        self.drop_last = drop_last
+        self.random_state = np.random.RandomState(seed)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.keys) // self.batch_size
+        return (len(self.keys) + self.batch_size - 1) // self.batch_size
+
+    def batches(self):
+        """
+        Batches of one epoch
+        :return: list of index arrays
+        """
+        # Random order between items of the same length
+        order = self.random_state.permutation(len(self.keys))
+        order = order[np.argsort(self.keys[order], kind='stable')]
+        buckets = np.array_split(order, self.n_buckets)
+        for bucket in buckets:
+            self.random_state.shuffle(bucket)
+        items = np.concatenate(buckets)
+        batches = [items[k:k + self.batch_size] for k in range(0, len(items), self.batch_size)]
+        if self.drop_last and len(batches) and len(batches[-1]) < self.batch_size:
+            batches = batches[:-1]
+        self.random_state.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        return iter(self.batches())
+
+    def padding_ratio(self, batches=None):
+        """
+        Proportion of padding with the bucketed batches
+        :param batches: batches to evaluate. Default: the batches of a new epoch.
+        """
+        return padding_ratio(self.lengths, self.batches() if batches is None else batches)
+
+    def random_padding_ratio(self):
+        """
+        Proportion of padding with random batches, for comparison
+        """
+        order = self.random_state.permutation(len(self.keys))
+        return padding_ratio(self.lengths, [order[k:k + self.batch_size] for k in range(0, len(order),
+                                                                                        self.batch_size)])
@@ -0,0 +1,173 @@
+import os
+import shutil
+import numpy as np
+
+
+def encode_words(words):
+    """
+    Packs a list of words into a uint8 array (utf-8, one word per line).
+    :param words: list of strings without new lines
+    """
+    return np.frombuffer('\n'.join(words).encode('utf-8'), dtype=np.uint8)
+
+
+def decode_words(array):
+    """
+    Inverse of `encode_words`.
+    :param array: uint8 array
+    :return: list of strings
+    """
+    if len(array) == 0:
+        return []
+    return bytes(array).decode('utf-8').split('\n')
+
+
+class Corpus:
+    """
+    Tokenized corpus stored as flat arrays.
+    properties:
+    - tokens: (int32 array) id of every token of the corpus in the `words` table
+    - sentence_offsets: (int64 array) position in `tokens` of the first token of every sentence, plus the end
+    - story_offsets: (int64 array) position in `sentence_offsets` of the first sentence of every story, plus the end
+    - words: (python list) word table of the corpus
+
+    A compiled corpus is a folder holding one `.npy` file per array. `Corpus.load` opens the arrays with
+    `np.memmap`, so loading is almost instantaneous and several processes share the same pages.
+    Indexing a corpus returns a story as a python list of tokenized sentences, like `Dataloader.original_lines`.
+    """
+
+    files = ['tokens', 'sentence_offsets', 'story_offsets', 'words']
+
+    def __init__(self, tokens, sentence_offsets, story_offsets, words):
+        self.tokens = tokens
+        self.sentence_offsets = sentence_offsets
+        self.story_offsets = story_offsets
+        self.words = words
+
+    @classmethod
+    def from_stories(cls, stories):
+        """
+        Builds a corpus from tokenized stories.
+        :param stories: list of stories, a story being a list of sentences, a sentence a list of words.
+        """
+        word_to_id = {}
+        tokens = []
+        sentence_offsets = [0]
+        story_offsets = [0]
+        for story in stories:
+            for sentence in story:
+                tokens.extend([word_to_id.setdefault(word, len(word_to_id)) for word in sentence])
+                sentence_offsets.append(len(tokens))
+            story_offsets.append(len(sentence_offsets) - 1)
+        words = [None] * len(word_to_id)
+        for word, k in word_to_id.items():
+            words[k] = word
+        return cls(np.array(tokens, dtype=np.int32), np.array(sentence_offsets, dtype=np.int64),
+                   np.array(story_offsets, dtype=np.int64), words)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Opens a corpus saved with `Corpus.save`.
+        :param directory: path of the corpus folder
+        """
+        arrays = {}
+        for name in cls.files:
+            arrays[name] = np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+        arrays['words'] = decode_words(arrays['words'])
+        return cls(**arrays)
+
+    @staticmethod
+    def exists(directory):
+        return all([os.path.isfile(os.path.join(directory, name + '.npy')) for name in Corpus.files])
+
+    def save(self, directory):
+        """
+        Saves the corpus in a folder, replacing the previous content of the folder.
+        :param directory: path of the corpus folder
+        """
+        # Written in a temporary folder so that other processes never see a partial corpus
+        tmp_directory = directory.rstrip(os.sep) + '.tmp-' + str(os.getpid())
+        os.makedirs(tmp_directory, exist_ok=True)
+        np.save(os.path.join(tmp_directory, 'tokens.npy'), self.tokens)
+        np.save(os.path.join(tmp_directory, 'sentence_offsets.npy'), self.sentence_offsets)
+        np.save(os.path.join(tmp_directory, 'story_offsets.npy'), self.story_offsets)
+        np.save(os.path.join(tmp_directory, 'words.npy'), encode_words(self.words))
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.rename(tmp_directory, directory)
+
+    def __len__(self):
+        return len(self.story_offsets) - 1
+
+    def __getitem__(self, item):
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('Story index out of range.')
+        return [self.sentence(k) for k in range(self.story_offsets[item], self.story_offsets[item + 1])]
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def sentence(self, k):
+        """
+        Get a tokenized sentence
+        :param k: index of the sentence in the whole corpus
+        :return: list of words
+        """
+        return [self.words[i] for i in self.tokens[self.sentence_offsets[k]:self.sentence_offsets[k + 1]]]
+
+    def sentence_lengths(self):
+        """
+        :return: length of every sentence of the corpus
+        """
+        return np.diff(self.sentence_offsets)
+
+    def max_story_length(self):
+        """
+        :return: maximum number of sentences in a story
+        """
+        return int(np.diff(self.story_offsets).max()) if len(self) else 0
+
+    def sentence_positions(self):
+        """
+        :return: (stories, positions) the story of every sentence and its position in the story
+        """
+        sentence_story = np.repeat(np.arange(len(self)), np.diff(self.story_offsets))
+        sentence_position = np.arange(len(self.sentence_offsets) - 1) - self.story_offsets[sentence_story]
+        return sentence_story, sentence_position
+
+    def length_matrix(self):
+        """
+        :return: int32 array of shape `stories x sentences` with the length of every sentence
+        """
+        lengths = np.zeros((len(self), self.max_story_length()), dtype=np.int32)
+        lengths[self.sentence_positions()] = self.sentence_lengths()
+        return lengths
+
+    def id_matrices(self, lookup, pad_id=0, max_length=None):
+        """
+        Converts the whole corpus to padded id matrices in one vectorized pass.
+        :param lookup: (int array) id to give to every word of the `words` table
+        :param pad_id: id used for padding
+        :param max_length: sentences are truncated to `max_length` tokens. Default: length of the longest sentence.
+        :return: (ids, lengths) ids is an int32 array of shape `stories x sentences x max_length` and lengths an int32
+            array of shape `stories x sentences`.
+        """
+        sentence_lengths = self.sentence_lengths()
+        n_sentences = len(sentence_lengths)
+        if max_length is None:
+            max_length = int(sentence_lengths.max()) if n_sentences else 0
+        sentence_story, sentence_position = self.sentence_positions()
+        # Sentence and position in the sentence of every token
+        token_sentence = np.repeat(np.arange(n_sentences), sentence_lengths)
+        token_position = np.arange(len(self.tokens)) - self.sentence_offsets[token_sentence]
+        kept = token_position < max_length
+        ids = np.full((len(self), self.max_story_length(), max_length), pad_id, dtype=np.int32)
+        ids[sentence_story[token_sentence[kept]], sentence_position[token_sentence[kept]], token_position[kept]] = \
+            np.asarray(lookup, dtype=np.int32)[self.tokens[kept]]
+        lengths = np.zeros(ids.shape[:2], dtype=np.int32)
+        lengths[sentence_story, sentence_position] = np.minimum(sentence_lengths, max_length)
+        return ids, lengths
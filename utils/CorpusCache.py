@@ -0,0 +1,122 @@
+import os
+import shutil
+import hashlib
+from .Corpus import Corpus
+from .tokenizer import TOKENIZER_VERSION
+
+
+class CorpusCache:
+    """
+    Content-addressed cache of tokenized corpora.
+    An entry is a compiled corpus (see `utils.Corpus`) stored in `folder/<key>`. The key is a hash of the content of
+    the source file, of the tokenizer version and of the settings used to build the corpus, so an entry is invalidated
+    as soon as one of them changes.
+    When the size of the cache exceeds `max_size` bytes, the least recently used entries are removed.
+    """
+
+    def __init__(self, folder, max_size=None):
+        """
+        :param folder: relative path to the cache folder
+        :param max_size: maximum size of the cache in bytes. Default: no limit.
+        """
+        self.folder = os.path.abspath(os.path.join(os.path.curdir, folder))
+        self.max_size = max_size
+        os.makedirs(self.folder, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Builds the cache from the `tokenization_cache` config value.
+        :return: a CorpusCache or None if the cache is disabled
+        """
+        if not config.is_set('tokenization_cache') or not config.tokenization_cache.is_set('folder') or \
+                config.tokenization_cache.folder is None:
+            return None
+        max_size = None
+        if config.tokenization_cache.is_set('max_size_mb') and config.tokenization_cache.max_size_mb is not None:
+            max_size = config.tokenization_cache.max_size_mb * 1024 * 1024
+        return cls(config.tokenization_cache.folder, max_size)
+
+    @staticmethod
+    def key(file, *settings):
+        """
+        Key of a source file
+        :param file: path to the source file
+        :param settings: anything changing the content of the corpus built from the file
+        """
+        file_hash = hashlib.sha1()
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                file_hash.update(chunk)
+        file_hash.update(repr((TOKENIZER_VERSION,) + settings).encode('utf-8'))
+        return file_hash.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, key)
+
+    def get(self, key):
+        """
+        :return: path of the corpus of the entry or None if not in the cache
+        """
+        entry = self.path(key)
+        if not Corpus.exists(entry):
+            return None
+        # Last access time used for the LRU eviction
+        os.utime(entry)
+        return entry
+
+    def put(self, key, corpus):
+        """
+        Adds a corpus in the cache
+        :param key:
+        :param corpus: Corpus instance
+        :return: path of the entry
+        """
+        entry = self.path(key)
+        # Written in a temporary folder so that other processes never see a partial entry
+        tmp_entry = entry + '.tmp-' + str(os.getpid())
+        corpus.save(tmp_entry)
+        if os.path.exists(entry):
+            shutil.rmtree(tmp_entry)
+        else:
+            os.rename(tmp_entry, entry)
+        os.utime(entry)
+        self.evict(keep=key)
+        return entry
+
+    def entries(self):
+        """
+        :return: list of (last access, size in bytes, key) of the entries
+        """
+        entries = []
+        for key in os.listdir(self.folder):
+            entry = self.path(key)
+            if not os.path.isdir(entry) or '.tmp-' in key:
+                continue
+            size = sum([os.path.getsize(os.path.join(entry, file)) for file in os.listdir(entry)])
+            entries.append((os.path.getmtime(entry), size, key))
+        return entries
+
+    def size(self):
+        return sum([size for _, size, _ in self.entries()])
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used entries until the cache fits in `max_size`.
+        :param keep: key never removed (the entry being used)
+        """
+        if self.max_size is None:
+            return
+        entries = sorted(self.entries())
+        total_size = sum([size for _, size, _ in entries])
+        for _, size, key in entries:
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            total_size -= size
+
+    def clear(self):
+        for _, _, key in self.entries():
+            shutil.rmtree(self.path(key), ignore_errors=True)
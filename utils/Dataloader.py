@@ -2,12 +2,25 @@ __author__ = "Benjamin Devillers (bdvllrs)"
 __credits__ = ["Benjamin Devillers (bdvllrs)"]
 __license__ = "GPL"
 
+import os
 import csv
 import pickle
+import hashlib
 import numpy as np
-from nltk import word_tokenize
 import numpy.random as rd
 from os import path
+from tqdm import tqdm
+from .Corpus import Corpus, encode_words
+from .CorpusCache import CorpusCache
+from .BucketSampler import BucketSampler
+from .NegativeSampler import NegativeSampler
+from .EmbeddingStore import hash_sentences
+from .tokenizer import tokenize_lines
+from .Vocab import Vocab, save_word_list, load_word_list
+
+
+def default_preprocess_fn(word_to_index, sentence):
+    return sentence
 
 
 class Data:
@@ -19,15 +32,27 @@ class Data:
     - original_lines: whole original dataset
     - preprocessed_lines: whole preprocessed dataset
     - sentiment_lines: sentiment analysis for the batch
+    - lengths: (numpy array) lengths of the sentences when the batch is made of token ids (see
+        `Dataloader.compute_token_ids`), None otherwise
+    - line_indexes: indexes of the lines of the batch in the dataset (slice or index array)
+    - dataloader: the `Dataloader` of the batch, None once the batch is pickled (e.g. sent to another process)
     - config: config object
     """
 
-    def __init__(self, batch, sentiment_batch, dataloader, label=None):
+    def __init__(self, batch, sentiment_batch, dataloader, label=None, lengths=None, line_indexes=None):
         self.batch = batch
+        self.lengths = lengths
+        self.line_indexes = line_indexes
         self.sentiments = sentiment_batch
         self.dataloader = dataloader
         self.label = label
 
+    def __getstate__(self):
+        # Sent to other processes (e.g. by a `utils.Prefetcher` with processes) without the whole dataset
+        state = self.__dict__.copy()
+        state['dataloader'] = None
+        return state
+
     def __getitem__(self, item):
         return self.get(item)
 
@@ -52,23 +77,41 @@ class Dataloader:
     To compute the vocab of the Dataset, use `Dataloader.compute_vocab()`.
     Save it with `Dataloader.save_vocab(file, size=-1)` that saves all vocab by default.
     Load it from a file with `Dataloader.load_vocab(file, size=-1)`.
+    # Compiled corpus
+    `Dataloader.save_corpus(folder)` writes the tokenized dataset as token id arrays with offset tables,
+    `Dataloader.load_corpus(folder)` opens them with `np.memmap`.
     """
 
     def __init__(self, config, filename=None, testing_data=False):
         self.config = config
         self.testing_data = testing_data
+        # Vocab attributes, also usable before a dataset is loaded (e.g. `load_vocab` then `save_vocab`)
+        self.word_to_index = {}
+        self.index_to_word = []
+        self.vocab = None
         if filename is not None:
             self.file_path = path.abspath(path.join(path.curdir, filename))
-            with open(self.file_path, newline='') as file:
-                reader = csv.reader(file)
-                self.original_lines = [row for row in reader][1:]
-            self.init_dataset()
-            self.tokenize_dataset()
+            cache = CorpusCache.from_config(config)
+            key = CorpusCache.key(self.file_path, self.testing_data) if cache is not None else None
+            cached_corpus = cache.get(key) if cache is not None else None
+            if cached_corpus is not None:
+                if self.config.debug:
+                    print('Loading tokenized dataset from cache...')
+                self.load_corpus(cached_corpus)
+            else:
+                with open(self.file_path, newline='') as file:
+                    reader = csv.reader(file)
+                    self.original_lines = [row for row in reader][1:]
+                self.init_dataset()
+                self.tokenize_dataset()
+                if cache is not None:
+                    self.corpus_path = cache.put(key, Corpus.from_stories(self.original_lines))
 
     def set_sentiments(self, sentiments):
         """
         Add a Sentiments instance if want to use sentiment analysis.
-        :param sentiments:
+        `Data.sentiments` is then the slice of the batch of the sentence scores (see `compute_sentiment_dataset`).
+        :param sentiments: utils.SentimentsSimple
         """
         self.sentiments = sentiments
         self.compute_sentiment_dataset()
@@ -111,35 +154,41 @@ class Dataloader:
     def __len__(self):
         return len(self.line_number)
 
-    def compute_vocab(self):
+    def count_words(self):
+        """
+        Counts the words of the dataset (all sentences, even the endings) in one pass.
+        :return: utils.Vocab instance, can be merged with the counts of other datasets.
+        """
+        if isinstance(self.original_lines, Corpus):
+            return Vocab().add_corpus(self.original_lines)
+        return Vocab().add_stories(self.original_lines)
+
+    def compute_vocab(self, min_count=1, max_size=None, vocab=None):
         """
         Compute the vocab
+        :param min_count: words seen less than `min_count` times are not kept
+        :param max_size: maximum size of the vocab (special tokens included). Default: all words.
+        :param vocab: utils.Vocab counts to use (e.g. merged counts of several datasets). Default: the counts of
+            this dataset.
         """
-        words = {}
-        for k in range(len(self)):
-            sentences = self.get(k, no_preprocess=True)[0]
-            # We use all words for vocab even those in the resulting sentence
-            for sentence in sentences:
-                for word in sentence:
-                    if word not in self.special_tokens:
-                        if word in words.keys():
-                            words[word] += 1
-                        else:
-                            words[word] = 1
-        self.index_to_word = list(list(zip(*sorted(words.items(), key=lambda w: w[1], reverse=True)))[0])
-        self.index_to_word = [token for token in self.special_tokens] + self.index_to_word
+        self.vocab = vocab if vocab is not None else self.count_words()
+        self.index_to_word = self.vocab.index_to_word(self.special_tokens, min_count, max_size)
+        self.word_to_index = {}
         for k, word in enumerate(self.index_to_word):
             self.word_to_index[word] = k
 
     def save_vocab(self, file, size=-1):
         """
-        Save vocab into pickle file
+        Save vocab into a npz file (see `utils.Vocab.save_word_list`)
         :param file: file location
         :param size: size of the vocab. Default: all vocab
         """
         file_path = path.abspath(path.join(path.curdir, file))
-        with open(file_path, 'wb') as file:
-            pickle.dump(self.index_to_word[:size], file)
+        index_to_word = self.index_to_word[:size]
+        counts = None
+        if self.vocab is not None:
+            counts = [self.vocab[word] for word in index_to_word]
+        save_word_list(file_path, index_to_word, counts)
 
     def save_dataset(self, file):
         """
@@ -148,39 +197,71 @@ class Dataloader:
         """
         file_path = path.abspath(path.join(path.curdir, file))
         with open(file_path, 'wb') as file:
-            pickle.dump(self.original_lines, file)
+            pickle.dump(list(self.original_lines), file)
 
     def load_dataset(self, file):
         """
         Load a dataset file generated by `Dataloader.save_dataset`.
-        :param file: relative path to file
+        The first time a pickled dataset is loaded, it is compiled into a corpus folder next to it (`file.corpus`)
+        which is then used as long as it is more recent than the pickle file.
+        :param file: relative path to file or to a corpus folder
         """
         file_path = path.abspath(path.join(path.curdir, file))
-        with open(file_path, 'rb') as file:
-            self.original_lines = pickle.load(file)
-        self.preprocessed_lines = None
-        self.line_number = list(range(len(self.original_lines)))
-        self.word_to_index = {}
-        self.index_to_word = []
-        self.sentiment_lines = []
-        self.preprocess_fn = lambda w, x: x
-        self.output_fn = lambda data: data
-        self.sentiments = None
+        if path.isdir(file_path):
+            return self.load_corpus(file)
+        corpus_path = file_path + '.corpus'
+        if not Corpus.exists(corpus_path) or path.getmtime(corpus_path) < path.getmtime(file_path):
+            with open(file_path, 'rb') as file:
+                Corpus.from_stories(pickle.load(file)).save(corpus_path)
+        self.load_corpus(corpus_path)
+
+    def save_corpus(self, file):
+        """
+        Saves the tokenized dataset as a compiled corpus (see `utils.Corpus`).
+        :param file: relative path to the corpus folder
+        """
+        file_path = path.abspath(path.join(path.curdir, file))
+        corpus = self.original_lines if isinstance(self.original_lines, Corpus) else Corpus.from_stories(
+            self.original_lines)
+        corpus.save(file_path)
+
+    def load_corpus(self, file):
+        """
+        Load a corpus generated by `Dataloader.save_corpus`. The arrays are memory-mapped.
+        :param file: relative path to the corpus folder
+        """
+        file_path = path.abspath(path.join(path.curdir, file))
+        self.original_lines = Corpus.load(file_path)
+        self.init_attributes()
+        self.corpus_path = file_path
         self.compute_preprocessed()
         self.shuffle_lines()
 
     def load_vocab(self, file, size=-1):
         """
-        Load vocab from file
+        Load vocab from file (saved by `Dataloader.save_vocab` or an older pickled vocab)
         :param file: location of the vocab file
         :param size: size of the vocab. Default: all vocab
         """
         file_path = path.abspath(path.join(path.curdir, file))
-        with open(file_path, 'rb') as file:
-            self.index_to_word = pickle.load(file)[:size]
+        self.index_to_word = load_word_list(file_path)[0][:size]
         for k, word in enumerate(self.index_to_word):
             self.word_to_index[word] = k
 
+    def get_line_indexes(self, index, number=1, random=False):
+        """
+        Indexes of the lines of a batch, going back to the beginning of the dataset at the end.
+        :param index: index in the dataset
+        :param number: number of element to return
+        :param random: if it needs to be randomized
+        :return: a slice if the lines are contiguous (numpy arrays are then sliced without copy), else an index array
+        """
+        index = index % len(self)
+        if not random and index + number <= len(self):
+            return slice(index, index + number)
+        positions = np.arange(index, index + number) % len(self)
+        return self.line_number[positions] if random else positions
+
     def get(self, index, number=1, random=False, no_preprocess=False, raw=False):
         """
         Get some lines:
@@ -191,48 +272,142 @@ class Dataloader:
         :param raw: if True, output_fn will not be executed
         :returns: list of shape `number x 5 x sequence length`.
         """
-        lines = self.original_lines[:] if no_preprocess else self.preprocessed_lines
+        return self.get_lines(self.get_line_indexes(index, number, random), no_preprocess, raw)
+
+    def get_lines(self, line_indexes, no_preprocess=False, raw=False):
+        """
+        Get the lines at the given indexes
+        :param line_indexes: slice or index array (e.g. a batch of a `utils.BucketSampler`)
+        :param no_preprocess: if true, does not preprocess the dataset with the defined preprocess_fn.
+        :param raw: if True, output_fn will not be executed
+        """
+        lines = self.original_lines if no_preprocess else self.preprocessed_lines
 
-        batch = []
+        lengths = None
+        if self.embedding_rows is not None and not no_preprocess:
+            # Sentences embedded in the embedding store: one gather
+            batch = self.embedding_store.gather(self.embedding_rows[line_indexes])
+        elif isinstance(lines, np.ndarray):
+            # Token ids computed by compute_token_ids: view or one gather, padded to the longest sentence of the batch
+            lengths = self.sentence_lengths[line_indexes]
+            batch = lines[line_indexes][:, :, :max(int(lengths.max()) if lengths.size else 0, 1)]
+        elif type(line_indexes) == slice and type(lines) == list:
+            batch = lines[line_indexes]
+        else:
+            batch = [lines[line_index] for line_index in self.line_range(line_indexes)]
         label = []
+        if self.testing_data:
+            if self.labels is None:
+                self.compute_labels()
+            label = self.labels[line_indexes]
         sentiment_batch = []
-        for k in range(number):
-            i = (index + k) % len(self)
-            line_index = i if not random else self.line_number[i]
-            batch.append(lines[line_index])
-            if self.testing_data:
-                # No preprocessing for the label
-                label.append(int(self.original_lines[line_index][6][0]))
-            if self.sentiments is not None:
-                sentiment_batch.append(self.sentiment_lines[line_index])
-        batch = Data(batch, sentiment_batch, self, label=label)
+        if self.sentiments is not None:
+            sentiment_batch = self.sentiment_lines[line_indexes]
+        batch = Data(batch, sentiment_batch, self, label=label, lengths=lengths, line_indexes=line_indexes)
         return self.output_fn(batch) if not raw else batch
 
-    def get_batch(self, batch_size, epochs, random=True):
+    def line_range(self, line_indexes):
+        """
+        Indexes of the lines selected by line_indexes, without allocating an index array for the whole dataset
+        :param line_indexes: slice or index array
+        :return: range for a slice, line_indexes otherwise
+        """
+        if type(line_indexes) == slice:
+            return range(*line_indexes.indices(len(self)))
+        return line_indexes
+
+    def get_sentences(self, line_indexes, position, no_preprocess=False):
+        """
+        Get one sentence of every given line, without building a batch
+        :param line_indexes: slice or index array
+        :param position: position of the sentence in the story (e.g. 4 for the ending)
+        :param no_preprocess: if true, does not preprocess the dataset with the defined preprocess_fn.
+        :return: float array of shape `number x embedding size` with an embedding store, int32 array of shape
+            `number x max_length` with token ids (not trimmed), else a list of sentences
+        """
+        lines = self.original_lines if no_preprocess else self.preprocessed_lines
+        if self.embedding_rows is not None and not no_preprocess:
+            return self.embedding_store.gather(self.embedding_rows[line_indexes, position])
+        if isinstance(lines, np.ndarray):
+            return lines[line_indexes, position]
+        return [lines[line_index][position] for line_index in self.line_range(line_indexes)]
+
+    def negative_sampler(self, position=4, neighbours=None, random_state=None):
+        """
+        Sampler of sentences of other stories, to replace the endings of a batch by negative examples.
+        :param position: position of the drawn sentences in the stories
+        :param neighbours: table of candidate stories for hard negatives (see `utils.NegativeSampler`)
+        :param random_state: np.random.RandomState. Default: the global numpy generator.
+        :return: utils.NegativeSampler
+        """
+        return NegativeSampler(self, position, neighbours, random_state)
+
+    def get_batch(self, batch_size, epochs, random=True, raw=False, sampler=None):
         """
         Get a batch
         :param batch_size:
         :param epochs: number of epochs
         :param random: if the sentences should be randomized.
+        :param raw: if True, yields the Data objects without applying output_fn (e.g. to apply it in a
+            `utils.Prefetcher`)
+        :param sampler: iterable of index arrays giving the batches of an epoch (e.g. `Dataloader.bucket_sampler`).
+            batch_size and random are then not used.
         :return: generator
         """
         for _ in range(epochs):
+            if sampler is not None:
+                for line_indexes in sampler:
+                    yield self.get_lines(line_indexes, raw=raw)
+                continue
             for k in range(0, len(self), batch_size):
-                batch = self.get(k, batch_size, random)
+                batch = self.get(k, batch_size, random, raw=raw)
                 yield batch
 
-    def init_dataset(self):
+    def bucket_sampler(self, batch_size, n_buckets=10, drop_last=False, seed=None):
         """
-        Internal function. Initialize dataset
+        Sampler of batches of stories with sentences of similar lengths, to use with `get_batch`.
+        In debug mode, prints the padding ratio compared to random batches.
+        :param batch_size:
+        :param n_buckets: number of buckets of lengths
+        :param drop_last: if True, the last batch of an epoch is dropped when smaller than batch_size
+        :param seed: seed of the sampler
+        :return: utils.BucketSampler
+        """
+        lengths = self.sentence_lengths
+        if lengths is None:
+            corpus = self.original_lines if isinstance(self.original_lines, Corpus) else Corpus.from_stories(
+                self.original_lines)
+            lengths = corpus.length_matrix()
+        sampler = BucketSampler(lengths, batch_size, n_buckets, drop_last, seed)
+        if self.config.debug:
+            print('Padding ratio: {0:.3f} (random batches: {1:.3f})'.format(sampler.padding_ratio(),
+                                                                             sampler.random_padding_ratio()))
+        return sampler
+
+    def init_attributes(self):
+        """
+        Internal function. Resets the attributes depending on `original_lines`
         """
         self.preprocessed_lines = None
-        self.line_number = list(range(len(self.original_lines)))
+        self.sentence_lengths = None
+        self.line_number = np.arange(len(self.original_lines))
+        self.labels = None
         self.word_to_index = {}
         self.index_to_word = []
+        self.vocab = None
         self.sentiment_lines = []
-        self.preprocess_fn = lambda w, x: x
+        self.preprocess_fn = default_preprocess_fn
         self.output_fn = lambda data: data
         self.sentiments = None
+        self.embedding_store = None
+        self.embedding_rows = None
+        self.corpus_path = None
+
+    def init_dataset(self):
+        """
+        Internal function. Initialize dataset
+        """
+        self.init_attributes()
 
         def extract_sentences(x):
             to_return = x[2:7] if not self.testing_data else x[1:9]
@@ -242,15 +417,78 @@ class Dataloader:
         self.compute_preprocessed()
         self.shuffle_lines()
 
-    def tokenize_dataset(self):
-        tokenize_fn = lambda x: list(map(lambda s: word_tokenize(s.lower()), x))
+    def tokenize_dataset(self, progress_fn=None):
+        """
+        Tokenizes the dataset with `config.nthreads` processes.
+        :param progress_fn: callback called with the number of stories tokenized since the last call.
+            Default: a progress bar in debug mode.
+        """
+        nthreads = self.config.nthreads if self.config.is_set('nthreads') else 1
+        progress_bar = None
         if self.config.debug:
             print('Tokenizing dataset...')
-        self.original_lines = list(map(tokenize_fn, self.original_lines))
+            if progress_fn is None:
+                progress_bar = tqdm(total=len(self.original_lines))
+                progress_fn = progress_bar.update
+        self.original_lines = tokenize_lines(self.original_lines, nthreads, progress_fn=progress_fn)
+        self.compute_preprocessed()
+        if progress_bar is not None:
+            progress_bar.close()
         if self.config.debug:
             print('Tokenized.')
 
+    def sentences(self):
+        """
+        :return: iterator over all the tokenized sentences of the dataset, story by story
+        """
+        if isinstance(self.original_lines, Corpus):
+            corpus = self.original_lines
+            return (corpus.sentence(k) for k in range(len(corpus.sentence_offsets) - 1))
+        return (sentence for line in self.original_lines for sentence in line)
+
+    def set_embedding_store(self, store):
+        """
+        Uses the embeddings of an `utils.EmbeddingStore` as preprocessed sentences: `Data.batch` is then a float
+        array of shape `number x sentences x embedding size`.
+        :param store: EmbeddingStore containing all the sentences of the dataset
+        """
+        hashes = hash_sentences(self.sentences())
+        if isinstance(self.original_lines, Corpus):
+            corpus = self.original_lines
+            rows = np.zeros((len(corpus), corpus.max_story_length()), dtype=np.int64)
+            rows[corpus.sentence_positions()] = store.lookup_hashes(hashes)
+        else:
+            rows = store.lookup_hashes(hashes).reshape(len(self.original_lines), -1)
+        self.embedding_store = store
+        self.embedding_rows = rows
+
+    def compute_token_ids(self, max_length=None, unk_token='<unk>', pad_token='<pad>'):
+        """
+        Converts the whole dataset to word indexes (from the loaded vocab) in one vectorized pass.
+        Replaces a `preprocess_fn` mapping words to `word_to_index`: `Data.batch` then is a slice of an int32 array of
+        shape `number x sentences x max_length` and `Data.lengths` the lengths of the sentences.
+        :param max_length: sentences are truncated to `max_length` words. Default: length of the longest sentence.
+        :param unk_token: token used for words not in the vocab
+        :param pad_token: token used for padding. If not in the vocab, index 0 is used.
+        """
+        assert unk_token in self.word_to_index, "Please load a vocab containing the {} token.".format(unk_token)
+        if self.config.debug:
+            print('Computing token ids...')
+        corpus = self.original_lines if isinstance(self.original_lines, Corpus) else Corpus.from_stories(
+            self.original_lines)
+        unk_id = self.word_to_index[unk_token]
+        lookup = np.array([self.word_to_index.get(word, unk_id) for word in corpus.words], dtype=np.int32)
+        self.preprocessed_lines, self.sentence_lengths = corpus.id_matrices(lookup,
+                                                                            self.word_to_index.get(pad_token, 0),
+                                                                            max_length)
+        if self.config.debug:
+            print('Computed.')
+
     def compute_preprocessed(self):
+        if self.preprocess_fn is default_preprocess_fn:
+            # Nothing to apply, avoids copying (or decoding a compiled corpus) for nothing
+            self.preprocessed_lines = self.original_lines
+            return
         if self.config.debug:
             print('Applying preprocessing to dataset...')
         preprocess_fn = lambda x: list(map(lambda s: self.preprocess_fn(self.word_to_index, s), x))
@@ -258,11 +496,54 @@ class Dataloader:
         if self.config.debug:
             print('Applied.')
 
+    def compute_labels(self):
+        """
+        Reads the label (right ending) of every story of a testing set.
+        """
+        if isinstance(self.original_lines, Corpus):
+            corpus = self.original_lines
+            # The label is the first token of the 7th sentence
+            label_tokens = corpus.tokens[corpus.sentence_offsets[corpus.story_offsets[:-1] + 6]]
+            label_ids, inverse = np.unique(label_tokens, return_inverse=True)
+            self.labels = np.array([int(corpus.words[k]) for k in label_ids], dtype=np.int64)[inverse]
+        else:
+            self.labels = np.array([int(line[6][0]) for line in self.original_lines], dtype=np.int64)
+
     def compute_sentiment_dataset(self):
-        self.sentiment_lines = []
-        for batch in range(len(self)):
-            scores = []
-            for sentence in self.original_lines[batch]:
-                score = self.sentiments.sentence_score(sentence)
-                scores.append(score)
-            self.sentiment_lines.append(scores)
+        """
+        Scores every sentence of the dataset in one vectorized pass over the token ids (see
+        `SentimentsSimple.corpus_scores`). `sentiment_lines` is a float array of shape `number x sentences`.
+        When the dataset comes from a compiled corpus (`load_corpus`, `load_dataset` or the tokenization cache), the
+        scores are saved next to it in `sentiments-<hash of the lexicon>.npy` and memory-mapped the next times. The
+        folder of a tokenization cache entry can be evicted by another process at any time: the scores are then only
+        kept in memory.
+        """
+        lexicon_hash = hashlib.sha1(encode_words(self.sentiments.index_to_word).tobytes())
+        lexicon_hash.update(np.ascontiguousarray(self.sentiments.scores, dtype=np.float64).tobytes())
+        scores_file = None
+        if self.corpus_path is not None:
+            scores_file = path.join(self.corpus_path, 'sentiments-' + lexicon_hash.hexdigest() + '.npy')
+            try:
+                # Older than the corpus: the corpus was compiled again
+                if path.getmtime(scores_file) >= path.getmtime(path.join(self.corpus_path, 'tokens.npy')):
+                    self.sentiment_lines = np.load(scores_file, mmap_mode='r')
+                    return
+            except OSError:
+                pass
+
+        corpus = self.original_lines if isinstance(self.original_lines, Corpus) else Corpus.from_stories(
+            self.original_lines)
+        sentence_scores = self.sentiments.corpus_scores(corpus)
+        sentiment_lines = np.zeros((len(corpus), corpus.max_story_length()), dtype=np.float64)
+        sentiment_lines[corpus.sentence_positions()] = sentence_scores
+        self.sentiment_lines = sentiment_lines
+
+        if scores_file is not None:
+            # Written in a temporary file so that other processes never see a partial file
+            tmp_file = scores_file + '.tmp-' + str(os.getpid()) + '.npy'
+            try:
+                np.save(tmp_file, sentiment_lines)
+                os.replace(tmp_file, scores_file)
+            except OSError:
+                if path.isfile(tmp_file):
+                    os.remove(tmp_file)
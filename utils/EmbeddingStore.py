@@ -0,0 +1,262 @@
+import os
+import shutil
+import hashlib
+import numpy as np
+
+
+def normalize_sentence(sentence):
+    """
+    Text used as key of a sentence: tokens separated by one space.
+    :param sentence: tokenized sentence (list of words) or string
+    """
+    if isinstance(sentence, str):
+        return ' '.join(sentence.split())
+    return ' '.join(sentence)
+
+
+def hash_sentences(sentences):
+    """
+    64 bits hash of the normalized text of every sentence.
+    :param sentences: iterable of sentences (list of words or strings)
+    :return: uint64 array
+    """
+    digests = b''.join([hashlib.blake2b(normalize_sentence(sentence).encode('utf-8'), digest_size=8).digest()
+                        for sentence in sentences])
+    return np.frombuffer(digests, dtype='<u8').astype(np.uint64)
+
+
+class EmbeddingStore:
+    """
+    Persistent store of sentence embeddings (e.g. sent2vec or ELMo outputs) keyed by the normalized text of the
+    sentences.
+    A store is a folder holding:
+    - vectors-<k>.npy: shards of the float32 embedding matrix, opened with `np.memmap`
+    - index.npz: sorted hashes of the sentences (see `hash_sentences`), row of every hash in the embedding matrix
+        and offsets of the shards in the matrix
+    The store is filled once with batched calls to the embedding function, the lookups are then a binary search
+    in the hashes and a gather in the shards. Adding sentences writes new shards and only rewrites the index.
+    """
+
+    def __init__(self, shards, hashes, rows, offsets):
+        self.shards = shards
+        self.hashes = hashes
+        self.rows = rows
+        self.offsets = offsets
+
+    @staticmethod
+    def shard_file(directory, k):
+        return os.path.join(directory, 'vectors-{0:05d}.npy'.format(k))
+
+    @classmethod
+    def load(cls, directory):
+        """
+        :param directory: path of the store folder
+        """
+        with np.load(os.path.join(directory, 'index.npz')) as index:
+            hashes, rows, offsets = index['hashes'], index['rows'], index['offsets']
+        shards = [np.load(cls.shard_file(directory, k), mmap_mode='r') for k in range(len(offsets) - 1)]
+        return cls(shards, hashes, rows, offsets)
+
+    @staticmethod
+    def exists(directory):
+        return os.path.isfile(os.path.join(directory, 'index.npz'))
+
+    @classmethod
+    def build(cls, directory, sentences, embed_fn, batch_size=1024, progress_fn=None, store=None, shard_size=65536):
+        """
+        Embeds the sentences and saves the store.
+        :param directory: path of the store folder
+        :param sentences: iterable of sentences (list of words or strings). Duplicates are only embedded once.
+        :param embed_fn: function taking a list of strings and returning a float matrix (e.g. the
+            `embed_sentences` method of a sent2vec model)
+        :param batch_size: number of sentences given to embed_fn at once
+        :param progress_fn: callback called with the number of sentences embedded since the last call
+        :param store: EmbeddingStore saved in `directory`, only the sentences missing from it are embedded and
+            written in new shards
+        :param shard_size: maximum number of sentences in a shard
+        :return: the new store
+        """
+        texts = {}
+        for sentence in sentences:
+            texts.setdefault(normalize_sentence(sentence), None)
+        texts = list(texts.keys())
+        hashes = hash_sentences(texts)
+        if store is not None:
+            missing = ~store.contains(hashes)
+            texts, hashes = [text for text, m in zip(texts, missing) if m], hashes[missing]
+        # Keeps the first sentence of colliding hashes
+        hashes, first = np.unique(hashes, return_index=True)
+        texts = [texts[k] for k in first]
+        if store is None and not len(texts):
+            raise ValueError('No sentence to embed.')
+
+        if store is None:
+            # Written in a temporary folder so that other processes never see a partial store
+            target = directory
+            directory = directory.rstrip(os.sep) + '.tmp-' + str(os.getpid())
+            os.makedirs(directory, exist_ok=True)
+            offsets = [0]
+        else:
+            offsets = list(store.offsets)
+        for start in range(0, len(texts), shard_size):
+            shard_texts = texts[start:start + shard_size]
+            shard = None
+            for k in range(0, len(shard_texts), batch_size):
+                batch = shard_texts[k:k + batch_size]
+                vectors = np.asarray(embed_fn(batch), dtype=np.float32).reshape(len(batch), -1)
+                if shard is None:
+                    shard = np.lib.format.open_memmap(cls.shard_file(directory, len(offsets) - 1), mode='w+',
+                                                      dtype=np.float32, shape=(len(shard_texts), vectors.shape[1]))
+                shard[k:k + len(batch)] = vectors
+                if progress_fn is not None:
+                    progress_fn(len(batch))
+            shard.flush()
+            del shard
+            offsets.append(offsets[-1] + len(shard_texts))
+
+        rows = np.arange(offsets[-1] - len(texts), offsets[-1], dtype=np.int64)
+        if store is not None:
+            hashes = np.concatenate((store.hashes, hashes))
+            rows = np.concatenate((store.rows, rows))
+        order = np.argsort(hashes, kind='stable')
+        # The index is replaced at once, the new shards are not used before
+        with open(os.path.join(directory, 'index.tmp.npz'), 'wb') as f:
+            np.savez(f, hashes=hashes[order], rows=rows[order], offsets=np.array(offsets, dtype=np.int64))
+        os.replace(os.path.join(directory, 'index.tmp.npz'), os.path.join(directory, 'index.npz'))
+
+        if store is None:
+            if os.path.exists(target):
+                shutil.rmtree(target)
+            os.rename(directory, target)
+            directory = target
+        return cls.load(directory)
+
+    @classmethod
+    def update(cls, directory, sentences, embed_fn, batch_size=1024, progress_fn=None, shard_size=65536):
+        """
+        Opens the store, adding the sentences it does not contain yet (builds it if it does not exist).
+        embed_fn is only called if some sentences are missing.
+        See `EmbeddingStore.build` for the parameters.
+        """
+        sentences = list(sentences)
+        store = None
+        if cls.exists(directory):
+            store = cls.load(directory)
+            if store.contains(hash_sentences(sentences)).all():
+                return store
+        return cls.build(directory, sentences, embed_fn, batch_size, progress_fn, store, shard_size)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, sentence):
+        return bool(self.contains(hash_sentences([sentence]))[0])
+
+    def __getitem__(self, sentence):
+        return self.gather(self.lookup([sentence]))[0]
+
+    @property
+    def dim(self):
+        return self.shards[0].shape[1]
+
+    def contains(self, hashes):
+        """
+        :param hashes: uint64 array of hashes
+        :return: bool array, True for the hashes in the store
+        """
+        if not len(self.hashes):
+            return np.zeros(len(hashes), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+        return self.hashes[positions] == hashes
+
+    def lookup_hashes(self, hashes):
+        """
+        :param hashes: uint64 array of hashes (any shape)
+        :return: rows in the embedding matrix of the hashes
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        flat = hashes.reshape(-1)
+        if not self.contains(flat).all():
+            raise KeyError('Some sentences are not in the embedding store.')
+        return self.rows[np.searchsorted(self.hashes, flat)].reshape(hashes.shape)
+
+    def lookup(self, sentences):
+        """
+        :param sentences: list of sentences (list of words or strings)
+        :return: rows in the embedding matrix of the sentences
+        """
+        return self.lookup_hashes(hash_sentences(sentences))
+
+    def gather(self, rows):
+        """
+        :param rows: int array of rows of the embedding matrix (any shape)
+        :return: float32 array of shape `rows.shape x dim`
+        """
+        rows = np.asarray(rows)
+        if len(self.shards) == 1:
+            return np.asarray(self.shards[0][rows])
+        shard_ids = np.searchsorted(self.offsets, rows, side='right') - 1
+        vectors = np.empty(rows.shape + (self.dim,), dtype=np.float32)
+        for k in np.unique(shard_ids):
+            mask = shard_ids == k
+            vectors[mask] = self.shards[k][rows[mask] - self.offsets[k]]
+        return vectors
+
+    def embed_sentences(self, sentences):
+        """
+        Same as `embed_sentences` of a sent2vec model, for stored sentences.
+        :param sentences: list of sentences (list of words or strings)
+        :return: float32 matrix
+        """
+        return self.gather(self.lookup(sentences))
+
+    def predict(self, sentences, batch_size=None):
+        """
+        Same as the `predict` method of a keras embedding model taking strings, for stored sentences.
+        """
+        return self.embed_sentences(sentences)
+
+
+def sent2vec_store(config, datasets):
+    """
+    Opens the embedding store of the `sent2vec.store` config, adding the sentences of the datasets not embedded yet.
+    The sent2vec model (`sent2vec.model` config) is only loaded when some sentences are missing.
+    :param config:
+    :param datasets: list of `Dataloader`, their embedding store is set to the returned store
+    :return: EmbeddingStore
+    """
+    assert config.sent2vec.is_set('store') and config.sent2vec.store is not None, \
+        "Please add sent2vec.store config value."
+    directory = os.path.abspath(os.path.join(os.curdir, config.sent2vec.store))
+    model = []
+
+    def embed_fn(sentences):
+        if not model:
+            import sent2vec
+            assert config.sent2vec.model is not None, "Please add sent2vec_model config value."
+            model.append(sent2vec.Sent2vecModel())
+            model[0].load_model(config.sent2vec.model)
+            if config.debug:
+                print('Embedding sentences with sent2vec...')
+        return model[0].embed_sentences(sentences)
+
+    sentences = [sentence for dataset in datasets for sentence in dataset.sentences()]
+    store = EmbeddingStore.update(directory, sentences, embed_fn)
+    for dataset in datasets:
+        dataset.set_embedding_store(store)
+    return store
+
+
+class EmbeddedOutputFn:
+    """
+    Wraps an output_fn returning `(inputs, labels)` where the inputs are arrays of sentences (strings): the sentences
+    are replaced by their embeddings read from a store.
+    """
+
+    def __init__(self, output_fn, store):
+        self.output_fn = output_fn
+        self.store = store
+
+    def __call__(self, *args):
+        inputs, labels = self.output_fn(*args)
+        return [self.store.embed_sentences(sentences) for sentences in inputs], labels
@@ -0,0 +1,145 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def sentence_key(sentence):
+    """
+    Key of a sentence in the cache: tuple of its tokens.
+    :param sentence: string (split on whitespaces), list or array of words, or list of sentences (tuple of their keys)
+    """
+    if isinstance(sentence, str):
+        return tuple(sentence.split())
+    if isinstance(sentence, np.ndarray):
+        sentence = sentence.tolist()
+    if len(sentence) and not isinstance(sentence[0], str):
+        return tuple(sentence_key(s) for s in sentence)
+    return tuple(sentence)
+
+
+class EncoderCache:
+    """
+    Memoization of a sentence encoder (sent2vec, InferSent, ELMo...) with a memory budget and LRU eviction.
+    The encoder is a function taking a list of sentences and returning one output per sentence. Every call only
+    encodes, in one batch, the sentences missing from the cache.
+    The cache has the methods of the encoders it replaces, so a script opts in by wrapping its model:
+    ```python
+    sent2vec_model = EncoderCache.from_config(sent2vec_model.embed_sentences, config)
+    sent2vec_model.embed_sentence(sentence)
+    elmo_model = EncoderCache.from_config(elmo_model.predict, config, min_batch_size=2)
+    elmo_model.predict(sentences, batch_size=len(batch))
+    ```
+    """
+
+    def __init__(self, encode_fn, max_size_mb=512, key_fn=sentence_key, min_batch_size=1):
+        """
+        :param encode_fn: function taking a list (or array) of sentences and returning their outputs
+        :param max_size_mb: memory budget of the cached outputs in MB
+        :param key_fn: function giving the hashable key of a sentence
+        :param min_batch_size: minimum number of sentences given to encode_fn, the batch is completed by repeating
+            the last sentence (for encoders that cannot take a single sentence)
+        """
+        self.encode_fn = encode_fn
+        self.max_bytes = int(max_size_mb * 2 ** 20)
+        self.key_fn = key_fn
+        self.min_batch_size = min_batch_size
+        self.cache = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, encode_fn, config, **kwargs):
+        """
+        Uses the `encoder_cache.max_size_mb` config value.
+        """
+        if config.encoder_cache.is_set('max_size_mb'):
+            kwargs.setdefault('max_size_mb', config.encoder_cache.max_size_mb)
+        return cls(encode_fn, **kwargs)
+
+    def __len__(self):
+        return len(self.cache)
+
+    def stats(self):
+        """
+        :return: dict with the number of hits and misses, the hit rate, the number of cached sentences and their size
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.,
+                'size': len(self.cache), 'mb': self.n_bytes / 2 ** 20}
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.n_bytes = 0
+
+    def add(self, key, value):
+        with self.lock:
+            if key in self.cache or value.nbytes > self.max_bytes:
+                return
+            self.cache[key] = value
+            self.n_bytes += value.nbytes
+            while self.n_bytes > self.max_bytes:
+                _, evicted = self.cache.popitem(last=False)
+                self.n_bytes -= evicted.nbytes
+
+    def encode(self, sentences):
+        """
+        :param sentences: list or array of sentences
+        :return: list of the outputs of the sentences
+        """
+        keys = [self.key_fn(sentence) for sentence in sentences]
+        outputs = [None] * len(keys)
+        missing = OrderedDict()
+        with self.lock:
+            for k, key in enumerate(keys):
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    outputs[k] = self.cache[key]
+                else:
+                    missing.setdefault(key, []).append(k)
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            first = [positions[0] for positions in missing.values()]
+            first += first[-1:] * (self.min_batch_size - len(first))
+            if isinstance(sentences, np.ndarray):
+                batch = sentences[first]
+            else:
+                batch = [sentences[k] for k in first]
+            values = self.encode_fn(batch)
+            for (key, positions), value in zip(missing.items(), values):
+                # Copied so that a cached output does not keep the whole batch in memory
+                value = np.array(value)
+                for k in positions:
+                    outputs[k] = value
+                self.add(key, value)
+        return outputs
+
+    def __call__(self, sentences):
+        return np.array(self.encode(sentences))
+
+    def embed_sentences(self, sentences):
+        """
+        Same as the `embed_sentences` method of a sent2vec model
+        """
+        return self(sentences)
+
+    def embed_sentence(self, sentence):
+        """
+        Same as the `embed_sentence` method of a sent2vec model
+        """
+        return self.encode([sentence])[0]
+
+    def predict(self, sentences, batch_size=None):
+        """
+        Same as the `predict` method of a keras model taking sentences
+        """
+        return self(sentences)
+
+    def encode_groups(self, groups, **kwargs):
+        """
+        Same as `BLSTMEncoder.encode_groups`, a group of sentences being the cached item
+        """
+        return self.encode(groups)
@@ -0,0 +1,107 @@
+import os
+import numpy as np
+import tensorflow as tf
+from .EmbeddingStore import EmbeddingStore
+
+embedding_types = {
+    "elmo": {
+        "name": "elmo",
+        "url": "https://tfhub.dev/google/elmo/1",
+        "size": 1024
+    },
+    "use": {
+        "name": "use",
+        "url": "https://tfhub.dev/google/universal-sentence-encoder/1",
+        "size": 512
+    }
+}
+
+
+class HubEmbedder:
+    """
+    Sentence encoder of TF-Hub (ELMo or Universal Sentence Encoder) run in its own graph and session, to embed
+    sentences in batches outside of a keras model.
+    """
+
+    def __init__(self, embedding_type='elmo', cache_dir=None):
+        """
+        :param embedding_type: key of `embedding_types`
+        :param cache_dir: folder where TF-Hub downloads the modules
+        """
+        import tensorflow_hub as hub
+        if cache_dir is not None:
+            os.environ['TFHUB_CACHE_DIR'] = cache_dir
+        self.embedding_type = embedding_types[embedding_type]
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.sentences = tf.placeholder(tf.string, shape=(None,))
+            module = hub.Module(self.embedding_type['url'])
+            if self.embedding_type['name'] == "elmo":
+                self.embeddings = module(self.sentences, signature="default", as_dict=True)["default"]
+            else:
+                self.embeddings = module(self.sentences)
+            initializers = [tf.global_variables_initializer(), tf.tables_initializer()]
+        self.session = tf.Session(graph=self.graph)
+        self.session.run(initializers)
+
+    def __call__(self, sentences):
+        """
+        :param sentences: list of strings
+        :return: float matrix of shape `len(sentences) x embedding size`
+        """
+        return self.session.run(self.embeddings, {self.sentences: np.array(sentences, dtype=object)})
+
+    def close(self):
+        self.session.close()
+
+
+def hub_precompute(config):
+    """
+    :return: True if the scripts should read the embeddings of the hub module from the store (`hub.precompute`)
+    """
+    return config.hub.is_set('precompute') and config.hub.precompute
+
+
+def hub_store(config, sentences, embedding_type=None):
+    """
+    Opens the embedding store of the `hub.store` config for the module of the `embedding_type` config, adding the
+    sentences not embedded yet. The module is only loaded when some sentences are missing, it then embeds them in
+    batches of `hub.batch_size` sentences.
+    :param config:
+    :param sentences: iterable of sentences (list of words or strings)
+    :param embedding_type: key of `embedding_types`. Default: `embedding_type` config value or elmo.
+    :return: EmbeddingStore
+    """
+    assert config.hub.is_set('store') and config.hub.store is not None, "Please add hub.store config value."
+    if embedding_type is None:
+        embedding_type = config.embedding_type if config.is_set('embedding_type') else 'elmo'
+    directory = os.path.abspath(os.path.join(os.curdir, config.hub.store, embedding_type))
+    batch_size = config.hub.batch_size if config.hub.is_set('batch_size') else 256
+    embedder = []
+
+    def embed_fn(batch):
+        if not embedder:
+            if config.debug:
+                print('Embedding sentences with the', embedding_type, 'module...')
+            cache_dir = config.hub.cache_dir if config.hub.is_set('cache_dir') else None
+            embedder.append(HubEmbedder(embedding_type, cache_dir))
+        return embedder[0](batch)
+
+    store = EmbeddingStore.update(directory, sentences, embed_fn, batch_size)
+    if embedder:
+        embedder[0].close()
+    return store
+
+
+def elmo_sentences(*datasets, separator=" "):
+    """
+    Sentences embedded by the ELMo output functions of the scripts, to give to `hub_store`: the beginning of every
+    story as one string, then its endings (the sixth sentence only exists in the testing sets).
+    :param datasets: Dataloader instances
+    :param separator: string put between the sentences of the beginning
+    """
+    for dataset in datasets:
+        for story in dataset.original_lines:
+            yield separator.join([" ".join(sentence) for sentence in story[:4]])
+            for sentence in story[4:6]:
+                yield " ".join(sentence)
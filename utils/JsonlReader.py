@@ -0,0 +1,222 @@
+import os
+import json
+import mmap
+import shutil
+import numpy as np
+
+
+def encode_strings(strings):
+    """
+    Packs strings into a uint8 array (utf-8) and the offsets of every string in it.
+    :param strings: list of strings
+    :return: (blob, offsets) offsets has `len(strings) + 1` values
+    """
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def decode_string(blob, offsets, k):
+    """
+    Inverse of `encode_strings` for one string.
+    """
+    return bytes(blob[offsets[k]:offsets[k + 1]]).decode('utf-8')
+
+
+class JsonlReader:
+    """
+    Random access to the lines of a jsonl file by their seek position.
+    The file is memory-mapped once. A batch of positions is read in increasing order (mostly sequential reads) and
+    decoded with a single `json.loads`.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.handle = None
+        self.map = None
+
+    def __getstate__(self):
+        # The memory map is opened again by every process
+        return {'file': self.file, 'handle': None, 'map': None}
+
+    def open(self):
+        if self.map is None:
+            self.handle = open(self.file, 'rb')
+            size = os.fstat(self.handle.fileno()).st_size
+            self.map = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        return self.map
+
+    def close(self):
+        if self.map is not None and not isinstance(self.map, bytes):
+            self.map.close()
+        if self.handle is not None:
+            self.handle.close()
+        self.handle, self.map = None, None
+
+    def line_positions(self):
+        """
+        :return: int64 array of the seek positions of the lines of the file
+        """
+        data = np.frombuffer(self.open(), dtype=np.uint8)
+        ends = np.flatnonzero(data == ord('\n'))
+        positions = np.concatenate(([0], ends + 1)).astype(np.int64)
+        # No line after the last new line
+        return positions[positions < len(data)]
+
+    def read(self, positions):
+        """
+        :param positions: seek positions of the lines
+        :return: list of the decoded lines, in the order of positions
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        data = self.open()
+        order = np.argsort(positions, kind='stable')
+        chunks = []
+        for position in positions[order]:
+            end = data.find(b'\n', position)
+            chunks.append(data[position:end if end >= 0 else len(data)])
+        decoded = json.loads(b'[' + b','.join(chunks) + b']')
+        lines = [None] * len(positions)
+        for k, line in zip(order, decoded):
+            lines[k] = line
+        return lines
+
+
+class ColumnReader:
+    """
+    Pre-parsed columnar copy of some string fields of a jsonl file, read like a `JsonlReader` without parsing json.
+    A cache is a folder holding `positions.npy`, the seek positions of the lines in the jsonl file, for every
+    field `<field>.npy` and `<field>-offsets.npy` (see `encode_strings`), and `source.npy`, the size and modification
+    time of the jsonl file, so that the cache is built again when the file changes.
+    """
+
+    def __init__(self, positions, fields, columns):
+        self.positions = positions
+        self.fields = fields
+        self.columns = columns
+
+    @staticmethod
+    def parse(file, fields):
+        """
+        Parses the jsonl file once.
+        :param file: path of the jsonl file
+        :param fields: names of the fields to keep. Missing fields are kept as empty strings.
+        :return: (positions, values) the seek positions of the lines and the list of the values of every field
+        """
+        positions = []
+        values = [[] for _ in fields]
+        with open(file, 'rb') as f:
+            position = f.tell()
+            line = f.readline()
+            while line:
+                if line.strip():
+                    json_line = json.loads(line)
+                    positions.append(position)
+                    for k, field in enumerate(fields):
+                        values[k].append(json_line.get(field, ''))
+                position = f.tell()
+                line = f.readline()
+        return np.array(positions, dtype=np.int64), values
+
+    @staticmethod
+    def save_columns(directory, positions, fields, values):
+        for field, field_values in zip(fields, values):
+            blob, offsets = encode_strings(field_values)
+            np.save(os.path.join(directory, field + '.npy'), blob)
+            np.save(os.path.join(directory, field + '-offsets.npy'), offsets)
+        np.save(os.path.join(directory, 'positions.npy'), positions)
+
+    @staticmethod
+    def source_stamp(file):
+        """
+        :return: int64 array with the size and the modification time (ns) of a file
+        """
+        stat = os.stat(file)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    @classmethod
+    def save_source(cls, directory, file):
+        np.save(os.path.join(directory, 'source.npy'), cls.source_stamp(file))
+
+    @classmethod
+    def is_source(cls, directory, file):
+        """
+        :return: True if the cache folder was built from the current version of the file
+        """
+        source_file = os.path.join(directory, 'source.npy')
+        return os.path.isfile(source_file) and np.array_equal(np.load(source_file), cls.source_stamp(file))
+
+    @classmethod
+    def build(cls, file, directory, fields):
+        """
+        Parses the jsonl file once and saves the fields of every line.
+        :param file: path of the jsonl file
+        :param directory: path of the cache folder
+        :param fields: names of the fields to keep. Missing fields are saved as empty strings.
+        """
+        positions, values = cls.parse(file, fields)
+        # Written in a temporary folder so that other processes never see a partial cache
+        tmp_directory = directory.rstrip(os.sep) + '.tmp-' + str(os.getpid())
+        os.makedirs(tmp_directory, exist_ok=True)
+        cls.save_columns(tmp_directory, positions, fields, values)
+        cls.save_source(tmp_directory, file)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.rename(tmp_directory, directory)
+        return cls.load(directory, fields)
+
+    @classmethod
+    def load(cls, directory, fields):
+        """
+        Opens the arrays with `np.memmap`.
+        """
+        columns = {}
+        for field in fields:
+            columns[field] = (np.load(os.path.join(directory, field + '.npy'), mmap_mode='r'),
+                              np.load(os.path.join(directory, field + '-offsets.npy'), mmap_mode='r'))
+        return cls(np.load(os.path.join(directory, 'positions.npy'), mmap_mode='r'), fields, columns)
+
+    @classmethod
+    def exists(cls, directory, fields, file=None):
+        """
+        :param file: if given, the cache must also have been built from the current version of this file
+        """
+        return os.path.isfile(os.path.join(directory, 'positions.npy')) and \
+               all([os.path.isfile(os.path.join(directory, field + '.npy')) for field in fields]) and \
+               (file is None or cls.is_source(directory, file))
+
+    @classmethod
+    def open(cls, file, directory, fields):
+        """
+        Opens the cache of the jsonl file, building it the first time or when the file changed.
+        """
+        if cls.exists(directory, fields, file):
+            return cls.load(directory, fields)
+        return cls.build(file, directory, fields)
+
+    def line_positions(self):
+        return np.asarray(self.positions)
+
+    def rows(self, positions):
+        """
+        :return: rows of the lines at the given seek positions
+        """
+        rows = np.searchsorted(self.positions, positions)
+        assert np.all(np.asarray(self.positions)[rows] == positions), 'Unknown line position.'
+        return rows
+
+    def line(self, row):
+        """
+        :return: the line at the given row as a dict of its fields
+        """
+        return {field: decode_string(blob, offsets, row) for field, (blob, offsets) in self.columns.items()}
+
+    def read(self, positions):
+        """
+        Same as `JsonlReader.read`
+        """
+        return [self.line(row) for row in self.rows(np.asarray(positions, dtype=np.int64))]
+
+    def close(self):
+        pass
@@ -0,0 +1,81 @@
+import numpy as np
+
+
+def nearest_neighbours(embeddings, k=10, batch_size=1024):
+    """
+    Exact k nearest neighbours (cosine similarity) of every embedding among the others.
+    :param embeddings: float array of shape `items x dim`
+    :param k: number of neighbours
+    :param batch_size: number of items compared to all the others at once
+    :return: int64 array of shape `items x k`, the closest first
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    normalized = embeddings / np.maximum(norms, 1e-12)
+    k = min(k, len(embeddings) - 1)
+    neighbours = np.empty((len(embeddings), k), dtype=np.int64)
+    for start in range(0, len(embeddings), batch_size):
+        similarities = normalized[start:start + batch_size] @ normalized.T
+        # An item is not its own neighbour
+        similarities[np.arange(len(similarities)), np.arange(start, start + len(similarities))] = -np.inf
+        closest = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(similarities, closest, axis=1), axis=1)
+        neighbours[start:start + batch_size] = np.take_along_axis(closest, order, axis=1)
+    return neighbours
+
+
+class NegativeSampler:
+    """
+    Draws sentences (endings by default) of other stories of a `Dataloader` to build negative examples, for a whole
+    batch in one gather (see `Dataloader.get_sentences`).
+    Strategies:
+    - random: stories drawn uniformly
+    - hard negatives: if a `neighbours` table is given (e.g. from `nearest_neighbours` on the embeddings of the
+        endings, or from a `utils.AnnIndex`), the story of every line is drawn among the neighbours of this line. A
+        missing neighbour (id -1) gives a story drawn uniformly.
+    """
+
+    def __init__(self, dataloader, position=4, neighbours=None, random_state=None):
+        """
+        :param dataloader: Dataloader to draw the sentences from
+        :param position: position of the drawn sentence in the stories (4 for the endings)
+        :param neighbours: int array of shape `stories x k`, candidate stories for every story of the dataloader
+        :param random_state: np.random.RandomState. Default: the global numpy generator.
+        """
+        self.dataloader = dataloader
+        self.position = position
+        self.neighbours = neighbours
+        self.random_state = np.random if random_state is None else random_state
+
+    def sample_lines(self, line_indexes=None, n=1):
+        """
+        Draws stories
+        :param line_indexes: stories of the batch (`Data.line_indexes`), only used with the neighbours table
+        :param n: number of stories drawn per line of the batch, or in total without line_indexes
+        :return: int64 array of indexes of stories of shape `n` without line_indexes, else `lines x n`
+        """
+        if line_indexes is None:
+            return self.random_state.randint(0, len(self.dataloader), size=n)
+        n_lines = len(self.dataloader.line_range(line_indexes))
+        if self.neighbours is None:
+            return self.random_state.randint(0, len(self.dataloader), size=(n_lines, n))
+        candidates = self.neighbours[line_indexes]
+        columns = self.random_state.randint(0, candidates.shape[1], size=(n_lines, n))
+        lines = np.take_along_axis(candidates, columns, axis=1)
+        # Missing neighbours (-1, see `AnnIndex.neighbours`) are replaced by stories drawn uniformly
+        missing = lines < 0
+        if missing.any():
+            lines[missing] = self.random_state.randint(0, len(self.dataloader), size=np.count_nonzero(missing))
+        return lines
+
+    def sample(self, line_indexes=None, n=1, no_preprocess=False):
+        """
+        Draws sentences
+        :param line_indexes: see `NegativeSampler.sample_lines`
+        :param n: see `NegativeSampler.sample_lines`
+        :param no_preprocess: if True, the sentences are taken from the original lines
+        :return: the sentences, in the format of `Dataloader.get_sentences`. With line_indexes and n > 1, the sentences
+            are ordered line by line.
+        """
+        lines = self.sample_lines(line_indexes, n).reshape(-1)
+        return self.dataloader.get_sentences(lines, self.position, no_preprocess)
@@ -3,10 +3,9 @@ __credits__ = ["Benjamin Devillers (bdvllrs)"]
 __license__ = "GPL"
 
 import os
-import json
 import numpy as np
-import pickle
-from nltk import word_tokenize
+from .Vocab import load_word_list
+from .RecordFile import RecordFile
 
 
 class PPDataloader:
@@ -14,11 +13,12 @@ class PPDataloader:
 
     def __init__(self, file):
         """
-        :param file: relavite path to a jsonl file
+        :param file: relavite path to a file of pickled feature records, read with a `utils.RecordFile`
         """
         self.file = os.path.abspath(os.path.join(os.curdir, file))
-        self.features = []
-        self.original_features = []
+        self.records = None
+        self.order = None
+        self.packed = None
         self.output_fn = lambda w, x: x
         self.preprocess_fn = lambda w, x: x
         self.index_to_word = []
@@ -28,7 +28,7 @@ class PPDataloader:
         self.shuffle_lines()
 
     def __len__(self):
-        return len(self.original_features)
+        return len(self.records)
 
     def set_output_fn(self, output_fn):
         """
@@ -53,8 +53,7 @@ class PPDataloader:
         """
         print('Loading vocab...')
         file_path = os.path.abspath(os.path.join(os.path.curdir, file))
-        with open(file_path, 'rb') as file:
-            self.index_to_word = pickle.load(file)
+        self.index_to_word = load_word_list(file_path)[0]
         if size_percent is not None:
             size = int(len(self.index_to_word) * size_percent)
         self.index_to_word = self.index_to_word[:size]
@@ -64,52 +63,109 @@ class PPDataloader:
 
     def _get_line_positions(self):
         """
-        Get seek position of all new lines
+        Opens the records with their offset table, the records are only unpickled when they are fetched
         """
-        self.file_length = 0
-        with open(self.file, 'rb') as file:
-            while 1:
-                try:
-                    features = pickle.load(file)
-                except EOFError:
-                    break
-                self.features.append(features)
-        self.features = self.features[:]
-        self.original_features = self.features[:]
+        self.records = RecordFile.open(self.file)
+        self.order = np.arange(len(self.records))
+
+    def pack_features(self, topic_length=5):
+        """
+        Converts all the records once into fixed-shape arrays (load the vocab first). `get` then returns slices of
+        these arrays, `preprocess_fn` is not used anymore.
+        A record is a list of (sentiment, topic) features, one per sentence, and the label (int). The first word of a
+        topic is skipped, the others are converted to ids (<unk> if not in the vocab), sorted, and truncated or padded
+        with <pad> to `topic_length`.
+        :param topic_length: number of ids per topic
+        :return: (sentiments, topics, labels) float32 array of shape `records x sentences`, int32 array of shape
+            `records x sentences x topic_length` and int64 array of shape `records` (-1 without label)
+        """
+        unk_id, pad_id = self.word_to_index['<unk>'], self.word_to_index['<pad>']
+        sentiments, topic_words, topic_lengths, labels = [], [], [], []
+        for record in self.records.read(range(len(self.records))):
+            label = -1
+            for features in record:
+                if type(features) == int:
+                    label = features
+                else:
+                    sentiments.append(features[0])
+                    topic_words.extend(features[1][1:])
+                    topic_lengths.append(len(features[1][1:]))
+            labels.append(label)
+        n_records = len(labels)
+        n_sentences = len(sentiments) // n_records if n_records else 0
+
+        ids = np.array([self.word_to_index.get(word, unk_id) for word in topic_words], dtype=np.int32)
+        topic_lengths = np.array(topic_lengths, dtype=np.int64)
+        topic_of_word = np.repeat(np.arange(len(topic_lengths)), topic_lengths)
+        # Ids sorted in every topic, then the first topic_length of every topic are kept
+        order = np.lexsort((ids, topic_of_word))
+        position = np.arange(len(ids)) - np.repeat(np.cumsum(topic_lengths) - topic_lengths, topic_lengths)
+        kept = position < topic_length
+        topics = np.full((len(topic_lengths), topic_length), pad_id, dtype=np.int32)
+        topics[topic_of_word[kept], position[kept]] = ids[order][kept]
+
+        self.packed = (np.array(sentiments, dtype=np.float32).reshape(n_records, n_sentences),
+                       topics.reshape(n_records, n_sentences, topic_length), np.array(labels, dtype=np.int64))
+        return self.packed
+
+    def add_column(self, array):
+        """
+        Adds an array to the packed features (see `pack_features`), sliced like them in the batches.
+        :param array: array with one row per record
+        :return: position of the column in the batches
+        """
+        assert self.packed is not None, "Please pack the features first."
+        assert len(array) == len(self.records), "The array must have one row per record."
+        self.packed = self.packed + (array,)
+        return len(self.packed) - 1
+
+    def set_column(self, position, array):
+        """
+        Replaces a column added with `add_column`. The packed arrays are swapped at once, so a batch being built in
+        another thread (e.g. by a Keras generator queue) holds either the old or the new column, never a mix.
+        :param position: position returned by `add_column`
+        :param array: array with one row per record
+        """
+        assert len(array) == len(self.records), "The array must have one row per record."
+        self.packed = self.packed[:position] + (array,) + self.packed[position + 1:]
 
     def shuffle_lines(self):
         """
-        Shuffles the lines
+        Shuffles the lines (the order in which the records are fetched with random=True)
         :return:
         """
-        np.random.shuffle(self.features)
+        np.random.shuffle(self.order)
 
-    def get(self, item, count=1, random=False):
+    def get(self, item, count=1, random=False, raw=False):
         """
         Get some values from the dataset
         :param item: index of the value
         :param count: number of items to retrieve
         :param random: if random fetching
-        :return: the batch
-        """
-        batch = []
-        k = 0
-        while k < count:
-            index = (item + k) % len(self.features)
-            features = self.features[index] if random else self.original_features[index]
-            batch.append(self.preprocess_fn(self.word_to_index, features))
-            k += 1
-        return self.output_fn(self.word_to_index, batch)
+        :param raw: if True, output_fn is not applied
+        :return: the batch. With `pack_features`, the batch is a tuple (sentiments, topics, labels) of array slices.
+        """
+        indexes = (item + np.arange(count)) % len(self.records)
+        if random:
+            indexes = self.order[indexes]
+        packed = self.packed
+        if packed is not None:
+            batch = tuple(array[indexes] for array in packed)
+            return self.output_fn(self.word_to_index, batch) if not raw else batch
+        batch = [self.preprocess_fn(self.word_to_index, features) for features in self.records.read(indexes)]
+        return self.output_fn(self.word_to_index, batch) if not raw else batch
 
-    def get_batch(self, batch_size, n_epochs, random=True):
+    def get_batch(self, batch_size, n_epochs, random=True, raw=False):
         """
         Get a generator for batches
         :param batch_size:
         :param n_epochs:
         :param random:
+        :param raw: if True, yields the batches without applying output_fn (apply it later with
+            `functools.partial(loader.output_fn, loader.word_to_index)`, e.g. in a `utils.Prefetcher`)
         """
         for epoch in range(n_epochs):
             for k in range(0, len(self), batch_size):
-                yield self.get(k, batch_size, random)
+                yield self.get(k, batch_size, random, raw)
             self.shuffle_lines()
 
@@ -0,0 +1,162 @@
+import queue
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class _End:
+    """Put in the queue when the generator is exhausted"""
+
+
+class _Error:
+    """Put in the queue when the generator raised an exception"""
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def _seeded_call(map_fn, item, seed=None):
+    """
+    Applies map_fn to an item. If seed is given, map_fn also gets its own `np.random.RandomState` seeded with seed, so
+    the result only depends on the item and on the seed, whatever the other threads draw.
+    """
+    if seed is None:
+        return map_fn(item)
+    return map_fn(item, np.random.RandomState(seed % (2 ** 32)))
+
+
+class Prefetcher:
+    """
+    Builds the batches of a generator ahead of the consumer.
+    A background thread reads the generator and keeps at most `queue_size` batches in advance in a queue.
+    If `map_fn` is given, it is applied to every item of the generator by `n_workers` threads (or processes with
+    `use_processes=True`) and the results are yielded in the order of the generator. It is typically used to run
+    the output_fn of the loaders in parallel:
+    ```python
+    generator = Prefetcher(train_set.get_batch(batch_size, epochs, raw=True), map_fn=output_fn, n_workers=4)
+    ```
+    When `seed` is set, `map_fn` is called as `map_fn(item, random_state)` with a `np.random.RandomState` seeded with
+    `seed + index`, to use instead of the global `random` and `numpy.random` generators (e.g. the `random_state` of
+    `utils.add_noise`): the batches are then the same from one run to another, even with several workers. The order of
+    the generator itself comes from the generator (e.g. `Dataloader.bucket_sampler(batch_size, seed=seed)`).
+    Process workers need a picklable `map_fn` and items. The `Data` batches are sent to the processes without their
+    `dataloader` (see `Data.__getstate__`).
+    """
+
+    def __init__(self, generator, queue_size=8, map_fn=None, n_workers=1, use_processes=False, seed=None):
+        """
+        :param generator: iterable of the batches
+        :param queue_size: maximum number of batches prepared in advance
+        :param map_fn: function applied to every item of the generator
+        :param n_workers: number of workers applying map_fn
+        :param use_processes: if True, map_fn is applied by processes instead of threads
+        :param seed: seed of the random states given to map_fn
+        """
+        self.generator = iter(generator)
+        self.map_fn = map_fn
+        self.seed = seed
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.closed = False
+        self.executor = None
+        if map_fn is not None:
+            self.executor = ProcessPoolExecutor(n_workers) if use_processes else ThreadPoolExecutor(n_workers)
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def from_config(cls, generator, config, map_fn=None):
+        """
+        Uses the values of the `prefetch` config (queue_size, n_workers, use_processes and seed).
+        """
+        prefetch = config.prefetch
+        return cls(generator,
+                   queue_size=prefetch.queue_size if prefetch.is_set('queue_size') else 8,
+                   map_fn=map_fn,
+                   n_workers=prefetch.n_workers if prefetch.is_set('n_workers') else 1,
+                   use_processes=prefetch.use_processes if prefetch.is_set('use_processes') else False,
+                   seed=prefetch.seed if prefetch.is_set('seed') else None)
+
+    def _put(self, item):
+        """
+        Puts an item in the queue, gives up if the prefetcher is closed.
+        """
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self):
+        k = 0
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    item = next(self.generator)
+                except StopIteration:
+                    break
+                if self.executor is not None:
+                    seed = self.seed + k if self.seed is not None else None
+                    item = self.executor.submit(_seeded_call, self.map_fn, item, seed)
+                if not self._put(item):
+                    return
+                k += 1
+            self._put(_End())
+        except Exception as e:
+            self._put(_Error(e))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise StopIteration
+        item = self.queue.get()
+        if isinstance(item, _End):
+            self.close()
+            raise StopIteration
+        if isinstance(item, _Error):
+            self.close()
+            raise item.exception
+        if self.executor is not None:
+            try:
+                item = item.result()
+            except Exception:
+                self.close()
+                raise
+        return item
+
+    def close(self):
+        """
+        Stops the background thread and the workers. The batches already prepared are dropped.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.stop_event.set()
+        # Unblocks the producer if it is waiting for space in the queue
+        while self.thread.is_alive():
+            try:
+                item = self.queue.get(timeout=0.1)
+                if self.executor is not None and not isinstance(item, (_End, _Error)):
+                    item.cancel()
+            except queue.Empty:
+                pass
+        if self.executor is not None:
+            while not self.queue.empty():
+                item = self.queue.get()
+                if not isinstance(item, (_End, _Error)):
+                    item.cancel()
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, 'closed'):
+            self.close()
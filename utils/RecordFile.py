@@ -0,0 +1,112 @@
+import os
+import mmap
+import pickle
+import numpy as np
+
+
+def record_offsets(file):
+    """
+    Scans a file of pickled records (written one after the other with `pickle.dump`).
+    :param file: path of the file
+    :return: int64 array of the position of every record in the file, plus the end
+    """
+    offsets = [0]
+    with open(file, 'rb') as f:
+        while 1:
+            try:
+                pickle.load(f)
+            except EOFError:
+                break
+            offsets.append(f.tell())
+    return np.array(offsets, dtype=np.int64)
+
+
+class RecordFile:
+    """
+    Random access to the records of a file of pickled records, with an offset table saved next to it in
+    `<file>.index.npy`. The file is memory-mapped and a record is only unpickled when it is read, so the memory used
+    does not depend on the size of the file.
+    """
+
+    def __init__(self, file, offsets):
+        self.file = file
+        self.offsets = offsets
+        self.handle = None
+        self.map = None
+
+    def __getstate__(self):
+        # The memory map is opened again by every process
+        return {'file': self.file, 'offsets': self.offsets, 'handle': None, 'map': None}
+
+    @staticmethod
+    def index_path(file):
+        return file + '.index.npy'
+
+    @classmethod
+    def open(cls, file):
+        """
+        Opens the file with its offset table, scanning the file the first time or when it is more recent than the
+        table.
+        :param file: path of the file
+        """
+        index_file = cls.index_path(file)
+        if os.path.isfile(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(file):
+            return cls(file, np.load(index_file, mmap_mode='r'))
+        offsets = record_offsets(file)
+        cls.save_offsets(file, offsets)
+        return cls(file, offsets)
+
+    @classmethod
+    def write(cls, file, records):
+        """
+        Writes records and their offset table.
+        :param file: path of the file
+        :param records: iterable of picklable objects
+        """
+        offsets = [0]
+        with open(file, 'wb') as f:
+            for record in records:
+                pickle.dump(record, f)
+                offsets.append(f.tell())
+        offsets = np.array(offsets, dtype=np.int64)
+        cls.save_offsets(file, offsets)
+        return cls(file, offsets)
+
+    @classmethod
+    def save_offsets(cls, file, offsets):
+        # Written in a temporary file so that other processes never see a partial table
+        index_file = cls.index_path(file)
+        tmp_file = index_file + '.tmp-' + str(os.getpid()) + '.npy'
+        np.save(tmp_file, offsets)
+        os.replace(tmp_file, index_file)
+
+    def _open_map(self):
+        if self.map is None:
+            self.handle = open(self.file, 'rb')
+            size = os.fstat(self.handle.fileno()).st_size
+            self.map = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        return self.map
+
+    def close(self):
+        if self.map is not None and not isinstance(self.map, bytes):
+            self.map.close()
+        if self.handle is not None:
+            self.handle.close()
+        self.handle, self.map = None, None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, item):
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('Record index out of range.')
+        return pickle.loads(self._open_map()[self.offsets[item]:self.offsets[item + 1]])
+
+    def read(self, indexes):
+        """
+        :param indexes: indexes of the records
+        :return: list of the records, in the order of indexes
+        """
+        return [self[int(k)] for k in indexes]
@@ -0,0 +1,197 @@
+import os
+import shutil
+import numpy as np
+from .Corpus import Corpus, encode_words, decode_words
+from .JsonlReader import ColumnReader, decode_string
+from .tokenizer import tokenize_lines, TOKENIZER_VERSION
+from .Vocab import Vocab
+
+# Fields of the SNLI lines used by the scripts
+snli_fields = ['sentence1', 'sentence2', 'gold_label', 'pairID']
+# Code of every gold label in `SNLICache.labels`, lines without gold label ('-') having the code -1
+snli_labels = ['entailment', 'neutral', 'contradiction']
+
+
+class SNLICache(ColumnReader):
+    """
+    Pre-parsed copy of a SNLI jsonl file, built once and opened with `np.memmap`, so that the loaders start without
+    reading the json file.
+    On top of the string columns of a `ColumnReader`, the cache folder holds:
+    - labels.npy: (int8) code of the gold label of every line (see `snli_labels`)
+    - pairs.npy: (int64) rows of the neutral and contradiction lines sharing the same premise, of shape `pairs x 2`
+        (see `SNLIDataloaderPairs`)
+    - tokens/: `utils.Corpus` of the lines, one story per line with the tokenized premise and hypothesis. Only built
+        the first time the token ids are used (see `SNLICache.corpus`).
+    - tokenizer.npy: version of the tokenization of tokens/ (see `utils.tokenizer.TOKENIZER_VERSION`)
+    """
+
+    def __init__(self, positions, fields, columns, labels, pairs, directory=None, nthreads=1):
+        super().__init__(positions, fields, columns)
+        self.labels = labels
+        self.pairs = pairs
+        self.directory = directory
+        self.nthreads = nthreads
+        self._corpus = None
+
+    @classmethod
+    def build(cls, file, directory, fields=None, nthreads=1):
+        """
+        Parses the jsonl file once. The lines are tokenized later, when the token ids are first used.
+        :param file: path of the jsonl file
+        :param directory: path of the cache folder
+        :param fields: ignored, the fields are `snli_fields`
+        :param nthreads: number of processes used to tokenize
+        """
+        positions, values = cls.parse(file, snli_fields)
+        gold_labels, pair_ids = values[2], values[3]
+        label_codes = {label: k for k, label in enumerate(snli_labels)}
+        labels = np.array([label_codes.get(label, -1) for label in gold_labels], dtype=np.int8)
+
+        # Same grouping as the json scan of SNLIDataloaderPairs: the last line of a label wins
+        groups = {}
+        for row, (label, pair_id) in enumerate(zip(gold_labels, pair_ids)):
+            if label == '-':
+                continue
+            group = groups.setdefault(pair_id[:-1], [-1, -1])
+            if label == 'neutral':
+                group[0] = row
+            elif label == 'contradiction':
+                group[1] = row
+        pairs = np.array([group for group in groups.values() if min(group) >= 0], dtype=np.int64).reshape(-1, 2)
+
+        # Written in a temporary folder so that other processes never see a partial cache
+        tmp_directory = directory.rstrip(os.sep) + '.tmp-' + str(os.getpid())
+        os.makedirs(tmp_directory, exist_ok=True)
+        cls.save_columns(tmp_directory, positions, snli_fields, values)
+        np.save(os.path.join(tmp_directory, 'labels.npy'), labels)
+        np.save(os.path.join(tmp_directory, 'pairs.npy'), pairs)
+        cls.save_source(tmp_directory, file)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.rename(tmp_directory, directory)
+        return cls.load(directory, nthreads=nthreads)
+
+    @classmethod
+    def load(cls, directory, fields=None, nthreads=1):
+        """
+        Opens the arrays with `np.memmap`.
+        :param nthreads: number of processes used to tokenize the lines if tokens/ is not built yet
+        """
+        reader = ColumnReader.load(directory, snli_fields)
+        return cls(reader.positions, reader.fields, reader.columns,
+                   np.load(os.path.join(directory, 'labels.npy'), mmap_mode='r'),
+                   np.load(os.path.join(directory, 'pairs.npy'), mmap_mode='r'),
+                   directory, nthreads)
+
+    @classmethod
+    def exists(cls, directory, fields=None, file=None):
+        return ColumnReader.exists(directory, snli_fields, file) and \
+               os.path.isfile(os.path.join(directory, 'labels.npy')) and \
+               os.path.isfile(os.path.join(directory, 'pairs.npy'))
+
+    @staticmethod
+    def tokens_exist(directory):
+        """
+        :return: True if tokens/ was built with the current tokenization
+        """
+        tokenizer_file = os.path.join(directory, 'tokenizer.npy')
+        return Corpus.exists(os.path.join(directory, 'tokens')) and os.path.isfile(tokenizer_file) and \
+               decode_words(np.load(tokenizer_file)) == [TOKENIZER_VERSION]
+
+    @classmethod
+    def open(cls, file, directory, fields=None, nthreads=1):
+        """
+        Opens the cache of the jsonl file, building it the first time or when the file changed.
+        :param nthreads: number of processes used to tokenize the lines
+        """
+        if cls.exists(directory, file=file):
+            return cls.load(directory, nthreads=nthreads)
+        print('Building the SNLI cache of', file, '...')
+        return cls.build(file, directory, nthreads=nthreads)
+
+    @property
+    def corpus(self):
+        """
+        `utils.Corpus` of the tokenized lines, tokenized and saved in tokens/ the first time (or when the tokenization
+        changed).
+        """
+        if self._corpus is None:
+            if not self.tokens_exist(self.directory):
+                self.build_tokens()
+            self._corpus = Corpus.load(os.path.join(self.directory, 'tokens'))
+        return self._corpus
+
+    def build_tokens(self):
+        """
+        Tokenizes the premise and the hypothesis of every line into tokens/.
+        """
+        print('Tokenizing the SNLI cache', self.directory, '...')
+        premises, hypotheses = self.columns['sentence1'], self.columns['sentence2']
+        lines = [(decode_string(premises[0], premises[1], row), decode_string(hypotheses[0], hypotheses[1], row))
+                 for row in range(len(self.positions))]
+        corpus = Corpus.from_stories(tokenize_lines(lines, self.nthreads))
+        tokenizer_file = os.path.join(self.directory, 'tokenizer.npy')
+        # The version is removed first and written last: tokens/ is only used once both are up to date
+        if os.path.exists(tokenizer_file):
+            os.remove(tokenizer_file)
+        corpus.save(os.path.join(self.directory, 'tokens'))
+        tmp_file = tokenizer_file + '.tmp-' + str(os.getpid()) + '.npy'
+        np.save(tmp_file, encode_words([TOKENIZER_VERSION]))
+        os.replace(tmp_file, tokenizer_file)
+
+    def labeled_rows(self):
+        """
+        :return: rows of the lines with a gold label
+        """
+        return np.flatnonzero(np.asarray(self.labels) >= 0)
+
+    def label_positions(self, label):
+        """
+        :param label: a gold label of `snli_labels`
+        :return: seek positions of the lines with this gold label
+        """
+        return np.asarray(self.positions)[np.asarray(self.labels) == snli_labels.index(label)]
+
+    def pair_positions(self):
+        """
+        :return: seek positions of the neutral and contradiction lines of every pair, of shape `pairs x 2`
+        """
+        return np.asarray(self.positions)[np.asarray(self.pairs)]
+
+    def token_ids(self, rows, k):
+        """
+        :param rows: rows of the lines
+        :param k: 0 for the premise, 1 for the hypothesis
+        :return: list of int32 arrays of ids in `corpus.words`
+        """
+        sentence_offsets = self.corpus.sentence_offsets
+        sentences = np.asarray(self.corpus.story_offsets)[np.asarray(rows)] + k
+        return [self.corpus.tokens[sentence_offsets[i]:sentence_offsets[i + 1]] for i in sentences]
+
+    def count_words(self, rows):
+        """
+        Counts the tokens of some lines at once.
+        :param rows: rows of the lines counted
+        :return: utils.Vocab, the words in the order they are first seen
+        """
+        story_offsets = np.asarray(self.corpus.story_offsets)
+        sentence_offsets = np.asarray(self.corpus.sentence_offsets)
+        lengths = np.diff(sentence_offsets[story_offsets])
+        # The sentences of a line are contiguous in corpus.tokens
+        starts = sentence_offsets[story_offsets[:-1]][rows]
+        lengths = lengths[rows]
+        token_indexes = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+        tokens = np.asarray(self.corpus.tokens)[token_indexes]
+        counts = np.bincount(tokens, minlength=len(self.corpus.words))
+        seen_words, first_index = np.unique(tokens, return_index=True)
+        seen_words = seen_words[np.argsort(first_index)]
+        return Vocab(dict(zip([self.corpus.words[k] for k in seen_words], counts[seen_words].tolist())))
+
+    def sentences(self):
+        """
+        :return: iterator over the sentences (sentence1 and sentence2 strings) of the labeled lines
+        """
+        premises, hypotheses = self.columns['sentence1'], self.columns['sentence2']
+        for row in self.labeled_rows():
+            yield decode_string(premises[0], premises[1], row)
+            yield decode_string(hypotheses[0], hypotheses[1], row)
@@ -5,18 +5,89 @@ __license__ = "GPL"
 import os
 import json
 import numpy as np
-import pickle
-from nltk import word_tokenize
+from collections import Counter
+from multiprocessing import Pool
+from .Vocab import Vocab, load_word_list, save_word_list
+from .JsonlReader import JsonlReader
+from .tokenizer import tokenize_sentence
+from .SNLICache import SNLICache, snli_labels
+
+
+def snli_cache_path(file):
+    """
+    :return: default path of the `utils.SNLICache` of a jsonl file: `<file without extension>-cache`
+    """
+    return os.path.splitext(file)[0] + '-cache'
+
+
+def count_byte_range(task):
+    """
+    Counts the words of the labeled lines of a jsonl file starting in a byte range.
+    :param task: (file, start, end)
+    :return: Counter of the lowercased tokens of sentence1 and sentence2
+    """
+    file, start, end = task
+    counts = Counter()
+    with open(file, 'rb') as f:
+        if start > 0:
+            # The line going over start belongs to the previous range
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            json_line = json.loads(line)
+            if json_line['gold_label'] != '-':
+                counts.update(tokenize_sentence(json_line['sentence1']))
+                counts.update(tokenize_sentence(json_line['sentence2']))
+    return counts
+
+
+def count_snli_words(file, nthreads=None, n_ranges=None):
+    """
+    Counts the words of a SNLI jsonl file with a pool of processes: every process tokenizes and counts the lines of
+    byte ranges of the file, then the counts are merged in the order of the ranges.
+    :param file: path of the jsonl file
+    :param nthreads: number of processes. Default: number of cpus. If 1, the file is counted in the current process.
+    :param n_ranges: number of byte ranges. Default: 4 per process.
+    :return: utils.Vocab, can be merged with the counts of other datasets (e.g. `Dataloader.count_words`)
+    """
+    nthreads = os.cpu_count() if nthreads is None else nthreads
+    n_ranges = 4 * nthreads if n_ranges is None else n_ranges
+    bounds = np.linspace(0, os.path.getsize(file), n_ranges + 1).astype(np.int64)
+    tasks = [(file, start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+    vocab = Vocab()
+    if nthreads <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            vocab.counts.update(count_byte_range(task))
+        return vocab
+    with Pool(min(nthreads, len(tasks))) as pool:
+        # imap keeps the order of the ranges, so words are in the order they are first seen
+        for counts in pool.imap(count_byte_range, tasks):
+            vocab.counts.update(counts)
+    return vocab
 
 
 class SNLIDataloader:
     """SNLI Dataloader"""
 
-    def __init__(self, file, compute_vocab=False):
+    def __init__(self, file, compute_vocab=False, columns=None, nthreads=1):
         """
         :param file: relavite path to a jsonl file
+        :param columns: relative path of the pre-parsed cache of the file (see `utils.SNLICache`), built the first
+            time. Default: see `snli_cache_path`. If False, the json file is scanned and parsed at every start.
+        :param nthreads: number of processes used to tokenize the file (e.g. `config.nthreads`)
         """
         self.file = os.path.abspath(os.path.join(os.curdir, file))
+        self.nthreads = nthreads
+        if columns is False:
+            self.reader = JsonlReader(self.file)
+        else:
+            columns = snli_cache_path(self.file) if columns is None else os.path.abspath(os.path.join(os.curdir, columns))
+            self.reader = SNLICache.open(self.file, columns, nthreads=nthreads)
         self.line_positions_pos = []
         self.line_positions_neg = []
         self.original_line_positions_pos = []
@@ -25,9 +96,13 @@ class SNLIDataloader:
         self.preprocess_fn = lambda x: x
         self.index_to_word = []
         self.word_to_index = {}
+        self.vocab = None
 
-        self._get_line_positions(compute_vocab)
+        self._get_line_positions()
         self.shuffle_lines()
+        if compute_vocab:
+            self.compute_vocab()
+            self.save_vocab('snli_vocab.dat')
 
     def __len__(self):
         return len(self.line_positions_neg) + len(self.line_positions_pos)
@@ -48,19 +123,57 @@ class SNLIDataloader:
     def load_vocab(self, file, size=-1):
         print('Loading vocab...')
         file_path = os.path.abspath(os.path.join(os.path.curdir, file))
-        with open(file_path, 'rb') as file:
-            self.index_to_word = pickle.load(file)[:size]
+        self.index_to_word = load_word_list(file_path)[0][:size]
         for k, word in enumerate(self.index_to_word):
             self.word_to_index[word] = k
         print('Loaded.')
 
-    def _get_line_positions(self, compute_vocab=False):
+    def count_words(self, nthreads=None):
+        """
+        Counts the words of the sentences of the labeled lines, from the token ids of the cache or with
+        `count_snli_words`.
+        :param nthreads: number of processes used without cache. Default: the nthreads of the loader.
+        :return: utils.Vocab instance, can be merged with the counts of other datasets.
+        """
+        if isinstance(self.reader, SNLICache):
+            return self.reader.count_words(self.reader.labeled_rows())
+        return count_snli_words(self.file, self.nthreads if nthreads is None else nthreads)
+
+    def compute_vocab(self, min_count=1, max_size=None, vocab=None):
+        """
+        Compute the vocab, with the <unk> and <pad> tokens first
+        :param min_count: words seen less than `min_count` times are not kept
+        :param max_size: maximum size of the vocab (special tokens included). Default: all words.
+        :param vocab: utils.Vocab counts to use (e.g. merged with the counts of the Story Cloze dataset). Default: the
+            counts of this dataset.
+        """
+        self.vocab = vocab if vocab is not None else self.count_words()
+        self.index_to_word = self.vocab.index_to_word(['<unk>', '<pad>'], min_count, max_size)
+        self.word_to_index = {}
+        for k, word in enumerate(self.index_to_word):
+            self.word_to_index[word] = k
+
+    def save_vocab(self, file, size=-1):
+        """
+        Save vocab into a npz file (see `utils.Vocab.save_word_list`), the format of `Dataloader.save_vocab`
+        :param file: file location
+        :param size: size of the vocab. Default: all vocab
+        """
+        file_path = os.path.abspath(os.path.join(os.path.curdir, file))
+        index_to_word = self.index_to_word if size == -1 else self.index_to_word[:size]
+        counts = None
+        if self.vocab is not None:
+            counts = [self.vocab[word] for word in index_to_word]
+        save_word_list(file_path, index_to_word, counts)
+
+    def _get_line_positions(self):
         """
         Get seek position of all new lines
         """
+        if isinstance(self.reader, SNLICache):
+            self._get_cached_line_positions()
+            return
         self.file_length = 0
-        vocab = {}
-        special_tokens = ['<unk>', '<pad>']
         with open(self.file, 'r') as file:
             line_pos = file.tell()
             line = file.readline()
@@ -71,30 +184,38 @@ class SNLIDataloader:
                         self.line_positions_neg.append(line_pos)
                     else:
                         self.line_positions_pos.append(line_pos)
-                    if compute_vocab:
-                        sentences = json_line['sentence1'] + ' ' + json_line['sentence2']
-                        sentences = word_tokenize(sentences)
-                        for word in sentences:
-                            word = word.lower()
-                            if word in vocab.keys():
-                                vocab[word] += 1
-                            else:
-                                vocab[word] = 1
                 line_pos = file.tell()
                 line = file.readline()
-        if compute_vocab:
-            self.index_to_word = list(list(zip(*sorted(vocab.items(), key=lambda w: w[1], reverse=True)))[0])
-            self.index_to_word = [token for token in special_tokens] + self.index_to_word
-            for k, word in enumerate(self.index_to_word):
-                self.word_to_index[word] = k
-            file_path = os.path.abspath(os.path.join(os.path.curdir, 'snli_vocab.dat'))
-            with open(file_path, 'wb') as file:
-                pickle.dump(self.index_to_word, file)
         self.line_positions_pos = self.line_positions_pos[:]
         self.line_positions_neg = self.line_positions_neg[:]
         self.original_line_positions_pos = self.line_positions_pos[:]
         self.original_line_positions_neg = self.line_positions_neg[:]
 
+    def _get_cached_line_positions(self):
+        """
+        Same as `_get_line_positions` from the labels and tokens of the cache
+        """
+        labels = np.asarray(self.reader.labels)
+        contradiction = snli_labels.index('contradiction')
+        self.line_positions_neg = self.reader.label_positions('contradiction')
+        self.line_positions_pos = np.asarray(self.reader.positions)[(labels >= 0) & (labels != contradiction)]
+        self.original_line_positions_pos = self.line_positions_pos.copy()
+        self.original_line_positions_neg = self.line_positions_neg.copy()
+
+    def sentences(self):
+        """
+        :return: iterator over the sentences (sentence1 and sentence2 strings) of the labeled lines
+        """
+        if isinstance(self.reader, SNLICache):
+            yield from self.reader.sentences()
+            return
+        with open(self.file, 'r') as file:
+            for line in file:
+                json_line = json.loads(line)
+                if json_line['gold_label'] != '-':
+                    yield json_line['sentence1']
+                    yield json_line['sentence2']
+
     def shuffle_lines(self):
         """
         Shuffles the lines
@@ -103,44 +224,49 @@ class SNLIDataloader:
         np.random.shuffle(self.line_positions_pos)
         np.random.shuffle(self.line_positions_neg)
 
-    def get(self, item, count=1, random=False, only_contradiction=False):
+    def get(self, item, count=1, random=False, only_contradiction=False, raw=False):
         """
         Get some values from the dataset
         :param item: index of the value
         :param count: number of items to retrieve
         :param random: if random fetching
         :param only_contradiction: if True, only keeps the contradiction pairs
+        :param raw: if True, output_fn is not applied
         :return: the batch
         """
         batch = []
-        with open(self.file, 'r') as file:
-            k, j = 0, 0
-            while k < count:
+        k, j = 0, 0
+        while k < count:
+            # The lines still missing are read at once
+            positions = []
+            for _ in range(count - k):
                 if np.random.random() > 0.5:
                     index = (item + j) % len(self.line_positions_pos)
                     position = self.line_positions_pos[index] if random else self.original_line_positions_pos[index]
                 else:
                     index = (item + j) % len(self.line_positions_neg)
                     position = self.line_positions_neg[index] if random else self.original_line_positions_neg[index]
-                file.seek(position)
-                line = json.loads(file.readline())
+                positions.append(position)
+                j += 1
+            for line in self.reader.read(positions):
                 if not only_contradiction or line['gold_label'] == 'contradiction':
                     batch.append(self.preprocess_fn(line))
                     k += 1
-                j += 1
-        return self.output_fn(self.word_to_index, batch)
+        return self.output_fn(self.word_to_index, batch) if not raw else batch
 
-    def get_batch(self, batch_size, n_epochs, random=True, only_contradiction=False):
+    def get_batch(self, batch_size, n_epochs, random=True, only_contradiction=False, raw=False):
         """
         Get a generator for batches
         :param batch_size:
         :param n_epochs:
         :param random:
         :param only_contradiction: if True, only keeps contradiction pairs
+        :param raw: if True, yields the batches without applying output_fn (apply it later with
+            `functools.partial(loader.output_fn, loader.word_to_index)`, e.g. in a `utils.Prefetcher`)
         """
         for epoch in range(n_epochs):
             for k in range(0, len(self), batch_size):
-                yield self.get(k, batch_size, random, only_contradiction)
+                yield self.get(k, batch_size, random, only_contradiction, raw)
             self.shuffle_lines()
 
 
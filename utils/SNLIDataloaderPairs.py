@@ -5,18 +5,30 @@ __license__ = "GPL"
 import os
 import json
 import numpy as np
-import pickle
 from nltk import word_tokenize
+from .Vocab import load_word_list
+from .JsonlReader import JsonlReader
+from .SNLICache import SNLICache
+from .SNLIDataloader import snli_cache_path
 
 
 class SNLIDataloaderPairs:
     """SNLI Dataloader"""
 
-    def __init__(self, file):
+    def __init__(self, file, columns=None, nthreads=1):
         """
         :param file: relavite path to a jsonl file
+        :param columns: relative path of the pre-parsed cache of the file (see `utils.SNLICache`), built the first
+            time. Default: see `utils.SNLIDataloader.snli_cache_path`. If False, the json file is scanned and parsed
+            at every start.
+        :param nthreads: number of processes used to tokenize the file (e.g. `config.nthreads`)
         """
         self.file = os.path.abspath(os.path.join(os.curdir, file))
+        if columns is False:
+            self.reader = JsonlReader(self.file)
+        else:
+            columns = snli_cache_path(self.file) if columns is None else os.path.abspath(os.path.join(os.curdir, columns))
+            self.reader = SNLICache.open(self.file, columns, nthreads=nthreads)
         self.line_positions_pos = []
         self.line_positions_neg = []
         self.line_positions = []
@@ -48,8 +60,7 @@ class SNLIDataloaderPairs:
     def load_vocab(self, file, size=-1):
         print('Loading vocab...')
         file_path = os.path.abspath(os.path.join(os.path.curdir, file))
-        with open(file_path, 'rb') as file:
-            self.index_to_word = pickle.load(file)[:size]
+        self.index_to_word = load_word_list(file_path)[0][:size]
         for k, word in enumerate(self.index_to_word):
             self.word_to_index[word] = k
         print('Loaded.')
@@ -57,7 +68,12 @@ class SNLIDataloaderPairs:
     def _get_line_positions(self):
         """
         Get seek position of all new lines
+        self.line_positions holds the positions of the neutral and contradiction lines of every pair
         """
+        if isinstance(self.reader, SNLICache):
+            self.line_positions = self.reader.pair_positions()
+            self.lines_id = list(range(len(self.line_positions)))
+            return
         positions = {}
         with open(self.file, 'r') as file:
             line_pos = file.tell()
@@ -76,9 +92,24 @@ class SNLIDataloaderPairs:
                 line = file.readline()
         for position in positions.values():
             if position['pos'] is not None and position['neg'] is not None:
-                self.line_positions.append(position)
+                self.line_positions.append([position['pos'], position['neg']])
+        self.line_positions = np.array(self.line_positions, dtype=np.int64).reshape(-1, 2)
         self.lines_id = list(range(len(self.line_positions)))
 
+    def sentences(self):
+        """
+        :return: iterator over the sentences (sentence1 and sentence2 strings) of the labeled lines
+        """
+        if isinstance(self.reader, SNLICache):
+            yield from self.reader.sentences()
+            return
+        with open(self.file, 'r') as file:
+            for line in file:
+                json_line = json.loads(line)
+                if json_line['gold_label'] != '-':
+                    yield json_line['sentence1']
+                    yield json_line['sentence2']
+
     def shuffle_lines(self):
         """
         Shuffles the lines
@@ -86,39 +117,36 @@ class SNLIDataloaderPairs:
         """
         np.random.shuffle(self.lines_id)
 
-    def get(self, item, count=1, random=False):
+    def get(self, item, count=1, random=False, raw=False):
         """
         Get some values from the dataset
         :param item: index of the value
         :param count: number of items to retrieve
         :param random: if random fetching
+        :param raw: if True, output_fn is not applied
         :return: the batch
         """
+        indexes = (item + np.arange(count)) % len(self.line_positions)
+        if random:
+            indexes = np.asarray(self.lines_id)[indexes]
+        # All the lines of the batch are read at once, the neutral line then the contradiction line of every pair
+        lines = self.reader.read(self.line_positions[indexes].reshape(-1))
         batch = []
-        with open(self.file, 'r') as file:
-            k = 0
-            while k < count:
-                index = (item + k) % len(self.line_positions)
-                positions = self.line_positions[self.lines_id[index]] if random else self.line_positions[index]
-                position_pos = positions['pos']
-                position_neg = positions['neg']
-                file.seek(position_pos)
-                line_pos = json.loads(file.readline())
-                file.seek(position_neg)
-                line_neg = json.loads(file.readline())
-                batch.append([self.preprocess_fn(line_pos), self.preprocess_fn(line_neg)])
-                k += 1
-        return self.output_fn(self.word_to_index, batch)
+        for k in range(count):
+            batch.append([self.preprocess_fn(lines[2 * k]), self.preprocess_fn(lines[2 * k + 1])])
+        return self.output_fn(self.word_to_index, batch) if not raw else batch
 
-    def get_batch(self, batch_size, n_epochs, random=True):
+    def get_batch(self, batch_size, n_epochs, random=True, raw=False):
         """
         Get a generator for batches
         :param batch_size:
         :param n_epochs:
         :param random:
+        :param raw: if True, yields the batches without applying output_fn (apply it later with
+            `functools.partial(loader.output_fn, loader.word_to_index)`, e.g. in a `utils.Prefetcher`)
         """
         for epoch in range(n_epochs):
             for k in range(0, len(self), batch_size):
-                yield self.get(k, batch_size, random)
+                yield self.get(k, batch_size, random, raw)
             self.shuffle_lines()
 
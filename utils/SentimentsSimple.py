@@ -3,53 +3,97 @@ __credits__ = ["Benjamin Devillers (bdvllrs)"]
 __license__ = "GPL"
 
 import os
+import numpy as np
+from .Corpus import encode_words, decode_words
+
+
+def parse_lexicon(file):
+    """
+    Parses a SentiWordNet file. Only the adjectives (lines starting with 'a') are kept, the score of a word being the
+    average of the scores of all its synsets.
+    :param file: path of the SentiWordNet file
+    :return: (words, scores) list of words in the order they are first seen and float64 array of shape `words x 2`
+        with the positive and negative scores
+    """
+    word_to_index = {}
+    word_ids, pos_scores, neg_scores = [], [], []
+    with open(file, 'r') as f:
+        for line in f:
+            if line[0] == 'a':
+                line = line.split('\t')
+                pos_score, neg_score = float(line[2]), float(line[3])
+                for word in line[4].split(' '):
+                    word_ids.append(word_to_index.setdefault(word.split('#')[0], len(word_to_index)))
+                    pos_scores.append(pos_score)
+                    neg_scores.append(neg_score)
+    counts = np.bincount(word_ids, minlength=len(word_to_index))
+    scores = np.stack([np.bincount(word_ids, pos_scores, len(word_to_index)),
+                       np.bincount(word_ids, neg_scores, len(word_to_index))], axis=1) / np.maximum(counts, 1)[:, None]
+    return list(word_to_index.keys()), scores
+
+
+def lexicon_binary_path(file):
+    """
+    :return: path of the binary cache of a SentiWordNet file: `<file>.npz`
+    """
+    return file + '.npz'
+
+
+def load_lexicon(file):
+    """
+    Loads a SentiWordNet file from its binary cache, parsing it first if the cache does not exist or is older.
+    :param file: path of the SentiWordNet file
+    :return: see `parse_lexicon`
+    """
+    binary_file = lexicon_binary_path(file)
+    if os.path.isfile(binary_file) and os.path.getmtime(binary_file) >= os.path.getmtime(file):
+        with np.load(binary_file) as data:
+            return decode_words(data['words']), data['scores']
+    words, scores = parse_lexicon(file)
+    # Written in a temporary file so that other processes never see a partial cache
+    tmp_file = binary_file + '.tmp-' + str(os.getpid())
+    with open(tmp_file, 'wb') as f:
+        np.savez(f, words=encode_words(words), scores=scores)
+    os.replace(tmp_file, binary_file)
+    return words, scores
 
 
 class SentimentsSimple:
+    """
+    SentiWordNet lexicon: a word -> (positive, negative) score table.
+    properties:
+    - index_to_word: words of the lexicon
+    - word_to_index: row of every word in `scores`
+    - scores: float64 array of shape `words x 2` with the positive and negative scores
+    """
+
     def __init__(self, config, sentiment_file):
         self.config = config
         self.sentiment_file = sentiment_file
-        self.words = {}
+        self.index_to_word = []
+        self.word_to_index = {}
+        self.scores = np.zeros((0, 2))
+        self._score_table = None
         self.open_file()
 
     def open_file(self):
         path = os.path.abspath(os.path.join(os.curdir, self.sentiment_file))
         if self.config.debug:
             print("Loading sentiment informations.")
-        with open(path, 'r') as file:
-            line = file.readline()
-            while line:
-                if line[0] == 'a':
-                    line = line.split('\t')
-                    pos_score, neg_score, words = line[2], line[3], line[4].split(' ')
-                    for word in words:
-                        word = word.split('#')
-                        if len(word) > 0:
-                            word = word[0]
-                            if word in self.words.keys():
-                                self.words[word]['pos'] = (self.words[word]['count'] * self.words[word]['pos'] + float(
-                                    pos_score)) / (self.words[word]['count'] + 1)
-                                self.words[word]['neg'] = (self.words[word]['count'] * self.words[word]['neg'] + float(
-                                    neg_score)) / (self.words[word]['count'] + 1)
-                                self.words[word]['count'] += 1
-                            else:
-                                self.words[word] = {
-                                    'pos': float(pos_score),
-                                    'neg': float(neg_score),
-                                    'count': 1
-                                }
-                line = file.readline()
+        self.index_to_word, self.scores = load_lexicon(path)
+        self.word_to_index = {word: k for k, word in enumerate(self.index_to_word)}
+        self._score_table = None
         if self.config.debug:
-            print(len(self.words.keys()), 'words loaded.')
+            print(len(self.index_to_word), 'words loaded.')
 
     def pos_score(self, word):
-        if word in self.words.keys():
-            return self.words[word]['pos']
+        if word in self.word_to_index:
+            return self.scores[self.word_to_index[word], 0]
         return 0
 
     def neg_score(self, word):
-        if word in self.words.keys():
-            return self.words[word]['neg']
+        if word in self.word_to_index:
+            return self.scores[self.word_to_index[word], 1]
         return 0
 
     def sentence_score(self, sentence):
@@ -60,6 +104,52 @@ class SentimentsSimple:
         pos_score = 0
         neg_score = 0
         for word in sentence:
-            pos_score += self.pos_score(word)
-            neg_score += self.neg_score(word)
+            row = self.word_to_index.get(word)
+            if row is not None:
+                pos_score += self.scores[row, 0]
+                neg_score += self.scores[row, 1]
         return pos_score - neg_score
+
+    def score_table(self, index_to_word):
+        """
+        Positive and negative scores of the words of a vocabulary, 0 for the words not in the lexicon.
+        The table of the last vocabulary is kept.
+        :param index_to_word: list of words (e.g. `Dataloader.index_to_word` or `Corpus.words`)
+        :return: float64 array of shape `vocab x 2`
+        """
+        if self._score_table is None or self._score_table[0] is not index_to_word:
+            rows = np.array([self.word_to_index.get(word, -1) for word in index_to_word], dtype=np.int64)
+            table = np.where((rows >= 0)[:, None], self.scores[np.maximum(rows, 0)], 0.) if len(self.scores) else \
+                np.zeros((len(rows), 2))
+            self._score_table = (index_to_word, table)
+        return self._score_table[1]
+
+    def corpus_scores(self, corpus):
+        """
+        Scores of all the sentences of a compiled corpus at once (same as `sentence_score`).
+        :param corpus: utils.Corpus
+        :return: float64 array with the score of every sentence of the corpus
+        """
+        table = self.score_table(corpus.words)
+        tokens = np.asarray(corpus.tokens)
+        sentence_lengths = corpus.sentence_lengths()
+        token_sentence = np.repeat(np.arange(len(sentence_lengths)), sentence_lengths)
+        # Positive and negative scores summed separately, in the order of the words, as in `sentence_score`
+        return np.bincount(token_sentence, table[tokens, 0], len(sentence_lengths)) - \
+               np.bincount(token_sentence, table[tokens, 1], len(sentence_lengths))
+
+    def batch_score(self, ids, index_to_word, lengths=None):
+        """
+        Scores of whole batches of id-encoded sentences at once (same as `sentence_score`).
+        :param ids: int array of shape `... x max_length` of ids in index_to_word
+        :param index_to_word: vocabulary of the ids
+        :param lengths: length of every sentence, of shape `...`. Default: all the ids are scored (the padding must
+            then be a word out of the lexicon)
+        :return: float64 array of shape `...`
+        """
+        ids = np.asarray(ids)
+        scores = self.score_table(index_to_word)[ids]
+        if lengths is not None:
+            scores = scores * (np.arange(ids.shape[-1]) < np.asarray(lengths)[..., None])[..., None]
+        scores = scores.sum(axis=-2)
+        return scores[..., 0] - scores[..., 1]
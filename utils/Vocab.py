@@ -0,0 +1,126 @@
+import pickle
+import numpy as np
+from collections import Counter
+from .Corpus import Corpus, encode_words, decode_words
+
+
+def save_word_list(file, words, counts=None):
+    """
+    Saves a list of words in a npz file: the words packed as utf-8 bytes and their counts.
+    :param file: path to the file
+    :param words: list of words
+    :param counts: count of every word. Default: zeros.
+    """
+    if counts is None:
+        counts = np.zeros(len(words), dtype=np.int64)
+    with open(file, 'wb') as f:
+        np.savez(f, words=encode_words(words), counts=np.array(counts, dtype=np.int64))
+
+
+def load_word_list(file):
+    """
+    Loads a list of words saved by `save_word_list`, or a pickled list of words (old vocab files).
+    :param file: path to the file
+    :return: (words, counts) where counts is None for pickled lists.
+    """
+    with open(file, 'rb') as f:
+        is_npz = f.read(2) == b'PK'
+        f.seek(0)
+        if not is_npz:
+            return pickle.load(f), None
+        data = np.load(f)
+        return decode_words(data['words']), data['counts']
+
+
+class Vocab:
+    """
+    Word counter used to build vocabularies.
+    Counts can be accumulated over several corpora (tokenized stories, compiled corpora, text files...) or merged
+    with other Vocab instances, then turned into an `index_to_word` list with frequency and size cutoffs.
+    The words are sorted by decreasing count, words with the same count are kept in the order they were first seen.
+    """
+
+    def __init__(self, counts=None):
+        self.counts = Counter()
+        if counts is not None:
+            self.counts.update(counts)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getitem__(self, word):
+        return self.counts[word]
+
+    def add_sentences(self, sentences):
+        """
+        :param sentences: iterable of tokenized sentences
+        """
+        for sentence in sentences:
+            self.counts.update(sentence)
+        return self
+
+    def add_stories(self, stories):
+        """
+        :param stories: iterable of stories, a story being a list of tokenized sentences
+        """
+        for story in stories:
+            self.add_sentences(story)
+        return self
+
+    def add_corpus(self, corpus: Corpus):
+        """
+        Counts all the tokens of a compiled corpus at once.
+        """
+        counts = np.bincount(corpus.tokens, minlength=len(corpus.words))
+        self.counts.update(dict(zip(corpus.words, counts.tolist())))
+        return self
+
+    def add_text_file(self, file):
+        """
+        Counts the words of a text file with one tokenized sentence per line (words separated by spaces).
+        """
+        with open(file, 'r') as f:
+            for line in f:
+                self.counts.update(line.split())
+        return self
+
+    def merge(self, vocab):
+        """
+        Adds the counts of another Vocab.
+        """
+        self.counts.update(vocab.counts)
+        return self
+
+    def index_to_word(self, special_tokens=(), min_count=1, max_size=None):
+        """
+        Builds the vocabulary
+        :param special_tokens: tokens put at the beginning of the vocabulary (not counted)
+        :param min_count: words seen less than `min_count` times are removed
+        :param max_size: maximum size of the vocabulary (with the special tokens). Default: no limit.
+        :return: list of words
+        """
+        words = [word for word, count in self.counts.items() if count >= min_count and word not in special_tokens]
+        words = sorted(words, key=lambda w: self.counts[w], reverse=True)
+        index_to_word = list(special_tokens) + words
+        if max_size is not None:
+            index_to_word = index_to_word[:max_size]
+        return index_to_word
+
+    def save(self, file, special_tokens=(), min_count=1, max_size=None):
+        """
+        Saves the vocabulary (see `Vocab.index_to_word`) with the counts of the words.
+        """
+        index_to_word = self.index_to_word(special_tokens, min_count, max_size)
+        save_word_list(file, index_to_word, [self.counts[word] for word in index_to_word])
+
+    @classmethod
+    def load(cls, file):
+        """
+        Loads counts saved with `Vocab.save`. Pickled lists of words give counts of 0.
+        """
+        words, counts = load_word_list(file)
+        if counts is None:
+            counts = np.zeros(len(words), dtype=np.int64)
+        vocab = cls()
+        vocab.counts.update(dict(zip(words, counts.tolist())))
+        return vocab
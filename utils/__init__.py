@@ -2,8 +2,20 @@ from .utils import load_embedding, train_test
 from .Config import Config
 from .SentimentsSimple import SentimentsSimple
 from .Sentiments import Sentiments
+from .Corpus import Corpus
 from .Dataloader import Dataloader, Data
 from .PPDataloader import PPDataloader
-from .SNLIDataloader import SNLIDataloader
+from .RecordFile import RecordFile
+from .SNLIDataloader import SNLIDataloader, count_snli_words
 from .SNLIDataloaderPairs import SNLIDataloaderPairs
+from .JsonlReader import JsonlReader, ColumnReader
+from .SNLICache import SNLICache
 from .Discriminator import Discriminator
+from .Prefetcher import Prefetcher
+from .BucketSampler import BucketSampler
+from .NegativeSampler import NegativeSampler, nearest_neighbours
+from .AnnIndex import AnnIndex, brute_force_search
+from .EncoderCache import EncoderCache
+from .noise import add_noise, noise_ids
+from .EmbeddingStore import EmbeddingStore, EmbeddedOutputFn, sent2vec_store
+from .HubEmbedder import HubEmbedder, embedding_types, hub_precompute, hub_store, elmo_sentences
@@ -0,0 +1,51 @@
+import numpy as np
+
+
+def noise_ids(ids, lengths, drop_probability=0.1, shuffle_max_distance=3, random_state=None, pad_id=0):
+    """
+    Word dropout and local shuffle of a padded batch of sentences, the last word of every sentence (the final
+    punctuation) being kept in place.
+    Every other word is dropped with probability `drop_probability`, then the remaining words are sorted by the key
+    `position + (shuffle_max_distance + 1) * u` with `u` uniform in [0, 1), so a word moves by at most
+    `shuffle_max_distance` positions.
+    :param ids: array of shape `sentences x max_length` (ids or tokens)
+    :param lengths: length of every sentence
+    :param drop_probability:
+    :param shuffle_max_distance:
+    :param random_state: np.random.RandomState. Default: the global numpy generator.
+    :param pad_id: value of the padding of the returned batch
+    :return: (ids, lengths) the noised batch, with the same shape, and the new lengths
+    """
+    random_state = np.random if random_state is None else random_state
+    ids = np.asarray(ids)
+    lengths = np.asarray(lengths)
+    positions = np.arange(ids.shape[1])[None, :]
+    body = positions < (lengths - 1)[:, None]
+    kept = body & (random_state.random_sample(ids.shape) >= drop_probability)
+    # Position of the kept words once the dropped ones are removed
+    keys = np.cumsum(kept, axis=1) - 1 + (shuffle_max_distance + 1) * random_state.random_sample(ids.shape)
+    # The last word goes after the kept words and the dropped words and padding at the end
+    keys[~kept] = np.inf
+    keys[positions == (lengths - 1)[:, None]] = ids.shape[1] * (shuffle_max_distance + 2)
+    order = np.argsort(keys, axis=1, kind='stable')
+    new_lengths = np.where(lengths > 0, kept.sum(axis=1) + 1, 0)
+    noised = np.take_along_axis(ids, order, axis=1)
+    noised[positions >= new_lengths[:, None]] = pad_id
+    return noised, new_lengths
+
+
+def add_noise(sentences, drop_probability=0.1, shuffle_max_distance=3, random_state=None):
+    """
+    Applies `noise_ids` to tokenized sentences.
+    :param sentences: list or array of sentences (list of words)
+    :return: array of the noised sentences (arrays of words)
+    """
+    lengths = np.array([len(sentence) for sentence in sentences], dtype=np.int64)
+    tokens = np.empty((len(sentences), lengths.max() if len(sentences) else 0), dtype=object)
+    for k, sentence in enumerate(sentences):
+        tokens[k, :lengths[k]] = list(sentence)
+    tokens, lengths = noise_ids(tokens, lengths, drop_probability, shuffle_max_distance, random_state, pad_id=None)
+    noised = np.empty(len(sentences), dtype=object)
+    for k in range(len(sentences)):
+        noised[k] = tokens[k, :lengths[k]].astype(str)
+    return noised
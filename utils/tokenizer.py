@@ -0,0 +1,43 @@
+from multiprocessing import Pool
+from nltk import word_tokenize
+
+# Change it when the tokenization changes: it invalidates the corpora cached with the previous one.
+TOKENIZER_VERSION = 'word_tokenize-lower-1'
+
+
+def tokenize_sentence(sentence):
+    return word_tokenize(sentence.lower())
+
+
+def tokenize_chunk(lines):
+    """
+    Tokenizes a list of lines, a line being a list of sentences.
+    """
+    return [list(map(tokenize_sentence, line)) for line in lines]
+
+
+def tokenize_lines(lines, nthreads=1, chunk_size=1000, progress_fn=None):
+    """
+    Tokenizes every sentence of every line with a pool of processes.
+    The lines are split in chunks of `chunk_size` lines, the order of the lines is kept.
+    :param lines: list of lines, a line being a list of sentences (strings)
+    :param nthreads: number of processes. If 1, the lines are tokenized in the current process.
+    :param chunk_size: number of lines sent to a process at once
+    :param progress_fn: callback called with the number of lines of every tokenized chunk
+    :return: list of lines, a line being a list of tokenized sentences (list of words)
+    """
+    chunks = [lines[k:k + chunk_size] for k in range(0, len(lines), chunk_size)]
+    tokenized = []
+    if nthreads is None or nthreads <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            tokenized.extend(tokenize_chunk(chunk))
+            if progress_fn is not None:
+                progress_fn(len(chunk))
+        return tokenized
+    with Pool(min(nthreads, len(chunks))) as pool:
+        # imap keeps the order of the chunks
+        for chunk in pool.imap(tokenize_chunk, chunks):
+            tokenized.extend(chunk)
+            if progress_fn is not None:
+                progress_fn(len(chunk))
+    return tokenized